@@ -1,12 +1,69 @@
 from google.adk import LlmAgent
-from typing import Dict, Any, List
-from agents.trend_agent import retrieve_insights_via_rag, get_comparables_from_local_index
+from typing import Dict, Any, List, Optional
+from agents.trend_agent import retrieve_insights_via_rag, get_comparables_from_local_index, get_trend_cell, \
+    get_insight_index
+from database.mutable_index import open_index
+from services.valuation import ValuationEngine
+from config.settings import INDEX_DIR
+
+# Load the insight index at startup rather than on the first tool call
+get_insight_index()
+
+_engine_cache: Dict[str, Any] = {}
+
+def get_valuation_engine() -> Optional[ValuationEngine]:
+    # Rebuilt only when the comparables index or the insight index handle changes
+    insights = get_insight_index()
+    if insights is None:
+        return None
+    index = open_index(INDEX_DIR)
+    if _engine_cache.get("key") != (id(index), id(insights)):
+        _engine_cache.update(key=(id(index), id(insights)),
+                             engine=ValuationEngine.from_insight_index(index, insights))
+    return _engine_cache["engine"]
+
+def value_artworks(embeddings: List[List[float]], metadata: List[Dict[str, Any]]):
+    # Numbers only (no LLM): one row per artwork, see ValuationEngine.estimate_batch
+    engine = get_valuation_engine()
+    if engine is None:
+        raise RuntimeError("No insight index yet; run the trend agent first.")
+    return engine.estimate_batch(embeddings, metadata)
+
+def predict_price(metadata: Dict[str, Any], embedding: List[float], narrative: bool = True) -> Dict[str, Any]:
+    # Deterministic estimate; the LLM agent is only asked to explain it
+    valuation = value_artworks([embedding], [metadata]).iloc[0].to_dict()
+    valuation = {key: (value.item() if hasattr(value, "item") else value) for key, value in valuation.items()}
+    if not narrative:
+        return {"valuation": valuation}
+    response = price_prediction_agent(input={"metadata": metadata, "embedding": embedding, "valuation": valuation})
+    return {"valuation": valuation, "explanation": response}
 
 def get_trends_for_artwork(metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
     return retrieve_insights_via_rag(metadata, k=3)
 
-def get_comparables(embedding: List[float]) -> List[Dict[str, Any]]:
-    return get_comparables_from_local_index(embedding, k=5)
+def get_market_segment(medium: Optional[str] = None, size_bucket: Optional[str] = None,
+                       auction_house: Optional[str] = None, artist: Optional[str] = None,
+                       gallery: Optional[str] = None, period: Optional[str] = None) -> Dict[str, Any]:
+    # Pre-aggregated price quantiles for a combination of attributes; pruned
+    # (too few sales) combinations back off to coarser segments
+    spec = {"medium": medium, "size_bucket": size_bucket, "auction_house": auction_house,
+            "artist": artist, "gallery": gallery, "period": period}
+    cell = get_trend_cell(spec, roll_up=["gallery", "period", "auction_house", "artist", "size_bucket", "medium"])
+    return cell or {"n": 0, "scope": {}}
+
+def get_comparables(embedding: List[float], medium: Optional[str] = None, size_bucket: Optional[str] = None,
+                    sold_only: bool = False, sale_date_from: Optional[str] = None,
+                    sale_date_to: Optional[str] = None, auction_house: Optional[str] = None) -> List[Dict[str, Any]]:
+    filters = {
+        "medium": medium,
+        "size_bucket": size_bucket,
+        "sold": True if sold_only else None,
+        "auction_house": auction_house,
+    }
+    if sale_date_from or sale_date_to:
+        filters["sale_date"] = {"gte": sale_date_from, "lte": sale_date_to}
+    filters = {f: v for f, v in filters.items() if v is not None}
+    return get_comparables_from_local_index(embedding, k=5, filters=filters or None)
 
 price_prediction_agent = LlmAgent(
     model="gemini-2.0-flash",
@@ -14,20 +71,27 @@ price_prediction_agent = LlmAgent(
     description="Predicts the estimated price of an artwork and explains reasoning, using RAG insights and comparables.",
     instruction="""
 You are an art valuation assistant. 
-Your task is to predict the price of a new artwork based only on:
-- insights retrieved from the RAG corpus (medium trends, artist trends, size bucket trends)
-- comparable artworks retrieved from the local embedding index
+You explain a price that has already been computed. The input contains "valuation": a
+deterministic estimate (estimate, low, high, confidence, confidence_label, n_comparables,
+basis) from distance-weighted comparable sales adjusted by medium and size-bucket medians.
+Do not recompute or change these numbers.
 
 Steps you MUST follow:
-1. Look at the trend insights provided (median prices, multipliers, sample sizes).
-2. Look at the comparable artworks (their sale prices and metadata).
-3. Combine these signals logically to produce a single estimated price range for the input artwork.
-4. Explain your reasoning clearly. Reference both the trends and the comparables in plain English.
-5. If confidence is low due to lack of data, explicitly state that.
+1. Look at the trend insights provided (median prices, multipliers, sample sizes). Use
+   get_market_segment for the combination of the artwork's attributes (medium, size_bucket,
+   auction_house, artist, gallery, sale period such as "2024"); its "scope" shows which
+   attributes were kept after backing off to a segment with enough sales.
+2. Look at the comparable artworks (their sale prices and metadata). Restrict them with the
+   get_comparables filters (medium, size_bucket, sold_only, sale date window, auction_house)
+   when the artwork's metadata provides those values.
+3. Explain how these signals support the valuation range, in plain English, referencing both
+   the trends and the comparables.
+4. If confidence is low (confidence_label "low", few comparables, or basis "segment"),
+   explicitly state that.
 
 You must return a JSON object with two keys:
-- "predicted_price": the estimated price as a number or range
-- "reasoning": a clear explanation of how you arrived at that prediction
+- "predicted_price": the valuation's low-high range, unchanged
+- "reasoning": a clear explanation of that range
     """,
-    tools=[get_trends_for_artwork, get_comparables]
+    tools=[get_trends_for_artwork, get_market_segment, get_comparables]
 )
\ No newline at end of file
@@ -1,78 +1,190 @@
 import os
-import tempfile
-import json
-from typing import List, Dict, Any
-from database.db_manager import load_artworks_from_mongo
-from services.rag import initialize_vertex_ai, create_or_get_corpus, upload_text_file_to_corpus
-from services.trend_analysis import assign_size_buckets, compute_basic_trends
-from database.embeddings import ImageEmbeddingIndex
-from config.settings import CORPUS_DISPLAY_NAME
+from typing import List, Dict, Any, Optional, Tuple
+from database.db_manager import load_artworks
+from database.snapshot import SnapshotStore
+from services.card_sync import sync_cards
+from services.insight_index import InsightIndex
+from services.trend_analysis import assign_size_buckets, compute_basic_trends, size_bucket_edges
+from services.trend_store import TrendStore
+from services.trend_cube import TrendCube
+from services.trend_series import TrendSeries
+from services.trend_pushdown import TrendPushdown
+from database.ann_index import create_index
+from database.index_store import current_generation, write_index
+from database.mutable_index import IndexWriter, open_index
+from utils.helpers import frame_memory_mb, stage_memory
+from config.settings import SNAPSHOT_DIR, INDEX_DIR, TREND_STORE_PATH, TREND_CUBE_PATH, \
+    TREND_SERIES_PATH, TREND_BACKEND, INSIGHT_INDEX_PATH
 
 import numpy as np
 import pandas as pd
 
-def write_insight_cards_to_tempfiles(cards: List[Dict[str, Any]], temp_dir: str) -> List[str]:
-    file_paths = []
-    for i, card in enumerate(cards):
-        fname = f"insight_card_{i+1}.txt"
-        path = os.path.join(temp_dir, fname)
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(card["text"].strip() + "\n\n")
-            f.write("---METADATA---\n")
-            f.write(json.dumps(card["scope"]) + "\n")
-            f.write(json.dumps({
-                "metric": card.get("metric"),
-                "value": card.get("value"),
-                "sample_size": card.get("sample_size"),
-                "confidence": card.get("confidence"),
-                "provenance": card.get("provenance"),
-            }) + "\n")
-        file_paths.append(path)
-    return file_paths
+def index_rows(df: pd.DataFrame, table, only_ids=None):
+    # Ids, float32 embeddings and comparables metadata for rows that have an embedding
+    emb_rows = table.embedding_rows
+    embeddings = table.embeddings
+    if only_ids is not None:
+        selected = df["_id"].iloc[emb_rows].isin(only_ids).to_numpy()
+        emb_rows = emb_rows[selected]
+        embeddings = embeddings[selected]
+    rows = df.iloc[emb_rows]
+    ids = rows["_id"].tolist()
+    values = rows["value"].to_numpy()
+    sale_dates = rows["sale_date"].dt.to_pydatetime() if "sale_date" in rows else [None] * len(rows)
+    sold = rows["sold"] if "sold" in rows else [None] * len(rows)
+    meta_list = [
+        {
+            "sale_price": float(v) if pd.notna(v) else None,
+            "artist": artist,
+            "medium": medium,
+            "size_bucket": str(size_bucket),
+            "sold": bool(is_sold) if pd.notna(is_sold) else None,
+            "sale_date": sale_date if pd.notna(sale_date) else None,
+            "auction_house": auction_house,
+            "gallery": gallery
+        }
+        for v, artist, medium, size_bucket, is_sold, sale_date, auction_house, gallery in zip(
+            values, rows["artist"], rows["medium"], rows["size_bucket"], sold, sale_dates,
+            rows["auction_house"], rows["gallery"])
+    ]
+    return ids, embeddings, meta_list
 
-def run_trend_agent_one_shot():
-    initialize_vertex_ai()
-    corpus = create_or_get_corpus(CORPUS_DISPLAY_NAME)
-    
-    df = load_artworks_from_mongo()
-    df = assign_size_buckets(df, buckets=3)
-    cards = compute_basic_trends(df, top_artists_n=50)
-    
-    with tempfile.TemporaryDirectory() as td:
-        file_paths = write_insight_cards_to_tempfiles(cards, td)
-        for path in file_paths:
-            display_name = os.path.basename(path)
-            description = "PoC insight card"
-            upload_text_file_to_corpus(corpus.name, path, display_name, description)
-    
-    # Build image embedding index
-    df_emb = df[df["img_embedding"].notna() & df["_id"].notna()].copy()
-    ids = df_emb["_id"].astype(str).tolist()
-    embeddings = [np.array(e).astype(float).tolist() for e in df_emb["img_embedding"].tolist()]
-    meta_list = []
-    for _, row in df_emb.iterrows():
-        meta_list.append({
-            "sale_price": float(row["value"]) if pd.notna(row["value"]) else None,
-            "artist": row.get("artist"),
-            "medium": row.get("medium"),
-            "size_bucket": str(row.get("size_bucket")),
-            "mongo_id": str(row["_id"])
-        })
-
-    img_index = ImageEmbeddingIndex(n_neighbors=5, metric="cosine")
-    if ids:
-        img_index.build(ids, embeddings, meta_list)
-        index_path = os.path.join(os.getcwd(), "image_embedding_index.joblib")
-        img_index.save(index_path)
+def snapshot_delta(df: pd.DataFrame, store: Optional[SnapshotStore]) -> Optional[pd.DataFrame]:
+    # Rows inserted since the last incremental snapshot refresh, or None when
+    # the persisted trend aggregates must be rebuilt from the full history.
+    # Re-fetched (updated) documents are left out; they are already counted.
+    if store is None or store.last_inserted is None:
+        return None
+    return df[df["_id"].isin(store.last_inserted)]
+
+def pushdown_trend_cards() -> Tuple[List[Dict[str, Any]], List[float]]:
+    # "mongo" backend: cards and size bucket edges aggregated server-side,
+    # without loading the collection
+    pushdown = TrendPushdown()
+    try:
+        cards = pushdown.compute_trends(top_artists_n=50)
+        edges = pushdown.size_edges if pushdown.size_edges is not None else pushdown.size_bucket_bounds()
+        return cards, edges
+    finally:
+        pushdown.client.close()
+
+def refresh_trend_cards(df: pd.DataFrame, delta: Optional[pd.DataFrame]) -> List[Dict[str, Any]]:
+    # With TREND_STORE_PATH set, fold only the delta into the persisted sketches;
+    # otherwise (or on first run) recompute from the full history
+    if not TREND_STORE_PATH:
+        return compute_basic_trends(df, top_artists_n=50)
+    trend_store = TrendStore.load(TREND_STORE_PATH)
+    if trend_store is not None and delta is not None:
+        trend_store.update(delta)
+    else:
+        trend_store = TrendStore()
+        trend_store.update(df)
+    trend_store.save(TREND_STORE_PATH)
+    return trend_store.cards(top_artists_n=50)
+
+def refresh_trend_series(df: pd.DataFrame, delta: Optional[pd.DataFrame]) -> List[Dict[str, Any]]:
+    # Rolling-window cards; new sales only extend the persisted series
+    series = TrendSeries.load(TREND_SERIES_PATH)
+    if series is not None and delta is not None:
+        series.append(delta)
+    else:
+        series = TrendSeries()
+        series.append(df)
+    series.save(TREND_SERIES_PATH)
+    return series.cards(top_artists_n=50)
+
+def publish_cards(cards: List[Dict[str, Any]], size_edges: List[float]) -> Dict[str, int]:
+    # Local insight index plus the RAG corpus
+    with stage_memory("insight index"):
+        InsightIndex.build(cards, meta={"size_edges": size_edges}).save(INSIGHT_INDEX_PATH)
     
-    return {"status": "success", "cards_uploaded": len(cards)}
+    with stage_memory("card sync"):
+        sync_stats = sync_cards(cards)
+    print(f"Card sync: {sync_stats}")
+    return sync_stats
+
+def run_trend_agent_one_shot():
+    store = SnapshotStore(SNAPSHOT_DIR) if SNAPSHOT_DIR else None
+    pushdown = TREND_BACKEND == "mongo"
+    if pushdown:
+        with stage_memory("trend cards"):
+            cards, size_edges = pushdown_trend_cards()
+        if store is None:
+            # The series, cube and embedding index need the artworks; without
+            # a snapshot store that is a full collection load, so only the
+            # server-side cards are refreshed
+            sync_stats = publish_cards(cards, size_edges)
+            return {"status": "success", "cards": len(cards), "cards_uploaded": sync_stats["uploaded"],
+                    "cards_deleted": sync_stats["deleted"]}
+
+    with stage_memory("load artworks"):
+        table = store.refresh() if store is not None else load_artworks()
+    print(f"Artworks frame: {len(table.df)} rows, {frame_memory_mb(table.df):,.0f}MB; "
+          f"embeddings {table.embeddings.nbytes / 2**20:,.0f}MB")
+    with stage_memory("size buckets"):
+        df = assign_size_buckets(table.df, buckets=3, inplace=True)
+    delta = snapshot_delta(df, store)
+    if not pushdown:
+        with stage_memory("trend cards"):
+            cards = refresh_trend_cards(df, delta)
+        size_edges = size_bucket_edges(df)
+    with stage_memory("trend series"):
+        cards += refresh_trend_series(df, delta)
+    with stage_memory("trend cube"):
+        TrendCube.build(df).save(TREND_CUBE_PATH)
+    sync_stats = publish_cards(cards, size_edges)
+
+    # Upsert only the snapshot delta into an existing index; otherwise build from scratch
+    delta_ids = None
+    if store is not None and store.last_delta is not None and current_generation(INDEX_DIR):
+        delta_ids = set(store.last_delta.df["_id"])
+    with stage_memory("embedding index"):
+        ids, embeddings, meta_list = index_rows(df, table, delta_ids)
+        if delta_ids is not None:
+            if ids:
+                writer = IndexWriter(INDEX_DIR)
+                writer.upsert(ids, embeddings, meta_list)
+                writer.wait()
+        elif ids:
+            img_index = create_index(n_neighbors=5, metric="cosine", n_vectors=len(ids))
+            img_index.build(ids, embeddings, meta_list)
+            write_index(img_index, INDEX_DIR)
+
+    return {"status": "success", "cards": len(cards), "cards_uploaded": sync_stats["uploaded"],
+            "cards_deleted": sync_stats["deleted"]}
+
+_insight_cache: Dict[str, Any] = {}
+
+def get_insight_index(index_path: str = INSIGHT_INDEX_PATH) -> Optional[InsightIndex]:
+    # Cached index, reloaded when the trend agent writes a new one
+    mtime = os.path.getmtime(index_path) if os.path.exists(index_path) else None
+    if mtime is None:
+        return None
+    if _insight_cache.get("key") != (index_path, mtime):
+        _insight_cache.update(key=(index_path, mtime), index=InsightIndex.load(index_path))
+    return _insight_cache["index"]
 
 def retrieve_insights_via_rag(query_filters: Dict[str, str], k: int = 3) -> List[Dict[str, Any]]:
-    qtext = " ".join([f"{k}:{v}" for k, v in query_filters.items()])
-    return [{"text": f"Retrieved insight for {qtext} (PoC placeholder)", "meta": query_filters}]
+    # Served from the local insight index (same cards as the RAG corpus) without a network round-trip
+    index = get_insight_index()
+    if index is None:
+        return []
+    return index.lookup(query_filters, k=k)
+
+_cube_cache: Dict[str, Any] = {}
+
+def get_trend_cell(spec: Dict[str, Any], roll_up: Optional[List[str]] = None,
+                   cube_path: str = TREND_CUBE_PATH) -> Optional[Dict[str, Any]]:
+    # Cached cube handle, reloaded when the trend agent writes a new cube
+    mtime = os.path.getmtime(cube_path) if os.path.exists(cube_path) else None
+    if mtime is None:
+        return None
+    if _cube_cache.get("key") != (cube_path, mtime):
+        _cube_cache.update(key=(cube_path, mtime), cube=TrendCube.load(cube_path))
+    return _cube_cache["cube"].cell(spec, roll_up=roll_up or ())
 
 def get_comparables_from_local_index(query_embedding: List[float], k: int = 5, 
-                                    index_path: str = "image_embedding_index.joblib") -> List[Dict[str, Any]]:
-    idx = ImageEmbeddingIndex()
-    idx.load(index_path)
-    return idx.query(query_embedding, k=k)
\ No newline at end of file
+                                    index_path: str = INDEX_DIR,
+                                    filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    idx = open_index(index_path)
+    return idx.query(query_embedding, k=k, filters=filters)
\ No newline at end of file
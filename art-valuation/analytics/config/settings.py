@@ -9,4 +9,87 @@ LOCATION = os.getenv("GOOGLE_CLOUD_LOCATION")
 MONGO_URI = os.getenv("MONGO_URI")
 MONGO_DB = os.getenv("MONGO_DB", "art_db")
 MONGO_COLLECTION = os.getenv("MONGO_COLLECTION", "artworks")
-CORPUS_DISPLAY_NAME = os.getenv("RAG_CORPUS", "ArtValuation_PoC_Corpus")
\ No newline at end of file
+CORPUS_DISPLAY_NAME = os.getenv("RAG_CORPUS", "ArtValuation_PoC_Corpus")
+
+# Data loading
+EMBEDDING_FIELD = os.getenv("EMBEDDING_FIELD", "img_embedding")
+LOAD_BATCH_SIZE = int(os.getenv("LOAD_BATCH_SIZE", "10000"))
+
+# Local snapshot cache (empty SNAPSHOT_DIR disables it)
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "")
+# Timestamp the pre-processor sets on every metadata write; "_id" only sees inserts
+SNAPSHOT_WATERMARK = os.getenv("SNAPSHOT_WATERMARK", "updated_at")
+SNAPSHOT_MAX_PARTS = int(os.getenv("SNAPSHOT_MAX_PARTS", "8"))
+
+# Embedding index search
+INDEX_CHUNK_ROWS = int(os.getenv("INDEX_CHUNK_ROWS", "131072"))
+INDEX_THREADS = int(os.getenv("INDEX_THREADS", "0"))  # 0 = all cores
+# Bytes of (queries x chunk rows) float32 scores alive at once across all
+# search threads; large query batches are split into blocks to stay under it
+INDEX_SCORE_BYTES = int(os.getenv("INDEX_SCORE_BYTES", str(256 * 2**20)))
+INDEX_DIR = os.getenv("INDEX_DIR", os.path.join(os.getcwd(), "image_embedding_index"))
+INDEX_MAX_SEGMENTS = int(os.getenv("INDEX_MAX_SEGMENTS", "16"))
+INDEX_MAX_DEAD_FRACTION = float(os.getenv("INDEX_MAX_DEAD_FRACTION", "0.2"))
+INDEX_TYPE = os.getenv("INDEX_TYPE", "exact")  # exact | ivf | pq
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))  # 0 = 4 * sqrt(N)
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+IVF_TRAIN_SAMPLE = int(os.getenv("IVF_TRAIN_SAMPLE", "100000"))
+PQ_M = int(os.getenv("PQ_M", "64"))  # bytes per vector; must divide the embedding dim
+PQ_OPQ = os.getenv("PQ_OPQ", "true").lower() == "true"
+PQ_RERANK = int(os.getenv("PQ_RERANK", "4"))  # re-rank k * PQ_RERANK candidates exactly; 0 disables
+PQ_TRAIN_SAMPLE = int(os.getenv("PQ_TRAIN_SAMPLE", "50000"))
+
+# Filtered comparables search
+FILTER_BITMAP_MAX_CARDINALITY = int(os.getenv("FILTER_BITMAP_MAX_CARDINALITY", "64"))
+FILTER_PREFILTER_SELECTIVITY = float(os.getenv("FILTER_PREFILTER_SELECTIVITY", "0.05"))
+FILTER_OVERFETCH = float(os.getenv("FILTER_OVERFETCH", "2.0"))
+
+# Trend analysis
+TREND_DIMENSIONS = os.getenv("TREND_DIMENSIONS", "medium,artist,size_bucket")
+# Quantile sketches: rank error <= SKETCH_EPSILON * n per query with probability
+# >= 1 - SKETCH_DELTA, whatever n is; the items per level (k) follow from these
+SKETCH_EPSILON = float(os.getenv("SKETCH_EPSILON", "0.02"))
+SKETCH_DELTA = float(os.getenv("SKETCH_DELTA", "0.01"))
+TREND_STORE_PATH = os.getenv("TREND_STORE_PATH", "")  # empty disables the incremental trend store
+
+# Trend cube (multi-dimensional aggregates; "period" is the sale-date period)
+CUBE_DIMENSIONS = os.getenv("CUBE_DIMENSIONS", "medium,artist,size_bucket,auction_house,gallery,period")
+CUBE_PERIOD = os.getenv("CUBE_PERIOD", "Y")  # Y | Q | M
+CUBE_MIN_SUPPORT = int(os.getenv("CUBE_MIN_SUPPORT", "5"))  # cells with fewer sales are pruned
+CUBE_MAX_DIMS = int(os.getenv("CUBE_MAX_DIMS", "4"))  # largest combination of dimensions materialized
+TREND_CUBE_PATH = os.getenv("TREND_CUBE_PATH", os.path.join(os.getcwd(), "trend_cube.npz"))
+
+# Rolling trend series
+SERIES_WINDOWS = os.getenv("SERIES_WINDOWS", "30,90,365")  # trailing windows in days
+SERIES_KEEP_DAYS = int(os.getenv("SERIES_KEEP_DAYS", "365"))  # daily points kept per scope
+SERIES_SLOPE_DAYS = int(os.getenv("SERIES_SLOPE_DAYS", "90"))  # span of the trend slope fit
+SERIES_FLAT_SLOPE = float(os.getenv("SERIES_FLAT_SLOPE", "0.01"))  # |change per 30 days| below this is "flat"
+SERIES_SLOPE_Z = float(os.getenv("SERIES_SLOPE_Z", "2.0"))  # |slope| must exceed this many standard errors
+TREND_SERIES_PATH = os.getenv("TREND_SERIES_PATH", os.path.join(os.getcwd(), "trend_series.npz"))
+
+# Trend backend: "pandas" computes cards from the loaded table, "mongo" pushes
+# the aggregation down into MongoDB and only transfers aggregated rows (without
+# SNAPSHOT_DIR it then skips the collection load and the frame-based stages)
+TREND_BACKEND = os.getenv("TREND_BACKEND", "pandas")
+PUSHDOWN_WORKERS = int(os.getenv("PUSHDOWN_WORKERS", "4"))  # concurrent aggregation pipelines
+
+# Insight card sync: "vertex" uploads to the RAG corpus, "local" to LOCAL_CORPUS_DIR
+CARD_SYNC_BACKEND = os.getenv("CARD_SYNC_BACKEND", "vertex")
+CARD_SYNC_WORKERS = int(os.getenv("CARD_SYNC_WORKERS", "8"))  # concurrent uploads/deletes
+CARD_MANIFEST_PATH = os.getenv("CARD_MANIFEST_PATH", os.path.join(os.getcwd(), "card_manifest.json"))
+LOCAL_CORPUS_DIR = os.getenv("LOCAL_CORPUS_DIR", os.path.join(os.getcwd(), "local_corpus"))
+
+# Local insight index (exact scope lookup + BM25 over the insight cards)
+INSIGHT_INDEX_PATH = os.getenv("INSIGHT_INDEX_PATH", os.path.join(os.getcwd(), "insight_index.npz"))
+INSIGHT_BM25_K1 = float(os.getenv("INSIGHT_BM25_K1", "1.2"))
+INSIGHT_BM25_B = float(os.getenv("INSIGHT_BM25_B", "0.75"))
+INSIGHT_RERANK_WEIGHT = float(os.getenv("INSIGHT_RERANK_WEIGHT", "0.5"))  # embedding share of the re-ranked score
+
+# Deterministic valuation (comparables adjusted by segment medians)
+VALUATION_K = int(os.getenv("VALUATION_K", "10"))  # comparables per artwork
+VALUATION_DISTANCE_EPS = float(os.getenv("VALUATION_DISTANCE_EPS", "0.05"))  # weight = 1 / (distance + eps)
+VALUATION_MAX_ADJUST = float(os.getenv("VALUATION_MAX_ADJUST", "4.0"))  # cap on each segment price ratio
+VALUATION_INTERVAL_Z = float(os.getenv("VALUATION_INTERVAL_Z", "1.0"))  # range = estimate +/- z log std devs
+VALUATION_MIN_SPREAD = float(os.getenv("VALUATION_MIN_SPREAD", "0.1"))  # minimum log std dev of the range
+VALUATION_CONF_DISTANCE = float(os.getenv("VALUATION_CONF_DISTANCE", "0.25"))  # distance halving the similarity term
+VALUATION_BATCH_SIZE = int(os.getenv("VALUATION_BATCH_SIZE", "4096"))  # artworks per search / output chunk
@@ -0,0 +1,172 @@
+import numpy as np
+import joblib
+from typing import List, Dict, Any, Optional, Tuple
+from database.embeddings import ImageEmbeddingIndex, _topk_rows
+from config.settings import INDEX_TYPE, IVF_NLIST, IVF_NPROBE, IVF_TRAIN_SAMPLE
+
+def train_kmeans(x: np.ndarray, n_clusters: int, n_iter: int = 10, seed: int = 0,
+                 spherical: bool = True) -> np.ndarray:
+    # Lloyd's k-means in float32, seeded with distinct random points.
+    # With spherical=True centroids are re-normalised (cosine / inner product).
+    rng = np.random.default_rng(seed)
+    n = x.shape[0]
+    n_clusters = min(n_clusters, n)
+    centroids = x[rng.choice(n, size=n_clusters, replace=False)].astype(np.float32)
+
+    for _ in range(n_iter):
+        assign = assign_clusters(x, centroids)
+        counts = np.bincount(assign, minlength=n_clusters)
+        order = np.argsort(assign, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.zeros_like(centroids)
+        nonempty = counts > 0
+        sums[nonempty] = np.add.reduceat(x[order], starts[nonempty], axis=0)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters with random points
+            sums[empty] = x[rng.choice(n, size=int(empty.sum()), replace=False)]
+            counts[empty] = 1
+        centroids = sums / counts[:, None]
+        if spherical:
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids /= norms
+    return centroids.astype(np.float32)
+
+def assign_clusters(x: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    # Nearest centroid (squared euclidean) for every row, in chunks to bound memory
+    c_sq = np.einsum("ij,ij->i", centroids, centroids)
+    out = np.empty(x.shape[0], dtype=np.int32)
+    for s in range(0, x.shape[0], chunk):
+        block = x[s:s + chunk]
+        out[s:s + chunk] = np.argmin(c_sq - 2 * block @ centroids.T, axis=1)
+    return out
+
+class IVFImageEmbeddingIndex(ImageEmbeddingIndex):
+    # Inverted-file index: a k-means coarse quantizer splits the vectors into
+    # nlist cells and a query scans only the nprobe nearest cells. Vectors are
+    # stored reordered by cell (CSR layout: cell_offsets[c]:cell_offsets[c+1]),
+    # so each probed cell is one contiguous slice. nprobe trades recall for speed
+    # and can be changed per query.
+
+    index_type = "ivf"
+
+    def __init__(self, n_neighbors=5, metric="cosine", nlist: int = IVF_NLIST, nprobe: int = IVF_NPROBE):
+        super().__init__(n_neighbors=n_neighbors, metric=metric)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = None
+        self.cell_offsets = None
+
+    def build(self, id_list: List[str], embedding_list, meta_list: List[Dict[str, Any]]):
+        super().build(id_list, embedding_list, meta_list)
+        self.train()
+
+    def train(self, sample_size: int = IVF_TRAIN_SAMPLE):
+        x = self.embeddings
+        nlist = self.nlist or max(1, int(4 * np.sqrt(x.shape[0])))
+        sample_size = max(sample_size, 40 * nlist)
+        rng = np.random.default_rng(0)
+        sample = x if x.shape[0] <= sample_size else x[rng.choice(x.shape[0], sample_size, replace=False)]
+        self.centroids = train_kmeans(np.ascontiguousarray(sample), nlist, spherical=self.metric == "cosine")
+        self._assign()
+
+    def _assign(self):
+        # Reorder vectors by cell so every inverted list is a contiguous slice
+        assign = assign_clusters(self.embeddings, self.centroids)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=len(self.centroids))
+        self.cell_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.embeddings = np.ascontiguousarray(self.embeddings[order])
+        self.ids = [self.ids[i] for i in order]
+        self._finish_build()
+
+    def save(self, path: str):
+        joblib.dump({
+            "ids": self.ids,
+            "embeddings": self.embeddings,
+            "meta": self.meta,
+            "metric": self.metric,
+            "normalized": self.metric == "cosine",
+            "ivf": {"centroids": self.centroids, "cell_offsets": self.cell_offsets,
+                    "nlist": self.nlist, "nprobe": self.nprobe}
+        }, path)
+
+    def load(self, path: str, data: Optional[Dict[str, Any]] = None):
+        if data is None:
+            data = joblib.load(path)
+        super().load(path, data)
+        ivf = data.get("ivf")
+        if ivf is None:
+            # Plain exact index file: train the quantizer now
+            self.train()
+            return
+        self.centroids = ivf["centroids"]
+        self.cell_offsets = ivf["cell_offsets"]
+        self.nlist = ivf["nlist"]
+        self.nprobe = ivf["nprobe"]
+
+    def _probe_cells(self, q: np.ndarray, nprobe: int) -> np.ndarray:
+        if self.metric == "cosine":
+            scores = q @ self.centroids.T
+        else:
+            scores = 2 * q @ self.centroids.T - np.einsum("ij,ij->i", self.centroids, self.centroids)
+        return _topk_rows(scores, nprobe)[1]
+
+    def search(self, queries, k: int = 5, nprobe: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        if self.centroids is None:
+            raise RuntimeError("Index not built/loaded.")
+        q = self._prepare(queries)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        k = min(k, len(self.ids))
+        cells = self._probe_cells(q, nprobe)
+
+        dists = np.full((q.shape[0], k), np.inf, dtype=np.float32)
+        idxs = np.full((q.shape[0], k), -1, dtype=np.int64)
+        starts, ends = self.cell_offsets[:-1], self.cell_offsets[1:]
+        for i in range(q.shape[0]):
+            rows = np.concatenate([np.arange(starts[c], ends[c]) for c in cells[i]])
+            if not len(rows):
+                continue
+            block = self.embeddings[rows]
+            scores = block @ q[i]
+            if self.metric == "euclidean":
+                scores = 2 * scores - self.sq_norms[rows]
+            top_scores, top = _topk_rows(scores[None, :], k)
+            n_found = top.shape[1]
+            if self.metric == "cosine":
+                dists[i, :n_found] = 1.0 - top_scores[0]
+            else:
+                dists[i, :n_found] = np.sqrt(np.maximum(q[i] @ q[i] - top_scores[0], 0.0))
+            idxs[i, :n_found] = rows[top[0]]
+        return dists, idxs
+
+    def _results(self, dists: np.ndarray, idxs: np.ndarray) -> List[Dict[str, Any]]:
+        keep = idxs >= 0
+        return super()._results(dists[keep], idxs[keep])
+
+def create_index(index_type: str = INDEX_TYPE, n_neighbors: int = 5, metric: str = "cosine",
+                 n_vectors: Optional[int] = None) -> ImageEmbeddingIndex:
+    # n_vectors: rows the index will be built from; PQ below its training
+    # minimum (one vector per sub-codebook centroid) falls back to exact
+    if index_type == "pq" and n_vectors is not None:
+        from database.pq_index import KSUB
+        if n_vectors < KSUB:
+            print(f"PQ needs at least {KSUB} vectors, got {n_vectors}; using the exact index")
+            index_type = "exact"
+    if index_type == "exact":
+        return ImageEmbeddingIndex(n_neighbors=n_neighbors, metric=metric)
+    if index_type == "ivf":
+        return IVFImageEmbeddingIndex(n_neighbors=n_neighbors, metric=metric)
+    if index_type == "pq":
+        from database.pq_index import PQImageEmbeddingIndex
+        return PQImageEmbeddingIndex(n_neighbors=n_neighbors, metric=metric)
+    raise ValueError(f"Unknown index type: {index_type}")
+
+def load_index(path: str) -> ImageEmbeddingIndex:
+    # Picks the index class from the saved file
+    data = joblib.load(path)
+    index_type = "ivf" if "ivf" in data else "pq" if "pq" in data else "exact"
+    index = create_index(index_type)
+    index.load(path, data)
+    return index
@@ -1,27 +1,234 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
 from pymongo import MongoClient
+import numpy as np
 import pandas as pd
-from config.settings import MONGO_URI, MONGO_DB, MONGO_COLLECTION
+from config.settings import MONGO_URI, MONGO_DB, MONGO_COLLECTION, EMBEDDING_FIELD, LOAD_BATCH_SIZE
+from database.schema import (SCALAR_FIELDS, NUMERIC_FIELDS, CATEGORICAL_FIELDS, FLOAT_DTYPE, ID_DTYPE,
+                             CategoryEncoder, apply_schema)
 
-def load_artworks_from_mongo() -> pd.DataFrame:
+@dataclass
+class ArtworkTable:
+    # Scalar columns in the typed schema (database.schema), one row per artwork
+    df: pd.DataFrame
+    # (n_embedded, dim) float32 matrix kept outside the DataFrame
+    embeddings: np.ndarray
+    # Row positions in df for each embedding row
+    embedding_rows: np.ndarray
+
+    def embedding_ids(self) -> np.ndarray:
+        return self.df["_id"].to_numpy()[self.embedding_rows]
+
+def _get_path(doc: Dict[str, Any], path: str):
+    for part in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+class _ColumnBuilder:
+    # Accumulates documents into typed columns and a growing float32 matrix.
+    # Every chunk_size documents the pending values are converted (categorical
+    # codes, float32, datetime64) and written into preallocated arrays, so only
+    # one chunk is ever held as Python objects and finish() copies nothing.
+
+    def __init__(self, fields: Sequence[str], with_embeddings: bool, capacity: int, chunk_size: int):
+        self.fields = list(fields)
+        self.with_embeddings = with_embeddings
+        self.chunk_size = chunk_size
+        self.chunks: Dict[str, List[np.ndarray]] = {f: [] for f in ["_id"] + self.fields}
+        self.pending: Dict[str, list] = {f: [] for f in ["_id"] + self.fields}
+        self.n_rows = 0
+        self.n_flushed = 0
+        self.capacity = max(capacity, 1)
+        self.encoders = {f: CategoryEncoder() for f in self.fields if f in CATEGORICAL_FIELDS}
+        self.columns: Dict[str, np.ndarray] = {}
+        for f in self.fields:
+            dtype = (np.int32 if f in self.encoders else FLOAT_DTYPE if f in NUMERIC_FIELDS
+                     else "datetime64[ns]" if f == "sale_date" else np.int8 if f == "sold" else None)
+            if dtype is not None:
+                self.columns[f] = np.empty(self.capacity, dtype=dtype)
+        self.embeddings: Optional[np.ndarray] = None
+        self.embedding_rows: List[int] = []
+        self.n_embedded = 0
+
+    def append(self, doc: Dict[str, Any]):
+        pending = self.pending
+        pending["_id"].append(str(doc.get("_id")))
+        for f in self.fields:
+            pending[f].append(doc.get(f))
+
+        if self.with_embeddings:
+            emb = _get_path(doc, EMBEDDING_FIELD)
+            if emb:
+                self._add_embedding(emb)
+
+        self.n_rows += 1
+        if len(pending["_id"]) >= self.chunk_size:
+            self._flush()
+
+    def _add_embedding(self, emb):
+        if self.embeddings is None:
+            self.embeddings = np.empty((self.capacity, len(emb)), dtype=np.float32)
+        elif len(emb) != self.embeddings.shape[1]:
+            # Rows of another dimension are skipped before they can trigger a grow
+            return
+        elif self.n_embedded == self.embeddings.shape[0]:
+            grown = np.empty((self.embeddings.shape[0] * 2, self.embeddings.shape[1]), dtype=np.float32)
+            grown[:self.n_embedded] = self.embeddings
+            self.embeddings = grown
+        self.embeddings[self.n_embedded] = emb
+        self.embedding_rows.append(self.n_rows)
+        self.n_embedded += 1
+
+    def _flush(self):
+        for f, values in self.pending.items():
+            if not values:
+                continue
+            if f in self.encoders:
+                col = self.encoders[f].encode(values)
+            elif f in NUMERIC_FIELDS:
+                col = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=FLOAT_DTYPE)
+            elif f == "sale_date":
+                col = pd.to_datetime(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype="datetime64[ns]")
+            elif f == "sold":
+                col = np.array([-1 if v is None else int(bool(v)) for v in values], dtype=np.int8)
+            elif f == "_id" and ID_DTYPE is not object:
+                col = pd.array(values, dtype=ID_DTYPE)
+            else:
+                col = np.asarray(values, dtype=object)
+            if f in self.columns:
+                self._write(f, col)
+            else:
+                self.chunks[f].append(col)
+            values.clear()
+        self.n_flushed = self.n_rows
+
+    def _write(self, f: str, col: np.ndarray):
+        # Doubling growth when the collection outgrew the estimated count
+        target = self.columns[f]
+        end = self.n_flushed + len(col)
+        if end > len(target):
+            grown = np.empty(max(end, 2 * len(target)), dtype=target.dtype)
+            grown[:self.n_flushed] = target[:self.n_flushed]
+            self.columns[f] = target = grown
+        target[self.n_flushed:end] = col
+
+    def _column(self, f: str) -> np.ndarray:
+        col = self.columns.pop(f)
+        # Keep the preallocated buffer unless most of it is unused slack
+        return col[:self.n_rows] if self.n_rows * 4 >= len(col) * 3 else col[:self.n_rows].copy()
+
+    def finish(self) -> ArtworkTable:
+        self._flush()
+        columns = {}
+        for f, chunks in self.chunks.items():
+            if f in self.encoders:
+                columns[f] = self.encoders[f].categorical(self._column(f))
+            elif f == "sold":
+                flags = self._column(f)
+                columns[f] = pd.arrays.BooleanArray(flags == 1, flags == -1)
+            elif f in self.columns:
+                columns[f] = self._column(f)
+            elif f == "_id" and ID_DTYPE is not object:
+                columns[f] = pd.concat([pd.Series(c) for c in chunks], ignore_index=True) if chunks \
+                    else pd.Series([], dtype=ID_DTYPE)
+            elif chunks:
+                columns[f] = np.concatenate(chunks)
+            else:
+                columns[f] = np.empty(0, dtype=object)
+            self.chunks[f] = []
+        df = pd.DataFrame(columns, copy=False)
+        if "dim1" in df.columns and "dim2" in df.columns:
+            df["area"] = df["dim1"] * df["dim2"]
+
+        if self.embeddings is None:
+            embeddings = np.empty((0, 0), dtype=np.float32)
+        else:
+            embeddings, self.embeddings = self.embeddings, None
+            # Like _column: keep the buffer unless most of it is slack, which is
+            # shrunk in place rather than copied so the peak stays one matrix
+            if self.n_embedded * 4 >= len(embeddings) * 3:
+                embeddings = embeddings[:self.n_embedded]
+            else:
+                try:
+                    embeddings.resize((self.n_embedded, embeddings.shape[1]))
+                except ValueError:
+                    # Still referenced elsewhere (e.g. under a debugger)
+                    embeddings = embeddings[:self.n_embedded].copy()
+        return ArtworkTable(df, embeddings, np.asarray(self.embedding_rows, dtype=np.int64))
+
+def load_artworks(query: Optional[Dict[str, Any]] = None, fields: Sequence[str] = SCALAR_FIELDS,
+                  with_embeddings: bool = True, batch_size: int = LOAD_BATCH_SIZE) -> ArtworkTable:
+    # Streams only the requested fields in large cursor batches and builds typed
+    # columns chunk by chunk; embeddings go straight into one float32 matrix
     client = MongoClient(MONGO_URI)
-    coll = client[MONGO_DB][MONGO_COLLECTION]
-    docs = list(coll.find({}))
-    
-    if not docs:
+    try:
+        coll = client[MONGO_DB][MONGO_COLLECTION]
+        projection = {f: 1 for f in fields}
+        if with_embeddings:
+            projection[EMBEDDING_FIELD] = 1
+        capacity = coll.estimated_document_count() if not query else batch_size
+        builder = _ColumnBuilder(fields, with_embeddings, capacity, batch_size)
+        for doc in coll.find(query or {}, projection, batch_size=batch_size):
+            builder.append(doc)
+    finally:
+        client.close()
+
+    if builder.n_rows == 0 and not query:
         raise RuntimeError("No documents found in the collection.")
-    
-    df = pd.DataFrame(docs)
+    return builder.finish()
+
+def load_artworks_from_mongo() -> pd.DataFrame:
+    # Kept for callers that only need scalar columns
+    return load_artworks(with_embeddings=False).df
+
+def load_artworks_from_parquet(path: str) -> ArtworkTable:
+    # Reads the columnar snapshots written by the pre-processor's parquet sink
+    # (a single file or a partitioned directory)
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path)
+    if table.num_rows == 0:
+        raise RuntimeError(f"No rows found in {path}.")
+
+    embeddings = np.empty((0, 0), dtype=np.float32)
+    rows = np.empty(0, dtype=np.int64)
+    if "embedding" in table.column_names:
+        col = table.column("embedding").combine_chunks()
+        valid = ~np.asarray(col.is_null().to_numpy(zero_copy_only=False), dtype=bool)
+        rows = np.flatnonzero(valid)
+        dim = col.type.list_size
+        embeddings = col.filter(col.is_valid()).flatten().to_numpy().reshape(-1, dim).astype(np.float32, copy=False)
+        table = table.drop_columns(["embedding"])
+
+    df = table.to_pandas()
+    return ArtworkTable(normalize_artworks(df), embeddings, rows)
+
+def load_artworks_from_jsonl(path: str, fields: Sequence[str] = SCALAR_FIELDS,
+                            batch_size: int = LOAD_BATCH_SIZE) -> ArtworkTable:
+    # One artwork document per line (e.g. mongoexport output), through the same
+    # column builder as the Mongo loader
+    import json
+
+    builder = _ColumnBuilder(fields, True, batch_size, batch_size)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                builder.append(json.loads(line))
+    if builder.n_rows == 0:
+        raise RuntimeError(f"No documents found in {path}.")
+    return builder.finish()
+
+def normalize_artworks(df: pd.DataFrame) -> pd.DataFrame:
     # Ensure expected fields exist
-    for f in ("artist", "medium", "dim1", "dim2", "year_created", "sale_date", 
-              "value", "img_embedding", "zero_shot_tags", "auction_house", "gallery"):
+    for f in ("artist", "medium", "dim1", "dim2", "year_created", "sale_date",
+              "value", "auction_house", "gallery"):
         if f not in df.columns:
             df[f] = None
-    
-    # Normalize data
-    df["dim1"] = pd.to_numeric(df["dim1"], errors="coerce")
-    df["dim2"] = pd.to_numeric(df["dim2"], errors="coerce")
-    df["value"] = pd.to_numeric(df["value"], errors="coerce")
+
+    # Normalize data into the typed schema
+    apply_schema(df)
     df["area"] = df["dim1"] * df["dim2"]
-    df["sale_date"] = pd.to_datetime(df["sale_date"], errors="coerce")
-    
-    return df
\ No newline at end of file
+
+    return df
@@ -1,53 +1,216 @@
+import os
 import numpy as np
 import joblib
-from typing import List, Dict, Any, Optional
-from sklearn.neighbors import NearestNeighbors
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+from database.filters import FilterIndex
+from config.settings import (INDEX_CHUNK_ROWS, INDEX_THREADS, INDEX_SCORE_BYTES, FILTER_PREFILTER_SELECTIVITY,
+                             FILTER_OVERFETCH)
+
+def _topk_rows(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Per-row top-k (highest score first) via argpartition, then a sort of only k items
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(scores.shape[1]), (scores.shape[0], k))
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind="stable")
+    return np.take_along_axis(part_scores, order, axis=1), np.take_along_axis(part, order, axis=1)
+
+def _query_blocks(n_queries: int, chunk_rows: int, threads: int = 1) -> List[Tuple[int, int]]:
+    # Query ranges whose (block x chunk_rows) float32 score matrices, one per
+    # thread, stay within INDEX_SCORE_BYTES (argpartition temporaries add a
+    # small constant factor on top)
+    block = max(1, INDEX_SCORE_BYTES // (4 * max(chunk_rows, 1) * max(threads, 1)))
+    return [(s, min(s + block, n_queries)) for s in range(0, n_queries, block)]
 
 class ImageEmbeddingIndex:
+    # Exact search over a contiguous float32 matrix. For cosine the rows are
+    # normalised once at build time, so a query is one matrix product plus
+    # argpartition. Large matrices are scored in row chunks across threads
+    # (BLAS releases the GIL) and the per-chunk top-k lists are merged; large
+    # query batches are processed in blocks (see _query_blocks).
+
+    index_type = "exact"
+
     def __init__(self, n_neighbors=5, metric="cosine"):
+        if metric not in ("cosine", "euclidean"):
+            raise ValueError(f"Unsupported metric: {metric}")
         self.n_neighbors = n_neighbors
         self.metric = metric
-        self.model: Optional[NearestNeighbors] = None
         self.ids: List[str] = []
         self.embeddings: Optional[np.ndarray] = None
+        self.sq_norms: Optional[np.ndarray] = None
         self.meta: Dict[str, Dict[str, Any]] = {}
+        # Set when opened from the memory-mapped directory format (database.index_store)
+        self.meta_table = None
+        self.generation = None
+        self._filter_index: Optional[FilterIndex] = None
 
-    def build(self, id_list: List[str], embedding_list: List[List[float]], meta_list: List[Dict[str, Any]]):
-        if not id_list:
+    def _prepare(self, vectors) -> np.ndarray:
+        x = np.ascontiguousarray(vectors, dtype=np.float32)
+        if x.ndim == 1:
+            x = x.reshape(1, -1)
+        if self.metric == "cosine":
+            norms = np.linalg.norm(x, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            x = x / norms
+        return x
+
+    def build(self, id_list: List[str], embedding_list, meta_list: List[Dict[str, Any]]):
+        if not len(id_list):
             raise RuntimeError("No embeddings provided to build index.")
-        self.ids = id_list
-        self.embeddings = np.array(embedding_list).astype(float)
-        self.model = NearestNeighbors(n_neighbors=self.n_neighbors, metric=self.metric)
-        self.model.fit(self.embeddings)
-        for _id, m in zip(id_list, meta_list):
+        self.ids = list(id_list)
+        self.embeddings = self._prepare(embedding_list)
+        self._finish_build()
+        self.meta = {}
+        self.meta_table = None
+        for _id, m in zip(self.ids, meta_list):
             self.meta[_id] = m
 
+    def _finish_build(self, sq_norms: Optional[np.ndarray] = None):
+        # sq_norms: persisted row norms (database.index_store), so opening skips the O(N * D) pass
+        self._filter_index = None
+        if self.metric == "euclidean":
+            self.sq_norms = sq_norms if sq_norms is not None else np.einsum("ij,ij->i", self.embeddings, self.embeddings)
+
     def save(self, path: str):
         joblib.dump({
             "ids": self.ids,
             "embeddings": self.embeddings,
             "meta": self.meta,
-            "model": self.model
+            "metric": self.metric,
+            "normalized": self.metric == "cosine"
         }, path)
 
-    def load(self, path: str):
-        data = joblib.load(path)
+    def load(self, path: str, data: Optional[Dict[str, Any]] = None):
+        # data: the already unpickled file (see database.ann_index.load_index)
+        if data is None:
+            data = joblib.load(path)
         self.ids = data["ids"]
-        self.embeddings = data["embeddings"]
         self.meta = data["meta"]
-        self.model = data["model"]
+        # Older files pickled a sklearn model and raw float64 vectors
+        model = data.get("model")
+        self.metric = data.get("metric") or getattr(model, "metric", None) or self.metric
+        if data.get("normalized"):
+            self.embeddings = np.ascontiguousarray(data["embeddings"], dtype=np.float32)
+        else:
+            self.embeddings = self._prepare(data["embeddings"])
+        self._finish_build()
 
-    def query(self, q_embedding: List[float], k: int = 5) -> List[Dict[str, Any]]:
-        if self.model is None:
+    def _score_chunk(self, q: np.ndarray, start: int, end: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        scores = q @ self.embeddings[start:end].T
+        if self.metric == "euclidean":
+            # -||x - q||^2 up to the per-query constant ||q||^2
+            scores = 2 * scores - self.sq_norms[start:end]
+        top_scores, top_idx = _topk_rows(scores, k)
+        return top_scores, top_idx + start
+
+    def search(self, queries, k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+        # Returns (distances, row indices), each (Q, k), nearest first
+        if self.embeddings is None:
             raise RuntimeError("Index not built/loaded.")
-        q = np.array(q_embedding).reshape(1, -1).astype(float)
-        dists, idxs = self.model.kneighbors(q, n_neighbors=min(k, len(self.ids)))
+        q = self._prepare(queries)
+        n = self.embeddings.shape[0]
+        k = min(k, n)
+        chunk = max(INDEX_CHUNK_ROWS, k)
+
+        bounds = [(s, min(s + chunk, n)) for s in range(0, n, chunk)]
+        if len(bounds) == 1:
+            parts = [self._score_chunk(q[qs:qe], 0, n, k) for qs, qe in _query_blocks(len(q), n)]
+        else:
+            threads = min(INDEX_THREADS or os.cpu_count() or 1, len(bounds))
+            parts = []
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                for qs, qe in _query_blocks(len(q), chunk, threads):
+                    block = q[qs:qe]
+                    chunks = list(pool.map(lambda b: self._score_chunk(block, b[0], b[1], k), bounds))
+                    all_scores = np.concatenate([c[0] for c in chunks], axis=1)
+                    all_idxs = np.concatenate([c[1] for c in chunks], axis=1)
+                    top_scores, pos = _topk_rows(all_scores, k)
+                    parts.append((top_scores, np.take_along_axis(all_idxs, pos, axis=1)))
+        scores = parts[0][0] if len(parts) == 1 else np.concatenate([p[0] for p in parts])
+        idxs = parts[0][1] if len(parts) == 1 else np.concatenate([p[1] for p in parts])
+        return self._distances(q, scores), idxs
+
+    def _distances(self, q: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        if self.metric == "cosine":
+            return 1.0 - scores
+        q_sq = np.einsum("ij,ij->i", q, q)[:, None]
+        return np.sqrt(np.maximum(q_sq - scores, 0.0))
+
+    def filter_index(self) -> FilterIndex:
+        if self._filter_index is None:
+            table = self.meta_table
+            if table is None:
+                from database.index_store import MetaTable
+                table = MetaTable.from_records([self.meta.get(_id, {}) for _id in self.ids])
+            self._filter_index = FilterIndex(table)
+        return self._filter_index
+
+    def _search_rows(self, q: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Exact scan restricted to candidate rows (pre-filtering), gathered chunk by chunk
+        blocks = _query_blocks(len(q), min(len(rows), INDEX_CHUNK_ROWS))
+        if len(blocks) > 1:
+            parts = [self._search_rows(q[qs:qe], rows, k) for qs, qe in blocks]
+            return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+        k = min(k, len(rows))
+        best_scores, best_idxs = None, None
+        for s in range(0, len(rows), INDEX_CHUNK_ROWS):
+            chunk = rows[s:s + INDEX_CHUNK_ROWS]
+            scores = q @ np.asarray(self.embeddings[chunk]).T
+            if self.metric == "euclidean":
+                scores = 2 * scores - self.sq_norms[chunk]
+            top_scores, top = _topk_rows(scores, k)
+            top = chunk[top]
+            if best_scores is not None:
+                top_scores = np.concatenate([best_scores, top_scores], axis=1)
+                top = np.concatenate([best_idxs, top], axis=1)
+                top_scores, pos = _topk_rows(top_scores, k)
+                top = np.take_along_axis(top, pos, axis=1)
+            best_scores, best_idxs = top_scores, top
+        return self._distances(q, best_scores), best_idxs
+
+    def search_filtered(self, queries, k: int, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Top-k among rows where mask is True. Selective filters scan only the
+        # candidates (pre-filter); broad filters over-fetch from the normal search
+        # and drop non-matching rows (post-filter), falling back to a pre-filter
+        # scan if too few survive. Missing slots are returned as row -1.
+        q = self._prepare(queries)
+        n_candidates = int(np.count_nonzero(mask))
+        if n_candidates == 0:
+            return np.full((q.shape[0], 0), np.inf, dtype=np.float32), np.full((q.shape[0], 0), -1)
+        selectivity = n_candidates / len(mask)
+        if n_candidates > k and selectivity >= FILTER_PREFILTER_SELECTIVITY:
+            k_wide = min(len(mask), int(np.ceil(k / selectivity * FILTER_OVERFETCH)))
+            dists, idxs = self.search(q, k_wide)
+            ok = (idxs >= 0) & mask[np.maximum(idxs, 0)]
+            if ok.sum(axis=1).min() >= k:
+                pos = np.argsort(~ok, axis=1, kind="stable")[:, :k]
+                return np.take_along_axis(dists, pos, axis=1), np.take_along_axis(idxs, pos, axis=1)
+        return self._search_rows(q, np.flatnonzero(mask), k)
+
+    def _results(self, dists: np.ndarray, idxs: np.ndarray) -> List[Dict[str, Any]]:
         results = []
-        for dist, idx in zip(dists[0], idxs[0]):
+        for dist, idx in zip(dists, idxs):
             _id = self.ids[int(idx)]
+            meta = self.meta_table.row(int(idx)) if self.meta_table is not None else self.meta.get(_id, {})
             results.append({
                 "artwork_id": _id,
                 "distance": float(dist),
-                "meta": self.meta.get(_id, {})
+                "meta": meta
             })
-        return results
\ No newline at end of file
+        return results
+
+    def query(self, q_embedding: List[float], k: int = 5,
+              filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        return self.query_batch([q_embedding], k, filters)[0]
+
+    def query_batch(self, q_embeddings, k: int = 5,
+                    filters: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        if filters:
+            dists, idxs = self.search_filtered(q_embeddings, k, self.filter_index().mask(filters))
+        else:
+            dists, idxs = self.search(q_embeddings, k)
+        return [self._results(d, i) for d, i in zip(dists, idxs)]
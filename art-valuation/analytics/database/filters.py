@@ -0,0 +1,124 @@
+from datetime import timezone
+from typing import Any, Dict, Optional
+import numpy as np
+import pandas as pd
+from config.settings import FILTER_BITMAP_MAX_CARDINALITY
+
+# Filter spec accepted by filtered kNN queries, keyed by metadata field:
+#   {"medium": "Oil"}                       equality
+#   {"medium": ["Oil", "Acrylic"]}          any of
+#   {"sold": True}
+#   {"sale_price": {"gte": 1000, "lt": 5000}}
+#   {"sale_date": {"gte": "2020-01-01"}}    dates as ISO strings, date or datetime
+# Conditions on different fields are AND-ed. Unknown fields match nothing.
+
+RANGE_OPS = ("gt", "gte", "lt", "lte")
+
+def _to_number(value, kind: str) -> float:
+    if kind == "date":
+        ts = pd.Timestamp(value)
+        if ts.tzinfo is None:
+            ts = ts.tz_localize(timezone.utc)
+        return ts.timestamp()
+    return float(value)
+
+class FilterIndex:
+    # Precomputed per-column structures over a MetaTable:
+    #  - low-cardinality categorical columns: one packed bitmap per value
+    #  - high-cardinality categorical columns: CSR postings (rows grouped by code)
+    #  - numeric/date columns: row ids sorted by value, for range lookups by searchsorted
+    # Built lazily per column on first use and kept for the life of the index handle.
+
+    def __init__(self, meta_table):
+        self.meta = meta_table
+        self.count = len(meta_table)
+        self._cache: Dict[str, Dict[str, Any]] = {}
+
+    def _column(self, name: str) -> Optional[Dict[str, Any]]:
+        if name in self._cache:
+            return self._cache[name]
+        col = self.meta.columns.get(name)
+        if col is None:
+            return None
+        if col["kind"] in ("float", "date"):
+            values = np.asarray(col["values"])
+            order = np.argsort(values, kind="stable")
+            sorted_values = values[order]
+            n_valid = int(np.count_nonzero(~np.isnan(sorted_values)))  # NaNs sort last
+            entry = {"kind": "range", "value_kind": col["kind"], "order": order[:n_valid],
+                     "sorted": sorted_values[:n_valid]}
+        else:
+            codes = np.asarray(col["codes"])
+            dictionary = col["dictionary"]
+            lookup = {}
+            for code, v in enumerate(dictionary):
+                lookup.setdefault(v, code)
+                lookup.setdefault(str(v), code)
+            entry = {"kind": "category", "lookup": lookup}
+            if len(dictionary) <= FILTER_BITMAP_MAX_CARDINALITY:
+                entry["bitmaps"] = [np.packbits(codes == c) for c in range(len(dictionary))]
+            else:
+                valid = np.flatnonzero(codes >= 0)
+                order = valid[np.argsort(codes[valid], kind="stable")]
+                counts = np.bincount(codes[valid], minlength=len(dictionary))
+                entry["postings"] = order
+                entry["offsets"] = np.concatenate([[0], np.cumsum(counts)])
+        self._cache[name] = entry
+        return entry
+
+    def _category_mask(self, entry: Dict[str, Any], values) -> np.ndarray:
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        mask = np.zeros(self.count, dtype=bool)
+        for v in values:
+            code = entry["lookup"].get(v)
+            if code is None:
+                code = entry["lookup"].get(str(v))
+            if code is None:
+                continue
+            if "bitmaps" in entry:
+                mask |= np.unpackbits(entry["bitmaps"][code], count=self.count).astype(bool)
+            else:
+                mask[entry["postings"][entry["offsets"][code]:entry["offsets"][code + 1]]] = True
+        return mask
+
+    def _range_mask(self, entry: Dict[str, Any], spec) -> np.ndarray:
+        if not isinstance(spec, dict):
+            spec = {"gte": spec, "lte": spec}
+        sorted_values = entry["sorted"]
+        lo, hi = 0, len(sorted_values)
+        for op, raw in spec.items():
+            if op not in RANGE_OPS:
+                raise ValueError(f"Unknown range operator: {op}")
+            if raw is None:
+                continue
+            bound = _to_number(raw, entry["value_kind"])
+            if op == "gt":
+                lo = max(lo, int(np.searchsorted(sorted_values, bound, side="right")))
+            elif op == "gte":
+                lo = max(lo, int(np.searchsorted(sorted_values, bound, side="left")))
+            elif op == "lt":
+                hi = min(hi, int(np.searchsorted(sorted_values, bound, side="left")))
+            else:
+                hi = min(hi, int(np.searchsorted(sorted_values, bound, side="right")))
+        mask = np.zeros(self.count, dtype=bool)
+        if lo < hi:
+            mask[entry["order"][lo:hi]] = True
+        return mask
+
+    def mask(self, filters: Dict[str, Any]) -> np.ndarray:
+        # Boolean candidate mask for a filter spec
+        mask = np.ones(self.count, dtype=bool)
+        for name, spec in filters.items():
+            if spec is None:
+                continue
+            entry = self._column(name)
+            if entry is None:
+                return np.zeros(self.count, dtype=bool)
+            if entry["kind"] == "range":
+                mask &= self._range_mask(entry, spec)
+            else:
+                mask &= self._category_mask(entry, spec)
+            if not mask.any():
+                break
+        return mask
@@ -0,0 +1,323 @@
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+import numpy as np
+from database.embeddings import ImageEmbeddingIndex
+from database.ann_index import IVFImageEmbeddingIndex
+
+# On-disk index layout:
+#   <root>/CURRENT               name of the live generation directory
+#   <root>/gen-000001/header.json    counts, dim, metric, index type, column kinds
+#                     vectors.f32    raw (N, D) float32, opened with np.memmap
+#                     sqnorms.f32    (N,) squared row norms, euclidean indexes only
+#                     ids.bin/.off   utf-8 ids and an (N + 1) int64 offset table
+#                     meta.<col>.*   columnar metadata (see MetaTable)
+#                     centroids.f32, cells.i64   IVF quantizer, when present
+#                     codes.u8, codebooks.f32, rotation.f32   PQ/OPQ codec, when present
+# Writers build a new generation and atomically swap CURRENT, so readers never
+# see a half-written index and mapped pages are shared between processes.
+
+FORMAT_VERSION = 1
+NUMERIC_KINDS = ("float", "date")
+
+class IdTable:
+    # Read-only id lookup over a mapped offset table and byte blob
+
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    @staticmethod
+    def write(ids: List[str], directory: str):
+        encoded = [str(i).encode("utf-8") for i in ids]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        offsets.tofile(os.path.join(directory, "ids.off"))
+        with open(os.path.join(directory, "ids.bin"), "wb") as f:
+            f.write(b"".join(encoded))
+
+    @classmethod
+    def open(cls, directory: str, count: int) -> "IdTable":
+        offsets = np.memmap(os.path.join(directory, "ids.off"), dtype=np.int64, mode="r", shape=(count + 1,))
+        blob_path = os.path.join(directory, "ids.bin")
+        blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if os.path.getsize(blob_path) else np.empty(0, np.uint8)
+        return cls(offsets, blob)
+
+class MetaTable:
+    # Row-aligned metadata stored column by column: numeric fields as float64
+    # (NaN for missing), dates as float64 epoch seconds, everything else
+    # dictionary-encoded as int32 codes (-1 for missing) plus a JSON list of
+    # distinct values.
+
+    def __init__(self, columns: Dict[str, Dict[str, Any]], count: int):
+        self.columns = columns
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def row(self, i: int) -> Dict[str, Any]:
+        out = {}
+        for name, col in self.columns.items():
+            if col["kind"] == "float":
+                v = col["values"][i]
+                out[name] = None if np.isnan(v) else float(v)
+            elif col["kind"] == "date":
+                v = col["values"][i]
+                out[name] = None if np.isnan(v) else datetime.fromtimestamp(float(v), timezone.utc).date().isoformat()
+            else:
+                code = col["codes"][i]
+                out[name] = None if code < 0 else col["dictionary"][code]
+        return out
+
+    @staticmethod
+    def _kind(values: List[Any]) -> str:
+        present = [v for v in values if v is not None]
+        if present and all(isinstance(v, (datetime, np.datetime64)) for v in present):
+            return "date"
+        if present and all(isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, (bool, np.bool_))
+                           for v in present):
+            return "float"
+        return "dict"
+
+    @classmethod
+    def from_records(cls, records: List[Dict[str, Any]]) -> "MetaTable":
+        names = []
+        for r in records:
+            for key in r:
+                if key not in names:
+                    names.append(key)
+        columns = {}
+        for name in names:
+            values = [r.get(name) for r in records]
+            kind = cls._kind(values)
+            if kind == "float":
+                columns[name] = {"kind": "float",
+                                 "values": np.array([np.nan if v is None else v for v in values], dtype=np.float64)}
+            elif kind == "date":
+                columns[name] = {"kind": "date", "values": np.array(
+                    [np.nan if v is None else _epoch_seconds(v) for v in values], dtype=np.float64)}
+            else:
+                dictionary, lookup = [], {}
+                codes = np.empty(len(values), dtype=np.int32)
+                for i, v in enumerate(values):
+                    if v is None:
+                        codes[i] = -1
+                        continue
+                    key = (type(v).__name__, v)
+                    if key not in lookup:
+                        lookup[key] = len(dictionary)
+                        dictionary.append(v.item() if isinstance(v, np.generic) else v)
+                    codes[i] = lookup[key]
+                columns[name] = {"kind": "dict", "codes": codes, "dictionary": dictionary}
+        return cls(columns, len(records))
+
+    def take(self, rows: np.ndarray) -> "MetaTable":
+        columns = {}
+        for name, col in self.columns.items():
+            if col["kind"] in NUMERIC_KINDS:
+                columns[name] = {"kind": col["kind"], "values": np.asarray(col["values"])[rows]}
+            else:
+                columns[name] = {"kind": "dict", "codes": np.asarray(col["codes"])[rows],
+                                 "dictionary": col["dictionary"]}
+        return MetaTable(columns, len(rows))
+
+    @classmethod
+    def concat(cls, tables: List["MetaTable"]) -> "MetaTable":
+        # Concatenate row-wise, merging dictionaries and remapping codes
+        names = []
+        for t in tables:
+            for name in t.columns:
+                if name not in names:
+                    names.append(name)
+        columns = {}
+        for name in names:
+            kinds = {t.columns[name]["kind"] for t in tables if name in t.columns}
+            if len(kinds) == 1 and kinds <= set(NUMERIC_KINDS):
+                columns[name] = {"kind": kinds.pop(), "values": np.concatenate([
+                    np.asarray(t.columns[name]["values"]) if name in t.columns else np.full(t.count, np.nan)
+                    for t in tables])}
+                continue
+            dictionary, lookup, parts = [], {}, []
+            for t in tables:
+                col = t.columns.get(name)
+                if col is None:
+                    parts.append(np.full(t.count, -1, dtype=np.int32))
+                    continue
+                if col["kind"] in NUMERIC_KINDS:
+                    values = [None if np.isnan(v) else float(v) for v in col["values"]]
+                    col = cls.from_records([{name: v} for v in values]).columns[name]
+                remap = np.empty(len(col["dictionary"]) + 1, dtype=np.int32)
+                remap[-1] = -1
+                for code, v in enumerate(col["dictionary"]):
+                    key = (type(v).__name__, v)
+                    if key not in lookup:
+                        lookup[key] = len(dictionary)
+                        dictionary.append(v)
+                    remap[code] = lookup[key]
+                parts.append(remap[np.asarray(col["codes"])])
+            columns[name] = {"kind": "dict", "codes": np.concatenate(parts), "dictionary": dictionary}
+        return cls(columns, sum(t.count for t in tables))
+
+    def write(self, directory: str) -> Dict[str, str]:
+        kinds = {}
+        for name, col in self.columns.items():
+            base = os.path.join(directory, f"meta.{name}")
+            if col["kind"] in NUMERIC_KINDS:
+                np.asarray(col["values"], dtype=np.float64).tofile(base + ".f64")
+            else:
+                np.asarray(col["codes"], dtype=np.int32).tofile(base + ".codes")
+                with open(base + ".dict.json", "w", encoding="utf-8") as f:
+                    json.dump(col["dictionary"], f, default=str)
+            kinds[name] = col["kind"]
+        return kinds
+
+    @classmethod
+    def open(cls, directory: str, kinds: Dict[str, str], count: int) -> "MetaTable":
+        columns = {}
+        for name, kind in kinds.items():
+            base = os.path.join(directory, f"meta.{name}")
+            if kind in NUMERIC_KINDS:
+                columns[name] = {"kind": kind, "values": _map(base + ".f64", np.float64, (count,))}
+            else:
+                columns[name] = _LazyDictColumn(base + ".dict.json", kind=kind,
+                                                codes=_map(base + ".codes", np.int32, (count,)))
+        return cls(columns, count)
+
+class _LazyDictColumn(dict):
+    # Dictionary-encoded column whose JSON dictionary is only parsed when first
+    # used, so opening an index stays O(columns) rather than O(distinct values)
+
+    def __init__(self, path: str, **fields):
+        super().__init__(**fields)
+        self.path = path
+
+    def __missing__(self, key):
+        if key != "dictionary":
+            raise KeyError(key)
+        with open(self.path, encoding="utf-8") as f:
+            self["dictionary"] = json.load(f)
+        return self["dictionary"]
+
+def _epoch_seconds(value) -> float:
+    if isinstance(value, np.datetime64):
+        return float(value.astype("datetime64[ms]").astype(np.int64)) / 1000.0
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+def _map(path: str, dtype, shape) -> np.ndarray:
+    # np.memmap refuses zero-length files
+    if not int(np.prod(shape)):
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+def current_generation(root: str) -> Optional[str]:
+    try:
+        with open(os.path.join(root, "CURRENT"), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def write_index_dir(index: ImageEmbeddingIndex, directory: str):
+    # Write vectors, ids, metadata and header for one index into an existing directory
+    vectors = np.ascontiguousarray(index.embeddings, dtype=np.float32)
+    vectors.tofile(os.path.join(directory, "vectors.f32"))
+    ids = list(index.ids)
+    IdTable.write(ids, directory)
+    meta = index.meta_table or MetaTable.from_records([index.meta.get(_id, {}) for _id in ids])
+    header = {
+        "format": FORMAT_VERSION,
+        "count": int(vectors.shape[0]),
+        "dim": int(vectors.shape[1]),
+        "metric": index.metric,
+        "normalized": index.metric == "cosine",
+        "index_type": "exact",
+        "meta_columns": meta.write(directory),
+    }
+    if index.metric == "euclidean" and index.sq_norms is not None:
+        np.asarray(index.sq_norms, dtype=np.float32).tofile(os.path.join(directory, "sqnorms.f32"))
+        header["sq_norms"] = True
+    if index.index_type == "ivf":
+        np.ascontiguousarray(index.centroids, dtype=np.float32).tofile(os.path.join(directory, "centroids.f32"))
+        np.asarray(index.cell_offsets, dtype=np.int64).tofile(os.path.join(directory, "cells.i64"))
+        header.update({"index_type": "ivf", "nlist": int(len(index.centroids)), "nprobe": index.nprobe})
+    elif index.index_type == "pq":
+        np.ascontiguousarray(index.codes, dtype=np.uint8).tofile(os.path.join(directory, "codes.u8"))
+        np.ascontiguousarray(index.pq.codebooks, dtype=np.float32).tofile(os.path.join(directory, "codebooks.f32"))
+        if index.pq.rotation is not None:
+            np.ascontiguousarray(index.pq.rotation, dtype=np.float32).tofile(os.path.join(directory, "rotation.f32"))
+        header.update({"index_type": "pq", "m": index.pq.m, "opq": index.pq.rotation is not None,
+                       "rerank": index.rerank})
+    with open(os.path.join(directory, "header.json"), "w", encoding="utf-8") as f:
+        json.dump(header, f, indent=2)
+
+def write_index(index: ImageEmbeddingIndex, root: str, keep_generations: int = 2) -> str:
+    # Write the index as a new generation and make it current; returns the generation name
+    os.makedirs(root, exist_ok=True)
+    previous = current_generation(root)
+    number = int(previous.split("-")[1]) + 1 if previous else 1
+    generation = f"gen-{number:06d}"
+    tmp_dir = os.path.join(root, generation + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    write_index_dir(index, tmp_dir)
+
+    os.replace(tmp_dir, os.path.join(root, generation))
+    pointer = os.path.join(root, "CURRENT.tmp")
+    with open(pointer, "w", encoding="utf-8") as f:
+        f.write(generation)
+    os.replace(pointer, os.path.join(root, "CURRENT"))
+
+    # Old generations may still be mapped by readers; unlinking is safe on POSIX
+    generations = sorted(d for d in os.listdir(root) if d.startswith("gen-") and not d.endswith(".tmp"))
+    for old in generations[:-keep_generations]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return generation
+
+def read_index(root: str, generation: Optional[str] = None) -> ImageEmbeddingIndex:
+    # Opens a generation without reading the vectors: everything is memory-mapped
+    generation = generation or current_generation(root)
+    if generation is None:
+        raise RuntimeError(f"No index found at {root}.")
+    index = read_index_dir(os.path.join(root, generation))
+    index.generation = generation
+    return index
+
+def read_index_dir(directory: str) -> ImageEmbeddingIndex:
+    with open(os.path.join(directory, "header.json"), encoding="utf-8") as f:
+        header = json.load(f)
+    count, dim = header["count"], header["dim"]
+
+    if header["index_type"] == "ivf":
+        index = IVFImageEmbeddingIndex(metric=header["metric"], nlist=header["nlist"], nprobe=header["nprobe"])
+        index.centroids = _map(os.path.join(directory, "centroids.f32"), np.float32, (header["nlist"], dim))
+        index.cell_offsets = _map(os.path.join(directory, "cells.i64"), np.int64, (header["nlist"] + 1,))
+    elif header["index_type"] == "pq":
+        from database.pq_index import PQImageEmbeddingIndex, KSUB
+        m = header["m"]
+        index = PQImageEmbeddingIndex(metric=header["metric"], m=m, opq=header["opq"], rerank=header["rerank"])
+        index.codes = _map(os.path.join(directory, "codes.u8"), np.uint8, (count, m))
+        index.pq.codebooks = np.fromfile(os.path.join(directory, "codebooks.f32"), dtype=np.float32).reshape(m, KSUB, -1)
+        if header["opq"]:
+            index.pq.rotation = np.fromfile(os.path.join(directory, "rotation.f32"), dtype=np.float32).reshape(dim, dim)
+    else:
+        index = ImageEmbeddingIndex(metric=header["metric"])
+    index.embeddings = _map(os.path.join(directory, "vectors.f32"), np.float32, (count, dim))
+    index.ids = IdTable.open(directory, count)
+    index.meta_table = MetaTable.open(directory, header["meta_columns"], count)
+    index.meta = {}
+    sq_norms = _map(os.path.join(directory, "sqnorms.f32"), np.float32, (count,)) if header.get("sq_norms") else None
+    index._finish_build(sq_norms)
+    return index
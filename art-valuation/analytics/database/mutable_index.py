@@ -0,0 +1,302 @@
+import json
+import os
+import shutil
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from database.embeddings import ImageEmbeddingIndex, _topk_rows
+from database.ann_index import create_index, load_index
+from database.index_store import (MetaTable, current_generation, read_index, read_index_dir,
+                                  write_index, write_index_dir)
+from config.settings import INDEX_MAX_SEGMENTS, INDEX_MAX_DEAD_FRACTION, INDEX_TYPE
+
+# Mutations are stored next to the base generation as small delta segments:
+#   <root>/<gen>/SEGMENTS.json        {"seq": n, "segments": [{"name", "count", "dead"}]}
+#   <root>/<gen>/seg-000001/          same files as a base index (may be empty)
+#                          dead.npy   (M, 2) int64 [segment, row] pairs this delta retires
+# Segment 0 is the base index; segment i is the i-th delta. A row is live unless
+# a later delta listed it in dead.npy, so readers never need an id -> row map.
+
+SEGMENTS = "SEGMENTS.json"
+
+def _read_segments(gen_dir: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(gen_dir, SEGMENTS), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"seq": 0, "segments": []}
+
+class SegmentedIndex:
+    # Query view over a base index plus its delta segments. A segment with
+    # tombstones is searched with its live mask (search_filtered: a bounded
+    # over-fetch, or an exact scan of the live rows when few are left), and
+    # the per-segment results are merged by distance.
+
+    def __init__(self, base: ImageEmbeddingIndex, segments: List[ImageEmbeddingIndex],
+                 dead: List[np.ndarray], seq: int = 0):
+        self.base = base
+        self.segments = [base] + segments
+        self.seq = seq
+        self.generation = base.generation
+        self.metric = base.metric
+        self.live = [np.ones(len(s.ids), dtype=bool) for s in self.segments]
+        for pairs in dead:
+            for seg, row in pairs:
+                self.live[int(seg)][int(row)] = False
+        self.dead_counts = [int((~m).sum()) for m in self.live]
+
+    @property
+    def count(self) -> int:
+        return sum(int(m.sum()) for m in self.live)
+
+    @property
+    def dead_fraction(self) -> float:
+        total = sum(len(m) for m in self.live)
+        return sum(self.dead_counts) / total if total else 0.0
+
+    def search(self, queries, k: int = 5,
+               filters: Optional[Dict[str, Any]] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Returns (distances, segment numbers, rows), each (Q, k); missing slots have segment -1.
+        # Tombstones are folded into each segment's candidate mask, so k is never
+        # widened by the number of dead rows.
+        q = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        all_d, all_s, all_r = [], [], []
+        for n, (segment, live) in enumerate(zip(self.segments, self.live)):
+            if not len(live) or not live.any():
+                continue
+            if filters:
+                d, r = segment.search_filtered(q, k, segment.filter_index().mask(filters) & live)
+            elif self.dead_counts[n]:
+                d, r = segment.search_filtered(q, k, live)
+            else:
+                d, r = segment.search(q, k)
+            ok = (r >= 0) & live[np.maximum(r, 0)]
+            all_d.append(np.where(ok, d, np.inf))
+            all_s.append(np.where(ok, n, -1))
+            all_r.append(np.where(ok, r, -1))
+        if not all_d:
+            empty = np.full((q.shape[0], 0), -1)
+            return empty.astype(np.float32), empty, empty
+        d, s, r = (np.concatenate(x, axis=1) for x in (all_d, all_s, all_r))
+        neg, pos = _topk_rows(-d, k)
+        return -neg, np.take_along_axis(s, pos, axis=1), np.take_along_axis(r, pos, axis=1)
+
+    def _results(self, dists, segs, rows) -> List[Dict[str, Any]]:
+        results = []
+        for dist, seg, row in zip(dists, segs, rows):
+            if seg < 0:
+                continue
+            results.append(self.segments[seg]._results(np.array([dist]), np.array([row]))[0])
+        return results
+
+    def query(self, q_embedding: List[float], k: int = 5,
+              filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        d, s, r = self.search(q_embedding, k, filters)
+        return self._results(d[0], s[0], r[0])
+
+    def query_batch(self, q_embeddings, k: int = 5,
+                    filters: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        d, s, r = self.search(q_embeddings, k, filters)
+        return [self._results(*row) for row in zip(d, s, r)]
+
+def open_segmented(root: str, generation: Optional[str] = None,
+                   reuse: Optional[SegmentedIndex] = None) -> SegmentedIndex:
+    # Opens a generation with its deltas; segments already opened by `reuse` are kept
+    generation = generation or current_generation(root)
+    gen_dir = os.path.join(root, generation)
+    manifest = _read_segments(gen_dir)
+    if reuse is not None and reuse.generation == generation:
+        base = reuse.base
+        opened = {e["name"]: seg for e, seg in zip(reuse.entries, reuse.segments[1:])}
+    else:
+        base, opened = read_index(root, generation), {}
+
+    segments, dead = [], []
+    for entry in manifest["segments"]:
+        seg_dir = os.path.join(gen_dir, entry["name"])
+        if entry["name"] in opened:
+            segments.append(opened[entry["name"]])
+        elif entry["count"]:
+            segments.append(read_index_dir(seg_dir))
+        else:
+            empty = ImageEmbeddingIndex(metric=base.metric)
+            empty.ids = []
+            segments.append(empty)
+        if entry["dead"]:
+            dead.append(np.load(os.path.join(seg_dir, "dead.npy")))
+    index = SegmentedIndex(base, segments, dead, manifest["seq"])
+    index.entries = manifest["segments"]
+    return index
+
+class IndexWriter:
+    # Applies add / upsert / delete batches as delta segments and compacts
+    # them into a new base generation. One writer per index directory.
+
+    def __init__(self, root: str):
+        self.root = root
+        self.lock = threading.Lock()
+        self._compactor: Optional[threading.Thread] = None
+        self._open()
+
+    def _open(self):
+        self.generation = current_generation(self.root)
+        if self.generation is None:
+            raise RuntimeError(f"No index found at {self.root}; write a base index first.")
+        self.gen_dir = os.path.join(self.root, self.generation)
+        self.index = open_segmented(self.root, self.generation)
+        self._locations: Optional[Dict[str, Tuple[int, int]]] = None
+
+    def _location_map(self) -> Dict[str, Tuple[int, int]]:
+        # id -> (segment, row) of the live copy; built once per writer
+        if self._locations is None:
+            locations = {}
+            for n, (segment, live) in enumerate(zip(self.index.segments, self.index.live)):
+                for row in np.flatnonzero(live):
+                    locations[segment.ids[int(row)]] = (n, int(row))
+            self._locations = locations
+        return self._locations
+
+    def _append_segment(self, ids: List[str], vectors, meta_list: List[Dict[str, Any]],
+                        dead: List[Tuple[int, int]]):
+        manifest = _read_segments(self.gen_dir)
+        manifest["seq"] += 1
+        name = f"seg-{manifest['seq']:06d}"
+        tmp_dir = os.path.join(self.gen_dir, name + ".tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        if ids:
+            delta = ImageEmbeddingIndex(metric=self.index.metric)
+            delta.build(ids, vectors, meta_list)
+            write_index_dir(delta, tmp_dir)
+        if dead:
+            np.save(os.path.join(tmp_dir, "dead.npy"), np.asarray(dead, dtype=np.int64))
+        os.replace(tmp_dir, os.path.join(self.gen_dir, name))
+
+        manifest["segments"].append({"name": name, "count": len(ids), "dead": len(dead)})
+        path = os.path.join(self.gen_dir, SEGMENTS)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+        self.index = open_segmented(self.root, self.generation, reuse=self.index)
+        if self._locations is not None:
+            n = len(self.index.segments) - 1
+            for row, _id in enumerate(ids):
+                self._locations[_id] = (n, row)
+
+    def add(self, ids: List[str], vectors, meta_list: List[Dict[str, Any]]):
+        # Append vectors for ids that are known to be new (no existence check)
+        with self.lock:
+            self._append_segment(list(ids), vectors, meta_list, [])
+        self._maybe_compact()
+
+    def upsert(self, ids: List[str], vectors, meta_list: List[Dict[str, Any]]):
+        # Insert new ids and replace the vectors/metadata of existing ones
+        ids = list(ids)
+        last = {_id: i for i, _id in enumerate(ids)}
+        if len(last) < len(ids):
+            keep = sorted(last.values())
+            ids = [ids[i] for i in keep]
+            vectors = np.asarray(vectors)[keep]
+            meta_list = [meta_list[i] for i in keep]
+        with self.lock:
+            locations = self._location_map()
+            dead = [locations[_id] for _id in ids if _id in locations]
+            self._append_segment(ids, vectors, meta_list, dead)
+        self._maybe_compact()
+
+    def delete(self, ids: List[str]):
+        # Tombstone ids; unknown ids are ignored
+        with self.lock:
+            locations = self._location_map()
+            dead = [locations.pop(_id) for _id in ids if _id in locations]
+            if dead:
+                self._append_segment([], None, [], dead)
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        if (len(self.index.segments) - 1 > INDEX_MAX_SEGMENTS
+                or self.index.dead_fraction > INDEX_MAX_DEAD_FRACTION):
+            self.compact_in_background()
+
+    def compact(self) -> str:
+        # Merge live rows of every segment into a new base generation.
+        # Readers keep querying the old generation until CURRENT flips.
+        with self.lock:
+            index = self.index
+            vectors, ids, metas = [], [], []
+            for segment, live in zip(index.segments, index.live):
+                rows = np.flatnonzero(live)
+                if not len(rows):
+                    continue
+                vectors.append(np.asarray(segment.embeddings)[rows])
+                ids.extend(segment.ids[int(r)] for r in rows)
+                table = segment.meta_table or MetaTable.from_records(
+                    [segment.meta.get(segment.ids[int(r)], {}) for r in range(len(segment.ids))])
+                metas.append(table.take(rows))
+            if not ids:
+                raise RuntimeError("Cannot compact an empty index.")
+
+            # A base that fell back to exact (too small for PQ) gets the configured type once it has grown
+            index_type = index.base.index_type if index.base.index_type != "exact" else INDEX_TYPE
+            merged = create_index(index_type, metric=index.metric, n_vectors=len(ids))
+            merged.ids = ids
+            merged.embeddings = np.ascontiguousarray(np.concatenate(vectors), dtype=np.float32)
+            merged.meta_table = MetaTable.concat(metas)
+            merged._finish_build()
+            same_type = merged.index_type == index.base.index_type
+            if merged.index_type == "pq":
+                if same_type:
+                    merged.rerank = index.base.rerank
+                    merged.pq = type(index.base.pq)(m=index.base.pq.m, opq=index.base.pq.opq)
+                merged.train()
+            elif merged.index_type == "ivf":
+                if same_type:
+                    merged.nprobe = index.base.nprobe
+                # Training reorders rows, so go through per-id metadata
+                meta_by_id = dict(zip(ids, (merged.meta_table.row(i) for i in range(len(ids)))))
+                merged.meta_table = None
+                merged.meta = meta_by_id
+                merged.train()
+
+            generation = write_index(merged, self.root)
+            print(f"Compacted {len(index.segments) - 1} delta segments into {generation} ({len(ids)} vectors)")
+            self._open()
+            return generation
+
+    def compact_in_background(self) -> threading.Thread:
+        if self._compactor is not None and self._compactor.is_alive():
+            return self._compactor
+        self._compactor = threading.Thread(target=self.compact, name="index-compaction", daemon=True)
+        self._compactor.start()
+        return self._compactor
+
+    def wait(self):
+        if self._compactor is not None:
+            self._compactor.join()
+
+_handles: Dict[str, Any] = {}
+_handles_lock = threading.Lock()
+
+def open_index(path: str):
+    # Long-lived handle per index path. Reopens the base only when CURRENT
+    # changes and only the new delta segments when SEGMENTS.json changes.
+    # Legacy joblib files are loaded once and cached by modification time.
+    with _handles_lock:
+        cached = _handles.get(path)
+        if os.path.isfile(path):
+            stamp = os.path.getmtime(path)
+            if cached is None or cached.generation != stamp:
+                cached = load_index(path)
+                cached.generation = stamp
+                _handles[path] = cached
+            return cached
+
+        generation = current_generation(path)
+        if generation is None:
+            raise RuntimeError(f"No index found at {path}.")
+        seq = _read_segments(os.path.join(path, generation))["seq"]
+        if cached is None or cached.generation != generation or cached.seq != seq:
+            cached = open_segmented(path, generation, reuse=cached)
+            _handles[path] = cached
+        return cached
@@ -0,0 +1,172 @@
+import numpy as np
+import joblib
+from typing import Dict, List, Any, Optional, Tuple
+from database.embeddings import ImageEmbeddingIndex, _query_blocks, _topk_rows
+from database.ann_index import train_kmeans, assign_clusters
+from config.settings import PQ_M, PQ_OPQ, PQ_RERANK, PQ_TRAIN_SAMPLE, INDEX_CHUNK_ROWS
+
+KSUB = 256  # centroids per subspace, so every sub-code is one byte
+
+class ProductQuantizer:
+    # Splits (optionally rotated) vectors into m sub-vectors and stores each as
+    # the uint8 id of its nearest sub-codebook centroid: m bytes per vector.
+    # OPQ learns the rotation by alternating PQ training with an orthogonal
+    # Procrustes fit of the rotation to the current reconstructions.
+
+    def __init__(self, m: int = PQ_M, opq: bool = PQ_OPQ):
+        self.m = m
+        self.opq = opq
+        self.codebooks: Optional[np.ndarray] = None   # (m, KSUB, dsub)
+        self.rotation: Optional[np.ndarray] = None    # (D, D) or None
+
+    def _train_codebooks(self, x: np.ndarray, n_iter: int) -> np.ndarray:
+        dsub = x.shape[1] // self.m
+        return np.stack([
+            train_kmeans(np.ascontiguousarray(x[:, j * dsub:(j + 1) * dsub]), KSUB,
+                         n_iter=n_iter, seed=j, spherical=False)
+            for j in range(self.m)
+        ])
+
+    def train(self, x: np.ndarray, opq_iters: int = 5):
+        dim = x.shape[1]
+        if dim % self.m:
+            raise ValueError(f"Embedding dim {dim} is not divisible by PQ_M={self.m}")
+        if x.shape[0] < KSUB:
+            raise ValueError(f"PQ needs at least {KSUB} training vectors, got {x.shape[0]}")
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        self.rotation = None
+        if self.opq:
+            rotation = np.eye(dim, dtype=np.float32)
+            for _ in range(opq_iters):
+                xr = x @ rotation
+                self.codebooks = self._train_codebooks(xr, n_iter=4)
+                recon = self.decode(self.encode(xr, rotate=False))
+                u, _, vt = np.linalg.svd(x.T @ recon)
+                rotation = (u @ vt).astype(np.float32)
+            self.rotation = rotation
+            x = x @ rotation
+        self.codebooks = self._train_codebooks(x, n_iter=10)
+
+    def encode(self, x: np.ndarray, rotate: bool = True) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32)
+        if rotate and self.rotation is not None:
+            x = x @ self.rotation
+        dsub = x.shape[1] // self.m
+        codes = np.empty((x.shape[0], self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = assign_clusters(np.ascontiguousarray(x[:, j * dsub:(j + 1) * dsub]), self.codebooks[j])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        # Reconstruction in the rotated space
+        return np.concatenate([self.codebooks[j][codes[:, j]] for j in range(self.m)], axis=1)
+
+    def lookup_tables(self, q: np.ndarray, metric: str) -> np.ndarray:
+        # (Q, m * KSUB) flattened per-query tables: inner products for cosine, and
+        # 2 q.c - |c|^2 for euclidean (the exact index's score, minus the constant |q|^2)
+        if self.rotation is not None:
+            q = q @ self.rotation
+        dsub = q.shape[1] // self.m
+        tables = np.empty((q.shape[0], self.m, KSUB), dtype=np.float32)
+        for j in range(self.m):
+            sub = q[:, j * dsub:(j + 1) * dsub]
+            ip = sub @ self.codebooks[j].T
+            if metric == "cosine":
+                tables[:, j] = ip
+            else:
+                c_sq = np.einsum("ij,ij->i", self.codebooks[j], self.codebooks[j])
+                tables[:, j] = 2 * ip - c_sq
+        return tables.reshape(q.shape[0], -1)
+
+class PQImageEmbeddingIndex(ImageEmbeddingIndex):
+    # Compressed index: search scores m-byte PQ codes with asymmetric-distance
+    # lookup tables (the query stays full precision), then optionally re-ranks
+    # the top k * rerank candidates exactly against the full vectors, which are
+    # memory-mapped from disk when opened through database.index_store, so only
+    # the touched rows are paged in.
+
+    index_type = "pq"
+
+    def __init__(self, n_neighbors=5, metric="cosine", m: int = PQ_M, opq: bool = PQ_OPQ,
+                 rerank: int = PQ_RERANK):
+        super().__init__(n_neighbors=n_neighbors, metric=metric)
+        self.pq = ProductQuantizer(m=m, opq=opq)
+        self.rerank = rerank
+        self.codes: Optional[np.ndarray] = None
+
+    def build(self, id_list: List[str], embedding_list, meta_list: List[Dict[str, Any]]):
+        super().build(id_list, embedding_list, meta_list)
+        self.train()
+
+    def train(self, sample_size: int = PQ_TRAIN_SAMPLE):
+        x = self.embeddings
+        rng = np.random.default_rng(0)
+        sample = x if x.shape[0] <= sample_size else x[np.sort(rng.choice(x.shape[0], sample_size, replace=False))]
+        self.pq.train(np.asarray(sample))
+        self.codes = np.concatenate([
+            self.pq.encode(np.asarray(x[s:s + INDEX_CHUNK_ROWS])) for s in range(0, x.shape[0], INDEX_CHUNK_ROWS)
+        ])
+
+    def save(self, path: str):
+        joblib.dump({
+            "ids": self.ids,
+            "embeddings": self.embeddings,
+            "meta": self.meta,
+            "metric": self.metric,
+            "normalized": self.metric == "cosine",
+            "pq": {"codes": self.codes, "codebooks": self.pq.codebooks, "rotation": self.pq.rotation,
+                   "m": self.pq.m, "opq": self.pq.opq, "rerank": self.rerank}
+        }, path)
+
+    def load(self, path: str, data: Optional[Dict[str, Any]] = None):
+        if data is None:
+            data = joblib.load(path)
+        super().load(path, data)
+        pq = data.get("pq")
+        if pq is None:
+            self.train()
+            return
+        self.pq = ProductQuantizer(m=pq["m"], opq=pq["opq"])
+        self.pq.codebooks, self.pq.rotation = pq["codebooks"], pq["rotation"]
+        self.codes = pq["codes"]
+        self.rerank = pq["rerank"]
+
+    def _adc_topk(self, tables: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        offsets = np.arange(self.pq.m, dtype=np.intp) * KSUB
+        n = self.codes.shape[0]
+        best_scores, best_idxs = None, None
+        for s in range(0, n, INDEX_CHUNK_ROWS):
+            flat = np.asarray(self.codes[s:s + INDEX_CHUNK_ROWS], dtype=np.intp) + offsets
+            scores = np.stack([table[flat].sum(axis=1) for table in tables])
+            top_scores, top = _topk_rows(scores, k)
+            top = top + s
+            if best_scores is not None:
+                top_scores = np.concatenate([best_scores, top_scores], axis=1)
+                top = np.concatenate([best_idxs, top], axis=1)
+                top_scores, pos = _topk_rows(top_scores, k)
+                top = np.take_along_axis(top, pos, axis=1)
+            best_scores, best_idxs = top_scores, top
+        return best_scores, best_idxs
+
+    def search(self, queries, k: int = 5, rerank: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        if self.codes is None:
+            raise RuntimeError("Index not built/loaded.")
+        q = self._prepare(queries)
+        k = min(k, self.codes.shape[0])
+        rerank = self.rerank if rerank is None else rerank
+        dists = np.empty((q.shape[0], k), dtype=np.float32)
+        idxs = np.empty((q.shape[0], k), dtype=np.int64)
+        # Lookup tables and (block x chunk) ADC scores are built one query block at a time
+        for qs, qe in _query_blocks(len(q), min(self.codes.shape[0], INDEX_CHUNK_ROWS)):
+            block = q[qs:qe]
+            tables = self.pq.lookup_tables(block, self.metric)
+            if not rerank or self.embeddings is None:
+                scores, idxs[qs:qe] = self._adc_topk(tables, k)
+                dists[qs:qe] = self._distances(block, scores)
+                continue
+            _, candidates = self._adc_topk(tables, min(k * rerank, self.codes.shape[0]))
+            for i, rows in enumerate(candidates):
+                rows = np.sort(rows)  # sequential page access on the mapped vectors
+                d, top = self._search_rows(block[i:i + 1], rows, k)
+                dists[qs + i], idxs[qs + i] = d[0], top[0]
+        return dists, idxs
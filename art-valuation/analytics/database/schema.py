@@ -0,0 +1,74 @@
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+
+# Typed schema of the analytics DataFrame. Embeddings never live in the frame;
+# they are a separate float32 matrix (see database.db_manager.ArtworkTable).
+SCALAR_FIELDS = ("artist", "medium", "dim1", "dim2", "year_created", "sale_date",
+                 "value", "auction_house", "gallery", "sold")
+NUMERIC_FIELDS = ("dim1", "dim2", "value", "year_created")
+CATEGORICAL_FIELDS = ("artist", "medium", "auction_house", "gallery")
+FLOAT_DTYPE = np.float32
+
+try:
+    import pyarrow  # noqa: F401
+    ID_DTYPE = pd.StringDtype("pyarrow")
+except ImportError:
+    ID_DTYPE = object
+
+
+class CategoryEncoder:
+    # Maps values to integer codes chunk by chunk so a column is never held as
+    # Python objects; None/NaN become -1 (missing)
+
+    def __init__(self):
+        self.codes: Dict = {}
+        self.categories: List = []
+
+    def encode(self, values: list) -> np.ndarray:
+        out = np.empty(len(values), dtype=np.int32)
+        codes, categories = self.codes, self.categories
+        for i, v in enumerate(values):
+            if v is None or v != v:
+                out[i] = -1
+                continue
+            try:
+                code = codes.get(v)
+            except TypeError:  # unhashable (e.g. a list): keep its string form
+                v = str(v)
+                code = codes.get(v)
+            if code is None:
+                code = codes[v] = len(categories)
+                categories.append(v)
+            out[i] = code
+        return out
+
+    def categorical(self, codes: np.ndarray) -> pd.Categorical:
+        # Categories sorted (as astype("category") would), codes remapped in place
+        try:
+            order = sorted(range(len(self.categories)), key=self.categories.__getitem__)
+        except TypeError:
+            order = sorted(range(len(self.categories)), key=lambda i: str(self.categories[i]))
+        remap = np.empty(len(order) + 1, dtype=codes.dtype)
+        remap[np.asarray(order, dtype=np.int64)] = np.arange(len(order), dtype=codes.dtype)
+        remap[-1] = -1  # code -1 indexes the last slot
+        codes[:] = remap[codes]
+        categories = pd.Index([self.categories[i] for i in order], dtype=object)
+        return pd.Categorical.from_codes(codes, categories=categories)
+
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert the known columns of df to the typed schema in place (also returns df)"""
+    for f in CATEGORICAL_FIELDS:
+        if f in df.columns and not isinstance(df[f].dtype, pd.CategoricalDtype):
+            df[f] = df[f].astype("category")
+    for f in NUMERIC_FIELDS + ("area",):
+        if f in df.columns and df[f].dtype != FLOAT_DTYPE:
+            df[f] = pd.to_numeric(df[f], errors="coerce").astype(FLOAT_DTYPE)
+    if "sale_date" in df.columns and not pd.api.types.is_datetime64_any_dtype(df["sale_date"]):
+        df["sale_date"] = pd.to_datetime(df["sale_date"], errors="coerce")
+    if "sold" in df.columns and df["sold"].dtype != "boolean":
+        df["sold"] = df["sold"].map(lambda v: None if pd.isna(v) else bool(v)).astype("boolean")
+    if "_id" in df.columns and ID_DTYPE is not object and df["_id"].dtype != ID_DTYPE:
+        df["_id"] = df["_id"].astype(ID_DTYPE)
+    return df
@@ -0,0 +1,203 @@
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import numpy as np
+import pandas as pd
+from database.db_manager import ArtworkTable, SCALAR_FIELDS, load_artworks
+from database.schema import apply_schema
+from config.settings import SNAPSHOT_DIR, SNAPSHOT_WATERMARK, SNAPSHOT_MAX_PARTS
+
+MANIFEST = "manifest.json"
+
+class SnapshotStore:
+    # Local copy of the artworks collection: one Parquet file of scalar columns
+    # plus a float32 .npy embedding matrix per part, and a manifest holding the
+    # high-water mark. refresh() only pulls documents past the watermark.
+    #
+    # The watermark is either "_id" (catches inserts only) or a timestamp field
+    # such as "updated_at", which the pre-processor bumps whenever it writes
+    # metadata, so re-embedded documents are fetched again (later parts win on
+    # duplicate _id). A timestamp watermark also keeps an "_id" watermark, so
+    # inserts that never got the timestamp are still picked up.
+    # Deletes are not seen incrementally; rebuild() starts over.
+
+    def __init__(self, path: str = SNAPSHOT_DIR, watermark_field: str = SNAPSHOT_WATERMARK,
+                 max_parts: int = SNAPSHOT_MAX_PARTS):
+        if not path:
+            raise ValueError("SnapshotStore needs a directory (set SNAPSHOT_DIR).")
+        self.path = path
+        self.watermark_field = watermark_field
+        self.max_parts = max_parts
+        os.makedirs(path, exist_ok=True)
+        self.manifest = self._read_manifest()
+        # Documents fetched by the last incremental refresh (None after a full load)
+        self.last_delta: Optional[ArtworkTable] = None
+        # Ids in last_delta that were not in the snapshot before (inserts, not updates)
+        self.last_inserted: Optional[set] = None
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        path = os.path.join(self.path, MANIFEST)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("watermark_field") == self.watermark_field:
+                return manifest
+            print(f"Snapshot watermark changed to {self.watermark_field}; rebuilding")
+        return {"watermark_field": self.watermark_field, "watermark": None, "parts": [], "seq": 0}
+
+    def _write_manifest(self):
+        path = os.path.join(self.path, MANIFEST)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp, path)
+
+    def _fields(self) -> List[str]:
+        fields = list(SCALAR_FIELDS)
+        if self.watermark_field != "_id" and self.watermark_field not in fields:
+            fields.append(self.watermark_field)
+        return fields
+
+    def _delta_query(self) -> Optional[Dict[str, Any]]:
+        watermark = self.manifest["watermark"]
+        if self.watermark_field == "_id":
+            return None if watermark is None else {"_id": {"$gt": _object_id(watermark)}}
+        id_watermark = self.manifest.get("id_watermark")
+        id_query = None if id_watermark is None else {"_id": {"$gt": _object_id(id_watermark)}}
+        if watermark is None:
+            # No document carried the timestamp yet: inserts only, unless nothing is loaded at all
+            return id_query
+        query = {self.watermark_field: {"$gt": datetime.fromisoformat(watermark)}}
+        return query if id_query is None else {"$or": [query, id_query]}
+
+    def _max_watermark(self, df: pd.DataFrame, field: str, current):
+        values = df[field].dropna()
+        if values.empty:
+            return current
+        latest = values.max()
+        return latest.isoformat() if hasattr(latest, "isoformat") else str(latest)
+
+    def _write_part(self, table: ArtworkTable) -> Dict[str, Any]:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.manifest["seq"] += 1
+        name = f"part-{self.manifest['seq']:05d}"
+        df = table.df.drop(columns=["area"], errors="ignore")
+        for col in df.columns:
+            if df[col].dtype == object and col != self.watermark_field:
+                df[col] = df[col].map(lambda v: None if v is None else str(v))
+
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False),
+                       os.path.join(self.path, name + ".parquet"), compression="zstd")
+        np.save(os.path.join(self.path, name + ".emb.npy"), table.embeddings)
+        np.save(os.path.join(self.path, name + ".rows.npy"), table.embedding_rows)
+        return {"name": name, "rows": len(df), "embedded": int(len(table.embedding_rows))}
+
+    def _remove_part(self, name: str):
+        for suffix in (".parquet", ".emb.npy", ".rows.npy"):
+            path = os.path.join(self.path, name + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def refresh(self) -> ArtworkTable:
+        # Fetch the delta past the watermark, append it as a new part and open the snapshot
+        start = time.perf_counter()
+        query = self._delta_query()
+        delta = load_artworks(query=query, fields=self._fields())
+        self.last_delta = delta if query is not None else None
+        self.last_inserted = self._inserted(delta) if query is not None else None
+        if len(delta.df):
+            part = self._write_part(delta)
+            self.manifest["parts"].append(part)
+            self.manifest["watermark"] = self._max_watermark(delta.df, self.watermark_field,
+                                                             self.manifest["watermark"])
+            if self.watermark_field != "_id":
+                self.manifest["id_watermark"] = self._max_watermark(delta.df, "_id",
+                                                                    self.manifest.get("id_watermark"))
+            self.manifest["refreshed_at"] = datetime.utcnow().isoformat()
+            self._write_manifest()
+        print(f"Snapshot refresh fetched {len(delta.df)} documents in {time.perf_counter() - start:.2f}s")
+
+        if len(self.manifest["parts"]) > self.max_parts:
+            return self.compact()
+        return self.open()
+
+    def _inserted(self, delta: ArtworkTable) -> set:
+        # With the "_id" watermark every fetched document is new; otherwise
+        # compare against the ids already in the snapshot (only that column is read)
+        ids = set(delta.df["_id"])
+        if self.watermark_field == "_id" or not ids:
+            return ids
+        import pyarrow.parquet as pq
+
+        for part in self.manifest["parts"]:
+            known = pq.read_table(os.path.join(self.path, part["name"] + ".parquet"), columns=["_id"])
+            ids.difference_update(known.column("_id").to_pylist())
+        return ids
+
+    def open(self) -> ArtworkTable:
+        # Embeddings are memory-mapped; with a single compacted part nothing is copied
+        import pyarrow.parquet as pq
+
+        parts = self.manifest["parts"]
+        if not parts:
+            raise RuntimeError(f"Snapshot at {self.path} is empty; call refresh() first.")
+
+        frames, matrices, rows = [], [], []
+        offset = 0
+        for part in parts:
+            base = os.path.join(self.path, part["name"])
+            frames.append(pq.read_table(base + ".parquet").to_pandas())
+            emb = np.load(base + ".emb.npy", mmap_mode="r")
+            if len(emb):
+                matrices.append(emb)
+                rows.append(np.load(base + ".rows.npy") + offset)
+            offset += part["rows"]
+
+        df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        embeddings = matrices[0] if len(matrices) == 1 else (
+            np.concatenate(matrices) if matrices else np.empty((0, 0), dtype=np.float32))
+        embedding_rows = rows[0] if len(rows) == 1 else (
+            np.concatenate(rows) if rows else np.empty(0, dtype=np.int64))
+
+        # Later parts hold newer versions of re-fetched documents
+        keep = ~df["_id"].duplicated(keep="last").to_numpy()
+        if not keep.all():
+            new_pos = np.cumsum(keep) - 1
+            emb_keep = keep[embedding_rows]
+            embeddings = embeddings[emb_keep]
+            embedding_rows = new_pos[embedding_rows[emb_keep]]
+            df = df[keep].reset_index(drop=True)
+
+        # Parts with different category sets concatenate as object columns
+        apply_schema(df)
+        df["area"] = df["dim1"] * df["dim2"]
+        return ArtworkTable(df, embeddings, embedding_rows)
+
+    def compact(self) -> ArtworkTable:
+        # Merge all parts (dropping superseded rows) into a single part
+        table = self.open()
+        table = ArtworkTable(table.df, np.ascontiguousarray(table.embeddings, dtype=np.float32),
+                             np.asarray(table.embedding_rows, dtype=np.int64))
+        old = [p["name"] for p in self.manifest["parts"]]
+        self.manifest["parts"] = [self._write_part(table)]
+        self._write_manifest()
+        for name in old:
+            self._remove_part(name)
+        print(f"Snapshot compacted {len(old)} parts into {self.manifest['parts'][0]['name']}")
+        return self.open()
+
+    def rebuild(self) -> ArtworkTable:
+        # Drop everything and reload the full collection
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+        self.manifest = {"watermark_field": self.watermark_field, "watermark": None, "parts": [], "seq": 0}
+        return self.refresh()
+
+def _object_id(value):
+    from bson import ObjectId
+    return ObjectId(value) if ObjectId.is_valid(value) else value
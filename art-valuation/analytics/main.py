@@ -1,5 +1,5 @@
 from agents.trend_agent import run_trend_agent_one_shot
-from agents.prediction_agent import price_prediction_agent
+from agents.prediction_agent import predict_price
 
 if __name__ == "__main__":
     # Run trend analysis
@@ -11,9 +11,7 @@ if __name__ == "__main__":
     metadata = {"medium": "Oil", "size_bucket": "size_2"}
     embedding = [0.01, 0.02, 0.03, 0.04]  # dummy vector
     
-    response = price_prediction_agent(
-        input={"metadata": metadata, "embedding": embedding}
-    )
+    response = predict_price(metadata, embedding)
     
     print("Price prediction:")
     print(response)
\ No newline at end of file
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+benchmark_ann.py
+
+Measures the recall@k / latency trade-off of the IVF index against exact
+search. Vectors are drawn from a Gaussian mixture (clustered like real
+image embeddings) unless --vectors points at a saved float32 .npy matrix.
+For each nprobe the script reports mean recall@k versus the exact top-k
+and per-query latency.
+
+Usage (from art-valuation/analytics):
+    python scripts/benchmark_ann.py --n 1000000 --dim 512 --nprobe 1,4,8,16,32,64
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from database.ann_index import IVFImageEmbeddingIndex
+from database.embeddings import ImageEmbeddingIndex
+
+
+def clustered_vectors(n: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    x = centers[rng.integers(clusters, size=n)] + 0.6 * rng.standard_normal((n, dim), dtype=np.float32)
+    return x
+
+
+def per_query_ms(index, queries, k, **kwargs) -> float:
+    start = time.perf_counter()
+    for q in queries:
+        index.search(q, k, **kwargs)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def recall_at_k(truth_ids, found_ids, k: int) -> float:
+    return float(np.mean([len(set(t) & set(f)) / k for t, f in zip(truth_ids, found_ids)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark IVF recall@k vs latency")
+    parser.add_argument("--n", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--vectors", help="Optional .npy matrix of real embeddings")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=0, help="0 = 4 * sqrt(N)")
+    parser.add_argument("--nprobe", default="1,2,4,8,16,32,64")
+    args = parser.parse_args()
+
+    if args.vectors:
+        vectors = np.load(args.vectors, mmap_mode="r")
+    else:
+        vectors = clustered_vectors(args.n, args.dim, clusters=max(16, args.n // 1000), seed=0)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape, dtype=np.float32)
+    ids = [str(i) for i in range(len(vectors))]
+    meta = [{} for _ in ids]
+
+    exact = ImageEmbeddingIndex()
+    exact.build(ids, vectors, meta)
+    _, truth = exact.search(queries, args.k)
+    truth_ids = [[exact.ids[i] for i in row] for row in truth]
+    exact_ms = per_query_ms(exact, queries, args.k)
+
+    start = time.perf_counter()
+    ivf = IVFImageEmbeddingIndex(nlist=args.nlist)
+    ivf.build(ids, vectors, meta)
+    build_s = time.perf_counter() - start
+
+    print(f"N={len(vectors)} dim={vectors.shape[1]} nlist={len(ivf.centroids)} "
+          f"IVF build {build_s:.1f}s, exact search {exact_ms:.2f} ms/query")
+    print(f"{'nprobe':>7} {'recall@' + str(args.k):>10} {'ms/query':>9} {'speedup':>8}")
+    for nprobe in [int(p) for p in args.nprobe.split(",")]:
+        _, found = ivf.search(queries, args.k, nprobe=nprobe)
+        found_ids = [[ivf.ids[i] for i in row if i >= 0] for row in found]
+        ms = per_query_ms(ivf, queries, args.k, nprobe=nprobe)
+        print(f"{nprobe:>7} {recall_at_k(truth_ids, found_ids, args.k):>10.3f} {ms:>9.2f} {exact_ms / ms:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
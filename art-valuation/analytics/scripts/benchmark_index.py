@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+benchmark_index.py
+
+Compares the exact float32 ImageEmbeddingIndex against the previous
+sklearn NearestNeighbors(metric="cosine") float64 implementation on random
+unit vectors, reporting build time, single-query latency, batched query
+throughput and whether the top-k ids agree.
+
+Usage (from art-valuation/analytics):
+    python scripts/benchmark_index.py --sizes 10000,100000,1000000 --dim 512
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from database.embeddings import ImageEmbeddingIndex
+
+
+def random_vectors(n: int, dim: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    x = rng.standard_normal((n, dim), dtype=np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def time_queries(fn, queries: np.ndarray) -> float:
+    start = time.perf_counter()
+    for q in queries:
+        fn(q)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def bench_native(vectors, queries, k):
+    ids = [str(i) for i in range(len(vectors))]
+    index = ImageEmbeddingIndex(n_neighbors=k)
+    start = time.perf_counter()
+    index.build(ids, vectors, [{} for _ in ids])
+    build_s = time.perf_counter() - start
+
+    index.search(queries[:1], k)  # warm-up
+    single_ms = time_queries(lambda q: index.search(q, k), queries)
+    start = time.perf_counter()
+    _, top = index.search(queries, k)
+    batch_qps = len(queries) / (time.perf_counter() - start)
+    return build_s, single_ms, batch_qps, top
+
+
+def bench_sklearn(vectors, queries, k):
+    from sklearn.neighbors import NearestNeighbors
+
+    start = time.perf_counter()
+    embeddings = np.array(vectors.tolist()).astype(float)
+    model = NearestNeighbors(n_neighbors=k, metric="cosine").fit(embeddings)
+    build_s = time.perf_counter() - start
+
+    queries64 = queries.astype(float)
+    single_ms = time_queries(lambda q: model.kneighbors(q.reshape(1, -1), n_neighbors=k), queries64)
+    start = time.perf_counter()
+    _, top = model.kneighbors(queries64, n_neighbors=k)
+    batch_qps = len(queries) / (time.perf_counter() - start)
+    return build_s, single_ms, batch_qps, top
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark exact embedding search")
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--skip-sklearn", action="store_true", help="Only time the native engine")
+    args = parser.parse_args()
+
+    queries = random_vectors(args.queries, args.dim, seed=1)
+    print(f"{'N':>9} {'engine':<8} {'build s':>8} {'ms/query':>9} {'batch q/s':>10} {'top-k agree':>12}")
+    for n in [int(s) for s in args.sizes.split(",")]:
+        vectors = random_vectors(n, args.dim, seed=0)
+        build_s, single_ms, qps, native_top = bench_native(vectors, queries, args.k)
+        print(f"{n:>9} {'native':<8} {build_s:>8.2f} {single_ms:>9.2f} {qps:>10.1f} {'':>12}")
+        if args.skip_sklearn:
+            continue
+        build_s, single_ms, qps, sk_top = bench_sklearn(vectors, queries, args.k)
+        agree = np.mean([set(a) == set(b) for a, b in zip(native_top, sk_top)])
+        print(f"{n:>9} {'sklearn':<8} {build_s:>8.2f} {single_ms:>9.2f} {qps:>10.1f} {agree:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
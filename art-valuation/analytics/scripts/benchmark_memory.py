@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+benchmark_memory.py
+
+Runs the trend pipeline (load -> size buckets -> trend cards) on synthetic
+documents fed through the same column builder the Mongo loader uses, and
+reports per-stage RSS, the DataFrame's deep memory use and the process peak
+RSS. Run once per configuration in a fresh process; peak RSS is lifetime.
+
+Usage (from art-valuation/analytics):
+    python scripts/benchmark_memory.py --n 1000000
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from database.db_manager import SCALAR_FIELDS, _ColumnBuilder
+from services.trend_analysis import assign_size_buckets, compute_basic_trends
+from utils.helpers import frame_memory_mb, peak_rss_mb, rss_mb, stage_memory
+
+
+def synthetic_documents(n: int, seed: int = 0):
+    # Strings are built per document, as BSON decoding does, rather than shared
+    rng = np.random.default_rng(seed)
+    mediums = ["Oil", "Acrylic", "Watercolor", "Ink", "Mixed media"]
+    houses = ["Christie's", "Sotheby's", "Bonhams", "Phillips"]
+    base = np.datetime64("2010-01-01")
+    for i in range(n):
+        house = int(rng.integers(len(houses) + 1))
+        yield {
+            "_id": f"{i:024x}",
+            "artist": "Artist " + str(int(rng.integers(5000))),
+            "medium": "".join(mediums[rng.integers(len(mediums))]),
+            "dim1": float(rng.uniform(10, 200)),
+            "dim2": float(rng.uniform(10, 200)),
+            "year_created": int(rng.integers(1900, 2024)),
+            "sale_date": str(base + np.timedelta64(int(rng.integers(0, 5000)), "D")),
+            "value": float(rng.lognormal(8, 1)),
+            "auction_house": "".join(houses[house]) if house < len(houses) else None,
+            "gallery": "Gallery " + str(int(rng.integers(300))),
+            "sold": bool(rng.integers(2)),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage memory of the trend pipeline")
+    parser.add_argument("--n", type=int, default=1000000)
+    args = parser.parse_args()
+
+    baseline = rss_mb()
+    with stage_memory("load"):
+        builder = _ColumnBuilder(SCALAR_FIELDS, with_embeddings=False, capacity=args.n, chunk_size=10000)
+        for doc in synthetic_documents(args.n):
+            builder.append(doc)
+        table = builder.finish()
+    print(f"DataFrame: {frame_memory_mb(table.df):,.0f}MB deep")
+    with stage_memory("size buckets"):
+        df = assign_size_buckets(table.df, buckets=3)
+    with stage_memory("trend cards"):
+        cards = compute_basic_trends(df, top_artists_n=50)
+    print(f"{len(cards)} cards; DataFrame {frame_memory_mb(df):,.0f}MB deep; "
+          f"peak RSS {peak_rss_mb():,.0f}MB ({peak_rss_mb() - baseline:,.0f}MB above start)")
+
+
+if __name__ == "__main__":
+    main()
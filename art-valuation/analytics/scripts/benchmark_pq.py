@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+benchmark_pq.py
+
+Reports the memory / recall trade-off of the product-quantized index.
+For each code size (PQ_M bytes per vector), with and without the OPQ
+rotation, it prints resident bytes per vector, recall@k of pure ADC search
+and of ADC + exact re-ranking against the float32 exact index, and
+per-query latency. The float64 joblib index used before is listed for
+reference (8 bytes per dimension).
+
+Usage (from art-valuation/analytics):
+    python scripts/benchmark_pq.py --n 200000 --dim 512 --m 16,32,64
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from database.embeddings import ImageEmbeddingIndex
+from database.pq_index import PQImageEmbeddingIndex
+
+
+def clustered_vectors(n: int, dim: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(16, n // 1000), dim), dtype=np.float32)
+    return centers[rng.integers(len(centers), size=n)] + 0.6 * rng.standard_normal((n, dim), dtype=np.float32)
+
+
+def recall(truth, found, k: int) -> float:
+    return float(np.mean([len(set(t) & set(f)) / k for t, f in zip(truth, found)]))
+
+
+def timed_search(index, queries, k, **kwargs):
+    start = time.perf_counter()
+    _, found = index.search(queries, k, **kwargs)
+    return found, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PQ memory vs recall")
+    parser.add_argument("--n", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--vectors", help="Optional .npy matrix of real embeddings")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--m", default="16,32,64", help="Comma-separated bytes per vector")
+    parser.add_argument("--rerank", type=int, default=4)
+    args = parser.parse_args()
+
+    vectors = np.load(args.vectors, mmap_mode="r") if args.vectors else clustered_vectors(args.n, args.dim, 0)
+    n, dim = vectors.shape
+    rng = np.random.default_rng(1)
+    queries = np.asarray(vectors[rng.choice(n, args.queries, replace=False)])
+    queries = queries + 0.05 * rng.standard_normal(queries.shape, dtype=np.float32)
+    ids = [str(i) for i in range(n)]
+    meta = [{} for _ in ids]
+
+    exact = ImageEmbeddingIndex()
+    exact.build(ids, vectors, meta)
+    truth, exact_ms = timed_search(exact, queries, args.k)
+
+    print(f"N={n} dim={dim} k={args.k}")
+    print(f"{'codec':<14} {'bytes/vec':>9} {'RAM for N':>10} {'recall ADC':>11} {'recall+rr':>10} "
+          f"{'ms ADC':>7} {'ms +rr':>7} {'train s':>8}")
+    print(f"{'float64 (old)':<14} {dim * 8:>9} {n * dim * 8 / 2**20:>8.0f}MB {1.0:>11.3f} {'':>10} {'':>7} {'':>7} {'':>8}")
+    print(f"{'float32 exact':<14} {dim * 4:>9} {n * dim * 4 / 2**20:>8.0f}MB {1.0:>11.3f} {'':>10} "
+          f"{exact_ms:>7.2f} {'':>7} {'':>8}")
+
+    for m in [int(v) for v in args.m.split(",")]:
+        for opq in (False, True):
+            index = PQImageEmbeddingIndex(m=m, opq=opq, rerank=args.rerank)
+            start = time.perf_counter()
+            index.build(ids, vectors, meta)
+            train_s = time.perf_counter() - start
+
+            adc, adc_ms = timed_search(index, queries, args.k, rerank=0)
+            reranked, rr_ms = timed_search(index, queries, args.k)
+            name = f"{'OPQ' if opq else 'PQ'}{m}"
+            print(f"{name:<14} {m:>9} {n * m / 2**20:>8.1f}MB {recall(truth, adc, args.k):>11.3f} "
+                  f"{recall(truth, reranked, args.k):>10.3f} {adc_ms:>7.2f} {rr_ms:>7.2f} {train_s:>8.1f}")
+    print("\nRe-ranking reads k * rerank full vectors per query from the memory-mapped vectors.f32,")
+    print("so only the PQ codes need to stay resident.")
+
+
+if __name__ == "__main__":
+    main()
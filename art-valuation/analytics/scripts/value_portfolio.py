@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+value_portfolio.py
+
+Values a portfolio of artworks without the LLM: comparables for every
+artwork come from batched index searches, segment medians from the insight
+index, and results stream to a Parquet directory or a JSONL file. Progress is
+checkpointed next to the output (<output>.checkpoint.json); rerunning the
+same command resumes an interrupted run. Per-phase times are printed at the end.
+
+Usage (from art-valuation/analytics):
+    python scripts/value_portfolio.py --input portfolio.jsonl --output valuations.jsonl
+    python scripts/value_portfolio.py --input snapshot/ --output valuations/
+    python scripts/value_portfolio.py --query '{"gallery": "Gallery 12"}' --output valuations/
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.settings import VALUATION_BATCH_SIZE
+from services.batch_valuation import value_portfolio
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch valuation of a portfolio of artworks")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help=".jsonl file of artwork documents, or a Parquet file/directory")
+    source.add_argument("--query", help="MongoDB filter (JSON) selecting the artworks from the collection")
+    parser.add_argument("--output", required=True, help=".jsonl file, otherwise a directory of Parquet parts")
+    parser.add_argument("--chunk-size", type=int, default=VALUATION_BATCH_SIZE)
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    args = parser.parse_args()
+
+    result = value_portfolio(args.output, source=args.input,
+                             query=json.loads(args.query) if args.query else None,
+                             chunk_size=args.chunk_size, resume=not args.restart)
+    print(f"Valued {result['rows_done']} artworks into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
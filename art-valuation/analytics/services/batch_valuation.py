@@ -0,0 +1,198 @@
+"""
+batch_valuation.py — Portfolio valuation in batches, streamed to Parquet/JSONL
+"""
+
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from config.settings import INDEX_DIR, INSIGHT_INDEX_PATH, VALUATION_BATCH_SIZE
+from database.db_manager import ArtworkTable, load_artworks, load_artworks_from_jsonl, load_artworks_from_parquet
+from services.insight_index import InsightIndex
+from services.trend_analysis import size_buckets_for_area
+from services.valuation import ValuationEngine
+from utils.helpers import PhaseTimer
+
+# Input columns copied next to the valuation columns in the output
+ID_COLUMNS = ("_id", "artist", "medium", "size_bucket")
+
+
+def load_portfolio(source: Optional[str] = None, query: Optional[Dict[str, Any]] = None) -> ArtworkTable:
+    """A .jsonl file, a Parquet file/directory, or (no source) a collection query"""
+    if source is None:
+        return load_artworks(query=query)
+    if source.endswith(".jsonl"):
+        return load_artworks_from_jsonl(source)
+    return load_artworks_from_parquet(source)
+
+
+def default_engine() -> ValuationEngine:
+    from database.mutable_index import open_index
+
+    insights = InsightIndex.load(INSIGHT_INDEX_PATH)
+    if insights is None:
+        raise RuntimeError(f"No insight index at {INSIGHT_INDEX_PATH}; run the trend agent first.")
+    return ValuationEngine.from_insight_index(open_index(INDEX_DIR), insights)
+
+
+class JsonlOutput:
+    # Appends records; a resumed run first cuts the file back to the checkpointed size
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def reset(self, position: int):
+        if position == 0 or not os.path.exists(self.path):
+            open(self.path, "w").close()
+        else:
+            with open(self.path, "r+b") as f:
+                f.truncate(position)
+
+    def write(self, frame: pd.DataFrame, chunk: int) -> int:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(frame.to_json(orient="records", lines=True, date_format="iso"))
+            f.flush()
+            os.fsync(f.fileno())
+        return os.path.getsize(self.path)
+
+
+class ParquetOutput:
+    # One part file per chunk in a directory (readable as one dataset); a
+    # resumed run removes parts past the checkpoint
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _part(self, chunk: int) -> str:
+        return os.path.join(self.path, f"part-{chunk:06d}.parquet")
+
+    def reset(self, position: int):
+        os.makedirs(self.path, exist_ok=True)
+        for name in os.listdir(self.path):
+            if name.startswith("part-") and int(name[5:11]) >= position:
+                os.remove(os.path.join(self.path, name))
+
+    def write(self, frame: pd.DataFrame, chunk: int) -> int:
+        tmp = self._part(chunk) + ".tmp"
+        frame.to_parquet(tmp, index=False)
+        os.replace(tmp, self._part(chunk))
+        return chunk + 1
+
+
+def open_output(path: str):
+    return JsonlOutput(path) if path.endswith(".jsonl") else ParquetOutput(path)
+
+
+class BatchValuation:
+    """
+    Values every artwork of a portfolio table chunk by chunk. Each chunk is
+    one batched index search plus vectorized estimates (see ValuationEngine),
+    its rows are appended to the output and then a checkpoint records how far
+    the run got, so an interrupted run resumes at the first unwritten chunk.
+    The checkpoint is tied to the portfolio's ids; a different portfolio
+    starts over. Per-phase times are collected in a PhaseTimer.
+    """
+
+    def __init__(self, engine: ValuationEngine, output: str, chunk_size: int = VALUATION_BATCH_SIZE,
+                 resume: bool = True, timer: Optional[PhaseTimer] = None):
+        self.engine = engine
+        self.output = open_output(output)
+        self.checkpoint_path = output.rstrip("/") + ".checkpoint.json"
+        self.chunk_size = chunk_size
+        self.resume = resume
+        self.timer = timer or PhaseTimer()
+
+    def _read_checkpoint(self, digest: str) -> Dict[str, Any]:
+        if self.resume and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                checkpoint = json.load(f)
+            if checkpoint.get("ids_digest") == digest and checkpoint.get("chunk_size") == self.chunk_size:
+                return checkpoint
+            print("Checkpoint belongs to a different portfolio or chunk size; starting over")
+        return {"ids_digest": digest, "chunk_size": self.chunk_size, "rows_done": 0, "chunks_done": 0,
+                "position": 0}
+
+    def _write_checkpoint(self, checkpoint: Dict[str, Any]):
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp, self.checkpoint_path)
+
+    def _targets(self, df: pd.DataFrame) -> pd.DataFrame:
+        # Attributes used for the segment lookups; size buckets follow the trend data's edges
+        targets = pd.DataFrame({c: df[c] for c in ID_COLUMNS if c in df.columns})
+        edges = self.engine.size_edges
+        if "size_bucket" not in targets.columns and edges is not None and "area" in df.columns:
+            targets["size_bucket"] = size_buckets_for_area(df["area"].to_numpy(), edges)
+        return targets
+
+    def _value_chunk(self, table: ArtworkTable, targets: pd.DataFrame, emb_pos: np.ndarray,
+                     start: int, end: int) -> pd.DataFrame:
+        meta = targets.iloc[start:end].reset_index(drop=True)
+        pos = emb_pos[start:end]
+        has = pos >= 0
+        parts = []
+        if has.any():
+            # Portfolio artworks are usually in the index too; never price one off itself
+            exclude = meta["_id"][has].tolist() if "_id" in meta.columns else None
+            part = self.engine.estimate_batch(table.embeddings[pos[has]], meta[has], timer=self.timer,
+                                              exclude_ids=exclude)
+            parts.append(part.set_index(np.flatnonzero(has)))
+        if not has.all():
+            # No embedding: segment medians only
+            part = self.engine.estimate_batch(None, meta[~has], timer=self.timer)
+            parts.append(part.set_index(np.flatnonzero(~has)))
+        result = pd.concat(parts).sort_index()
+        return pd.concat([meta, result.reset_index(drop=True)], axis=1)
+
+    def run(self, table: ArtworkTable) -> Dict[str, Any]:
+        df = table.df
+        n = len(df)
+        ids = df["_id"].astype(str)
+        digest = hashlib.sha1("\n".join(ids).encode("utf-8")).hexdigest()
+        checkpoint = self._read_checkpoint(digest)
+        if checkpoint.get("complete"):
+            print(f"Portfolio already valued ({n} artworks)")
+            return checkpoint
+
+        with self.timer.phase("prepare"):
+            self.engine.prepare()
+            targets = self._targets(df)
+            emb_pos = np.full(n, -1, dtype=np.int64)
+            emb_pos[table.embedding_rows] = np.arange(len(table.embedding_rows))
+            self.output.reset(checkpoint["position"])
+
+        start = checkpoint["rows_done"]
+        if start:
+            print(f"Resuming at row {start} of {n}")
+        while start < n:
+            end = min(start + self.chunk_size, n)
+            frame = self._value_chunk(table, targets, emb_pos, start, end)
+            with self.timer.phase("write"):
+                checkpoint["position"] = self.output.write(frame, checkpoint["chunks_done"])
+            checkpoint["rows_done"] = end
+            checkpoint["chunks_done"] += 1
+            with self.timer.phase("checkpoint"):
+                self._write_checkpoint(checkpoint)
+            print(f"Valued {end}/{n} artworks")
+            start = end
+
+        checkpoint["complete"] = True
+        self._write_checkpoint(checkpoint)
+        return checkpoint
+
+
+def value_portfolio(output: str, source: Optional[str] = None, query: Optional[Dict[str, Any]] = None,
+                    chunk_size: int = VALUATION_BATCH_SIZE, resume: bool = True,
+                    engine: Optional[ValuationEngine] = None) -> Dict[str, Any]:
+    timer = PhaseTimer()
+    with timer.phase("load"):
+        table = load_portfolio(source, query)
+        engine = engine or default_engine()
+    result = BatchValuation(engine, output, chunk_size=chunk_size, resume=resume, timer=timer).run(table)
+    timer.report()
+    return {**result, "timings": dict(timer.totals)}
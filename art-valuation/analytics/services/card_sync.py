@@ -0,0 +1,190 @@
+"""
+card_sync.py — Incremental sync of insight cards into the RAG corpus
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from config.settings import (CORPUS_DISPLAY_NAME, CARD_SYNC_BACKEND, CARD_SYNC_WORKERS, CARD_MANIFEST_PATH,
+                             LOCAL_CORPUS_DIR)
+
+
+def render_card(card: Dict[str, Any], with_provenance: bool = True) -> str:
+    """File body uploaded for a card: text, then scope and metric metadata"""
+    meta = {
+        "metric": card.get("metric"),
+        "value": card.get("value"),
+        "sample_size": card.get("sample_size"),
+        "confidence": card.get("confidence"),
+    }
+    if with_provenance:
+        meta["provenance"] = card.get("provenance")
+    return (card["text"].strip() + "\n\n"
+            + "---METADATA---\n"
+            + json.dumps(card["scope"], default=str) + "\n"
+            + json.dumps(meta, default=str) + "\n")
+
+
+def card_id(card: Dict[str, Any]) -> str:
+    """Stable identity of a card across runs: its type, metric and scope"""
+    key = json.dumps([card.get("type"), card.get("metric"), card["scope"]], sort_keys=True, default=str)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def card_hash(card: Dict[str, Any]) -> str:
+    """Content hash; provenance (creation time) is excluded so unchanged cards match"""
+    return hashlib.sha256(render_card(card, with_provenance=False).encode("utf-8")).hexdigest()
+
+
+class VertexCorpus:
+    # Vertex AI RAG corpus (services.rag); the corpus handle is cached there
+
+    def __init__(self, display_name: str = CORPUS_DISPLAY_NAME):
+        from services.rag import initialize_vertex_ai, create_or_get_corpus
+
+        initialize_vertex_ai()
+        self.corpus = create_or_get_corpus(display_name)
+        self.name = self.corpus.name
+
+    def upload(self, path: str, display_name: str, description: str) -> str:
+        from services.rag import upload_text_file_to_corpus
+
+        return upload_text_file_to_corpus(self.name, path, display_name, description).name
+
+    def delete(self, file_id: str):
+        from services.rag import delete_file_from_corpus
+
+        delete_file_from_corpus(file_id)
+
+
+class LocalCorpus:
+    # Stand-in for the corpus API backed by a directory: uploads are copies,
+    # file ids are the stored paths. Used for local runs and testing the sync.
+
+    def __init__(self, root: str = LOCAL_CORPUS_DIR):
+        self.root = root
+        self.name = "local:" + os.path.abspath(root)
+        os.makedirs(root, exist_ok=True)
+
+    def upload(self, path: str, display_name: str, description: str) -> str:
+        target = os.path.join(self.root, display_name)
+        shutil.copyfile(path, target)
+        return target
+
+    def delete(self, file_id: str):
+        if os.path.exists(file_id):
+            os.remove(file_id)
+
+    def files(self) -> List[str]:
+        return sorted(os.listdir(self.root))
+
+
+def default_corpus():
+    return LocalCorpus() if CARD_SYNC_BACKEND == "local" else VertexCorpus()
+
+
+class CardSync:
+    """
+    Diffs the current cards against a local manifest of what the corpus holds
+    ({card id: {"hash", "file_id"}}) and only uploads new or changed cards and
+    deletes cards that are gone or superseded. Uploads and deletes run on a
+    bounded thread pool; the manifest is rewritten after every run, including
+    partially failed ones, so the next run retries only what is missing.
+    Replaced file versions are recorded under "pending_deletes" before they
+    are deleted and stay there until a delete succeeds.
+    """
+
+    def __init__(self, corpus=None, manifest_path: str = CARD_MANIFEST_PATH, workers: int = CARD_SYNC_WORKERS):
+        self.corpus = corpus or default_corpus()
+        self.manifest_path = manifest_path
+        self.workers = workers
+        self.manifest = self._read_manifest()
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("corpus") == self.corpus.name:
+                manifest.setdefault("pending_deletes", [])
+                return manifest
+            print(f"Card manifest belongs to {manifest.get('corpus')}; starting a new one")
+        return {"corpus": self.corpus.name, "cards": {}, "pending_deletes": []}
+
+    def _write_manifest(self):
+        self.manifest["synced_at"] = datetime.utcnow().isoformat()
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp, self.manifest_path)
+
+    def plan(self, cards: List[Dict[str, Any]]) -> Tuple[Dict[str, Tuple[Dict[str, Any], str]], List[str]]:
+        """(cards to upload by id with their hash, card ids to delete)"""
+        current = self.manifest["cards"]
+        desired = {}
+        for card in cards:
+            desired[card_id(card)] = (card, card_hash(card))
+        uploads = {cid: entry for cid, entry in desired.items()
+                   if current.get(cid, {}).get("hash") != entry[1]}
+        deletes = [cid for cid in current if cid not in desired]
+        return uploads, deletes
+
+    def _upload(self, temp_dir: str, cid: str, card: Dict[str, Any], digest: str) -> str:
+        # Versioned name, so a changed card never collides with the file it replaces
+        display_name = f"insight_card_{cid}_{digest[:8]}.txt"
+        path = os.path.join(temp_dir, display_name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(render_card(card))
+        return self.corpus.upload(path, display_name, "Insight card")
+
+    def sync(self, cards: List[Dict[str, Any]]) -> Dict[str, int]:
+        uploads, deletes = self.plan(cards)
+        current = self.manifest["cards"]
+        stats = {"uploaded": 0, "unchanged": len(cards) - len(uploads), "deleted": 0, "failed": 0}
+        # Old versions of changed cards, including ones a previous run failed to delete
+        pending = self.manifest["pending_deletes"]
+
+        try:
+            with tempfile.TemporaryDirectory() as td, ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {pool.submit(self._upload, td, cid, card, digest): (cid, digest)
+                           for cid, (card, digest) in uploads.items()}
+                for future in as_completed(futures):
+                    cid, digest = futures[future]
+                    try:
+                        file_id = future.result()
+                    except Exception as e:
+                        print(f"Upload of card {cid} failed: {e}")
+                        stats["failed"] += 1
+                        continue
+                    if cid in current:
+                        pending.append(current[cid]["file_id"])
+                    current[cid] = {"hash": digest, "file_id": file_id}
+                    stats["uploaded"] += 1
+
+                # Stale cards, and old versions of changed cards once their replacement is in
+                removals = {pool.submit(self.corpus.delete, current[cid]["file_id"]): cid for cid in deletes}
+                superseded = {pool.submit(self.corpus.delete, file_id): file_id for file_id in pending}
+                for future in as_completed(list(removals) + list(superseded)):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(f"Delete of card file failed: {e}")
+                        stats["failed"] += 1
+                        continue
+                    if future in removals:
+                        del current[removals[future]]
+                        stats["deleted"] += 1
+                    else:
+                        pending.remove(superseded[future])
+        finally:
+            self._write_manifest()
+        return stats
+
+
+def sync_cards(cards: List[Dict[str, Any]], corpus=None) -> Dict[str, int]:
+    return CardSync(corpus=corpus).sync(cards)
@@ -0,0 +1,216 @@
+"""
+insight_index.py — In-process retrieval over insight cards
+"""
+
+import json
+import os
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config.settings import INSIGHT_INDEX_PATH, INSIGHT_BM25_K1, INSIGHT_BM25_B, INSIGHT_RERANK_WEIGHT
+
+TOKEN_RE = re.compile(r"[^\W_]+")
+# Card fields kept in the index file (and returned as "meta"); provenance is dropped
+CARD_FIELDS = ("type", "scope", "metric", "value", "sample_size", "confidence")
+# Order in which cards of one scope are returned: level first, then movement
+TYPE_ORDER = {"aggregate": 0, "time_series": 1}
+FUZZY_CANDIDATES = 20  # BM25 hits checked when a scope value has no exact match
+FUZZY_CACHE_SIZE = 4096  # remembered fallback results (including misses)
+
+
+def tokenize(text: str) -> List[str]:
+    # Lower-cased word tokens (letters and digits)
+    return TOKEN_RE.findall(str(text).lower())
+
+
+def scope_key(field: str, value: Any) -> Tuple[str, str]:
+    return field, str(value).strip().casefold()
+
+
+class InsightIndex:
+    """
+    Insight cards with three access paths:
+      - exact: (scope field, value) -> card rows, a dict lookup
+      - BM25 over card text and scope values, stored as an inverted index whose
+        postings already carry their BM25 weight, so a query is one scatter-add
+        per term
+      - optional blending of the BM25 score with embedding similarity, when the
+        index was built with an embedding function
+    Saved as a single npz (JSON header + flat arrays) that loads in milliseconds.
+    `meta` carries context of the cards' data, e.g. the size bucket edges.
+    """
+
+    def __init__(self, cards: List[Dict[str, Any]], vocabulary: List[str], offsets: np.ndarray,
+                 postings: np.ndarray, weights: np.ndarray, embeddings: Optional[np.ndarray] = None,
+                 meta: Optional[Dict[str, Any]] = None):
+        self.cards = cards
+        self.meta = meta or {}
+        self.vocabulary = {term: i for i, term in enumerate(vocabulary)}
+        self.offsets = offsets
+        self.postings = postings
+        self.weights = weights
+        self.embeddings = embeddings
+        # Ready-made results, so a lookup only copies dicts
+        self.results = [{"text": c["text"], "meta": {f: c.get(f) for f in CARD_FIELDS}} for c in cards]
+        self.scopes: Dict[Tuple[str, str], List[int]] = {}
+        for i, card in enumerate(cards):
+            for field, value in card["scope"].items():
+                self.scopes.setdefault(scope_key(field, value), []).append(i)
+        self.fields = {field for field, _ in self.scopes}
+        self._fuzzy: Dict[Tuple[str, str], Optional[List[int]]] = {}
+        for rows in self.scopes.values():
+            rows.sort(key=lambda i: TYPE_ORDER.get(cards[i].get("type"), len(TYPE_ORDER)))
+
+    def __len__(self):
+        return len(self.cards)
+
+    @classmethod
+    def build(cls, cards: List[Dict[str, Any]], embed_fn: Optional[Callable[[List[str]], Any]] = None,
+              k1: float = INSIGHT_BM25_K1, b: float = INSIGHT_BM25_B,
+              meta: Optional[Dict[str, Any]] = None) -> "InsightIndex":
+        """Index cards; embed_fn (texts -> (N, D) array) enables embedding re-ranking"""
+        cards = [{**{f: card.get(f) for f in CARD_FIELDS}, "text": card["text"]} for card in cards]
+        term_ids: Dict[str, int] = {}
+        doc_terms: List[Dict[int, int]] = []
+        for card in cards:
+            # Scope values are indexed alongside the text so "Oil" finds the Oil card
+            tokens = tokenize(card["text"])
+            for field, value in card["scope"].items():
+                tokens += tokenize(field) + tokenize(value)
+            counts: Dict[int, int] = {}
+            for token in tokens:
+                t = term_ids.setdefault(token, len(term_ids))
+                counts[t] = counts.get(t, 0) + 1
+            doc_terms.append(counts)
+
+        n_docs = len(cards)
+        doc_len = np.array([sum(c.values()) for c in doc_terms], dtype=np.float64)
+        avg_len = float(doc_len.mean()) if n_docs else 0.0
+        df = np.zeros(len(term_ids), dtype=np.int64)
+        for counts in doc_terms:
+            df[list(counts)] += 1
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+
+        # CSR postings: for term t, docs/weights live at offsets[t]:offsets[t + 1]
+        offsets = np.zeros(len(term_ids) + 1, dtype=np.int64)
+        np.cumsum(df, out=offsets[1:])
+        postings = np.empty(offsets[-1], dtype=np.int32)
+        weights = np.empty(offsets[-1], dtype=np.float32)
+        fill = offsets[:-1].copy()
+        for doc, counts in enumerate(doc_terms):
+            norm = k1 * (1 - b + b * doc_len[doc] / avg_len)
+            for t, tf in counts.items():
+                postings[fill[t]] = doc
+                weights[fill[t]] = idf[t] * tf * (k1 + 1) / (tf + norm)
+                fill[t] += 1
+
+        embeddings = None
+        if embed_fn is not None and n_docs:
+            embeddings = _normalize(np.asarray(embed_fn([c["text"] for c in cards]), dtype=np.float32))
+        vocabulary = sorted(term_ids, key=term_ids.get)
+        return cls(cards, vocabulary, offsets, postings, weights, embeddings, meta)
+
+    def lookup(self, metadata: Dict[str, Any], k: int = 3) -> List[Dict[str, Any]]:
+        """
+        Cards for the artwork's attributes, taking the fields in the order given
+        and one card per field per round. A value without an exact scope match
+        falls back to the best BM25 hit whose scope value contains all of its
+        words (e.g. "Oil" -> "Oil on canvas").
+        """
+        matched = []
+        for field, value in metadata.items():
+            if value is None or field not in self.fields:
+                continue
+            rows = self.scopes.get(scope_key(field, value)) or self._fuzzy_scope(field, value)
+            if rows:
+                matched.append(rows)
+
+        out: List[int] = []
+        depth = max((len(rows) for rows in matched), default=0)
+        for i in range(depth):
+            for rows in matched:
+                if i < len(rows) and rows[i] not in out:
+                    out.append(rows[i])
+        return [dict(self.results[i]) for i in out[:k]]
+
+    def resolve_scope(self, field: str, value: Any) -> Optional[Any]:
+        """The indexed scope value that lookup() would match for (field, value), if any"""
+        if value is None:
+            return None
+        rows = self.scopes.get(scope_key(field, value)) or self._fuzzy_scope(field, value)
+        return self.cards[rows[0]]["scope"][field] if rows else None
+
+    def _fuzzy_scope(self, field: str, value: Any) -> Optional[List[int]]:
+        key = scope_key(field, value)
+        if key in self._fuzzy:
+            return self._fuzzy[key]
+        rows = None
+        words = set(tokenize(value))
+        for row, _ in (self._search(str(value), FUZZY_CANDIDATES) if words else []):
+            scope_value = self.cards[row]["scope"].get(field)
+            if scope_value is not None and words <= set(tokenize(scope_value)):
+                rows = self.scopes[scope_key(field, scope_value)]
+                break
+        if len(self._fuzzy) >= FUZZY_CACHE_SIZE:
+            self._fuzzy.clear()
+        self._fuzzy[key] = rows
+        return rows
+
+    def search(self, query: str, k: int = 3, query_embedding=None) -> List[Dict[str, Any]]:
+        """Free-text BM25 search, blended with embedding similarity when available"""
+        return [{**self.results[i], "score": score} for i, score in self._search(query, k, query_embedding)]
+
+    def _search(self, query: str, k: int, query_embedding=None,
+                rerank_weight: float = INSIGHT_RERANK_WEIGHT) -> List[Tuple[int, float]]:
+        if not self.cards or k <= 0:
+            return []
+        scores = np.zeros(len(self.cards), dtype=np.float32)
+        for token in set(tokenize(query)):
+            t = self.vocabulary.get(token)
+            if t is not None:
+                lo, hi = self.offsets[t], self.offsets[t + 1]
+                # A doc appears once per term, so fancy-index accumulation is exact
+                scores[self.postings[lo:hi]] += self.weights[lo:hi]
+
+        use_embedding = query_embedding is not None and self.embeddings is not None and rerank_weight > 0
+        if use_embedding:
+            sims = self.embeddings @ _normalize(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+            top = scores.max()
+            scores = (1 - rerank_weight) * (scores / top if top > 0 else scores) + rerank_weight * sims
+        else:
+            if not scores.any():
+                return []
+            k = min(k, int(np.count_nonzero(scores)))
+
+        k = min(k, len(scores))
+        part = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        part = part[np.argsort(-scores[part], kind="stable")]
+        return [(int(i), float(scores[i])) for i in part]
+
+    def save(self, path: str = INSIGHT_INDEX_PATH):
+        header = {"cards": self.cards, "vocabulary": sorted(self.vocabulary, key=self.vocabulary.get),
+                  "meta": self.meta}
+        arrays = {"offsets": self.offsets, "postings": self.postings, "weights": self.weights}
+        if self.embeddings is not None:
+            arrays["embeddings"] = self.embeddings
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, header=np.array(json.dumps(header, default=str)), **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str = INSIGHT_INDEX_PATH) -> Optional["InsightIndex"]:
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            header = json.loads(str(data["header"]))
+            embeddings = data["embeddings"] if "embeddings" in data.files else None
+            return cls(header["cards"], header["vocabulary"], data["offsets"], data["postings"],
+                       data["weights"], embeddings, header.get("meta"))
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
@@ -0,0 +1,157 @@
+"""
+quantile_sketch.py — Mergeable streaming quantile sketch (KLL family)
+"""
+
+import math
+import random
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from config.settings import SKETCH_EPSILON, SKETCH_DELTA
+
+
+def sketch_k(epsilon: float = SKETCH_EPSILON, delta: float = SKETCH_DELTA) -> int:
+    """Items per level for rank error <= epsilon * n with probability >= 1 - delta"""
+    return max(2, math.ceil(2.0 / epsilon * math.sqrt(math.log(2.0 / delta))))
+
+
+def sketch_epsilon(k: int, delta: float = SKETCH_DELTA) -> float:
+    """Inverse of sketch_k: the rank error guaranteed by k at failure probability delta"""
+    return 2.0 / k * math.sqrt(math.log(2.0 / delta))
+
+
+class KLLSketch:
+    """
+    KLL-style quantile sketch with equal-capacity levels.
+
+    Level h holds items of weight 2**h. When a level grows past k items it is
+    sorted and every other item (random offset) is promoted to level h + 1.
+
+    Guarantee: for any single rank or quantile query, the rank error is at
+    most epsilon * n with probability at least 1 - delta, independent of n,
+    when k = sketch_k(epsilon, delta) = ceil(2 / epsilon * sqrt(ln(2 / delta)))
+    (so k = O(1/epsilon * sqrt(log(1/delta)))). Each compaction at level h
+    moves a given rank by 0 or +/-2**h with a fair random sign; level h is
+    compacted at most n / (k * 2**h) times and the top level H has
+    2**H < 2n/k, so the variance proxy is below 2 n**2 / k**2 and Hoeffding
+    gives P(|error| > epsilon * n) <= 2 exp(-(epsilon * k)**2 / 4) <= delta.
+    This holds for merged sketches too. `rank_epsilon()` is that epsilon for
+    the sketch's k; `rank_error` also tracks the deterministic worst case,
+    which grows like log(n / k) / k.
+    Sketches with the same k merge by concatenating levels.
+    """
+
+    def __init__(self, k: Optional[int] = None, seed: Optional[int] = None):
+        # k defaults to the value derived from SKETCH_EPSILON / SKETCH_DELTA
+        self.k = k or sketch_k()
+        self.levels: List[np.ndarray] = [np.empty(0)]
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.rank_error = 0  # worst-case absolute rank error accumulated by compactions
+        self._rng = random.Random(seed)
+        self._view = None
+
+    def update(self, value: float):
+        self.update_many([value])
+
+    def update_many(self, values: Iterable[float]):
+        arr = np.asarray(values, dtype=np.float64).ravel()
+        arr = arr[np.isfinite(arr)]
+        if not arr.size:
+            return
+        self.n += int(arr.size)
+        self.min = min(self.min, float(arr.min()))
+        self.max = max(self.max, float(arr.max()))
+        self.levels[0] = np.concatenate([self.levels[0], arr])
+        self._compress()
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if level.size > self.k:
+                level = np.sort(level)
+                keep = level[:1] if level.size % 2 else level[:0]
+                body = level[keep.size:]
+                promoted = body[self._rng.randint(0, 1)::2]
+                self.levels[h] = keep
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+                self.rank_error += 2 ** h
+            h += 1
+        self._view = None
+
+    def merge(self, other: "KLLSketch") -> "KLLSketch":
+        """Fold another sketch (e.g. from another shard) into this one"""
+        if other.k != self.k:
+            raise ValueError("Cannot merge sketches with different k")
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, level in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], level])
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.rank_error += other.rank_error
+        self._compress()
+        return self
+
+    def _sorted_view(self):
+        if self._view is None:
+            values = np.concatenate(self.levels)
+            weights = np.concatenate([np.full(level.size, 2 ** h, dtype=np.int64)
+                                      for h, level in enumerate(self.levels)])
+            order = np.argsort(values, kind="stable")
+            self._view = (values[order], np.cumsum(weights[order]))
+        return self._view
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.n == 0:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        values, cum = self._sorted_view()
+        i = int(np.searchsorted(cum, q * cum[-1], side="left"))
+        return float(values[min(i, len(values) - 1)])
+
+    def quantiles(self, qs: Iterable[float]) -> List[Optional[float]]:
+        return [self.quantile(q) for q in qs]
+
+    def rank(self, value: float) -> float:
+        """Approximate fraction of items <= value"""
+        if self.n == 0:
+            return 0.0
+        values, cum = self._sorted_view()
+        i = int(np.searchsorted(values, value, side="right"))
+        return float(cum[i - 1] / cum[-1]) if i else 0.0
+
+    def rank_epsilon(self, delta: float = SKETCH_DELTA) -> float:
+        """Rank error bound (fraction of n) that holds with probability >= 1 - delta"""
+        if not self.n:
+            return 0.0
+        return min(sketch_epsilon(self.k, delta), self.worst_case_epsilon())
+
+    def worst_case_epsilon(self) -> float:
+        """Deterministic rank error bound (fraction of n) from the compactions so far"""
+        return self.rank_error / self.n if self.n else 0.0
+
+    def size(self) -> int:
+        return int(sum(level.size for level in self.levels))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"k": self.k, "n": self.n, "min": self.min, "max": self.max,
+                "rank_error": self.rank_error, "levels": [level.tolist() for level in self.levels]}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "KLLSketch":
+        sketch = cls(k=data["k"])
+        sketch.levels = [np.asarray(level, dtype=np.float64) for level in data["levels"]] or [np.empty(0)]
+        sketch.n = data["n"]
+        sketch.min, sketch.max = data["min"], data["max"]
+        sketch.rank_error = data["rank_error"]
+        return sketch
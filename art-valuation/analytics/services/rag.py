@@ -3,11 +3,18 @@ from vertexai.preview import rag
 from google.auth import default
 from config.settings import PROJECT_ID, LOCATION, CORPUS_DISPLAY_NAME
 
+# Corpus handles by display name, so list_corpora() runs once per process
+_corpus_cache = {}
+
 def initialize_vertex_ai():
     creds, _ = default()
     vertexai.init(project=PROJECT_ID, location=LOCATION, credentials=creds)
 
 def create_or_get_corpus(display_name: str = CORPUS_DISPLAY_NAME):
+    cached = _corpus_cache.get(display_name)
+    if cached is not None:
+        return cached
+
     embedding_model_config = rag.EmbeddingModelConfig(
         publisher_model="publishers/google/models/text-embedding-004"
     )
@@ -15,6 +22,7 @@ def create_or_get_corpus(display_name: str = CORPUS_DISPLAY_NAME):
     existing = list(rag.list_corpora())
     for c in existing:
         if c.display_name == display_name:
+            _corpus_cache[display_name] = c
             return c
 
     corpus = rag.create_corpus(
@@ -22,6 +30,7 @@ def create_or_get_corpus(display_name: str = CORPUS_DISPLAY_NAME):
         description="PoC insight cards for art valuation",
         embedding_model_config=embedding_model_config,
     )
+    _corpus_cache[display_name] = corpus
     return corpus
 
 def upload_text_file_to_corpus(corpus_name: str, file_path: str, display_name: str, description: str):
@@ -31,4 +40,7 @@ def upload_text_file_to_corpus(corpus_name: str, file_path: str, display_name: s
         display_name=display_name,
         description=description,
     )
-    return rag_file
\ No newline at end of file
+    return rag_file
+
+def delete_file_from_corpus(file_name: str):
+    rag.delete_file(name=file_name)
@@ -5,116 +5,126 @@ trend_analysis.py — Core trend analysis functionality for art valuation
 import numpy as np
 import pandas as pd
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from config.settings import TREND_DIMENSIONS
 
-def assign_size_buckets(df: pd.DataFrame, buckets: int = 3) -> pd.DataFrame:
-    """Create simple quantile-based size buckets on 'area'"""
-    df = df.copy()
-    # handle missing area by setting to 0 (they'll be in smallest bucket); alternatively filter them out
-    df["area_fill"] = df["area"].fillna(0.0)
+def assign_size_buckets(df: pd.DataFrame, buckets: int = 3, inplace: bool = False) -> pd.DataFrame:
+    """
+    Create simple quantile-based size buckets on 'area'. Only the new
+    categorical column is allocated: with inplace=True it is added to df,
+    otherwise to a shallow (copy-on-write) view of df.
+    """
+    # handle missing area by treating it as 0 (they'll be in smallest bucket); alternatively filter them out
+    area_fill = df["area"].fillna(0.0)
+    labels = [f"size_{i+1}" for i in range(buckets)]
     try:
-        df["size_bucket"] = pd.qcut(df["area_fill"], q=buckets, labels=[f"size_{i+1}" for i in range(buckets)])
+        size_bucket = pd.qcut(area_fill, q=buckets, labels=labels)
     except Exception:
         # fallback if qcut cannot split (e.g., too many identical areas) — simple cut by percentiles
-        q = np.percentile(df["area_fill"], [33, 66])
-        df["size_bucket"] = pd.cut(df["area_fill"], bins=[-1e9, q[0], q[1], 1e18], labels=[f"size_{i+1}" for i in range(buckets)])
-    df.drop(columns=["area_fill"], inplace=True)
-    return df
+        q = np.percentile(area_fill, [33, 66])
+        size_bucket = pd.cut(area_fill, bins=[-1e9, q[0], q[1], 1e18], labels=labels)
+    if inplace:
+        df["size_bucket"] = size_bucket
+        return df
+    return df.assign(size_bucket=size_bucket)
+
+
+def size_bucket_edges(df: pd.DataFrame) -> List[float]:
+    """Largest area in each size bucket but the last, as assigned by assign_size_buckets"""
+    area = df["area"].fillna(0.0)
+    upper = area.groupby(df["size_bucket"], observed=True).max().sort_index()
+    return [float(v) for v in upper.iloc[:-1]]
+
+
+def size_buckets_for_area(area, edges: List[float]) -> pd.Categorical:
+    """Size bucket labels for new artworks, using the edges of the trend data"""
+    labels = [f"size_{i+1}" for i in range(len(edges) + 1)]
+    area_fill = np.nan_to_num(np.asarray(area, dtype=np.float64), nan=0.0)
+    codes = np.searchsorted(np.asarray(edges, dtype=np.float64), area_fill, side="left")
+    return pd.Categorical.from_codes(codes, categories=labels)
+
+
+# Card template per trend dimension. "label" formats the scope value, "top_n"
+# limits the dimension to its most frequent keys, "multiplier" adds the ratio
+# to the global median. Dimensions not listed here use DEFAULT_DIMENSION.
+DIMENSION_TEMPLATES = {
+    "medium": {"label": "{key}", "multiplier": True},
+    "artist": {"label": "Artist: {key}", "top_n": True},
+    "size_bucket": {"label": "{key} artworks"},
+}
+DEFAULT_DIMENSION = {"label": "{field}: {key}"}
+
+
+def _price_per_area(df: pd.DataFrame) -> np.ndarray:
+    value = df["value"].to_numpy(dtype=np.float64)
+    area = df["area"].to_numpy(dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(area > 0, value / area, np.nan)
 
 
-def compute_basic_trends(df: pd.DataFrame, top_artists_n: int = 50) -> List[Dict[str, Any]]:
+def aggregate_dimension(df_valid: pd.DataFrame, field: str, top_n: Optional[int] = None) -> pd.DataFrame:
+    """One groupby pass: N, median price and median price/area per key of `field`"""
+    agg = df_valid.groupby(field, observed=True, sort=True).agg(
+        n=("value", "size"),
+        median_price=("value", "median"),
+        median_ppa=("price_per_area", "median"),
+    )
+    if top_n is not None:
+        top = df_valid[field].value_counts().nlargest(top_n).index
+        agg = agg.reindex(top).dropna(subset=["n"])
+    return agg
+
+
+def make_trend_card(field: str, key, n: int, median_price: float, median_ppa: Optional[float],
+                    global_median: float, created_at: str) -> Dict[str, Any]:
+    """Fill the card template for one aggregated scope row"""
+    template = DIMENSION_TEMPLATES.get(field, DEFAULT_DIMENSION)
+    confidence = "low" if n < 30 else "high"
+    text = template["label"].format(field=field, key=key) + f" — median price ${median_price:,.0f} (N={n})."
+    if median_ppa is not None and not np.isnan(median_ppa):
+        text += f" Median price/area = ${median_ppa:,.2f}."
+    if template.get("multiplier") and global_median > 0:
+        text += f" Multiplier vs global median = {median_price / global_median:.2f}."
+    text += f" Confidence: {confidence}."
+    return {
+        "type": "aggregate",
+        "scope": {field: str(key) if field == "size_bucket" else key},
+        "metric": "median_price",
+        "value": median_price,
+        "sample_size": n,
+        "confidence": confidence,
+        "text": text,
+        "provenance": {"created_at": created_at}
+    }
+
+
+def compute_basic_trends(df: pd.DataFrame, top_artists_n: int = 50,
+                         dimensions: Optional[List[str]] = None) -> List[Dict[str, Any]]:
     """
-    Compute the minimal trends described in the PoC:
+    Compute per-scope trend cards with one vectorized groupby pass per dimension:
       - per medium: median price, N, median price_per_area, multiplier vs global median
       - per artist: top N artists only (others ignored)
       - per size_bucket: median price and N
+      - any other configured dimension (TREND_DIMENSIONS) with the default template
     Returns a list of insight card dicts.
     """
-    cards = []
-    df_valid = df[df["value"].notna()].copy()
+    dimensions = dimensions or [d.strip() for d in TREND_DIMENSIONS.split(",") if d.strip()]
+    value = df["value"]
+    df_valid = df.loc[value.notna(), [c for c in dict.fromkeys(dimensions + ["value", "area"]) if c in df.columns]]
+    df_valid = df_valid.assign(price_per_area=_price_per_area(df_valid))
     global_median = float(df_valid["value"].median()) if not df_valid.empty else 0.0
+    created_at = datetime.utcnow().isoformat()
 
-    # Add price_per_area (avoid division by zero)
-    df_valid["price_per_area"] = df_valid.apply(lambda r: (r["value"] / r["area"]) if pd.notna(r["area"]) and r["area"] > 0 else np.nan, axis=1)
-
-    # 1) Medium-level trends
-    med_groups = df_valid.groupby("medium")
-    for medium, g in med_groups:
-        if medium is None or g.empty:
-            continue
-        n = int(g.shape[0])
-        median_price = float(g["value"].median())
-        median_ppa = float(g["price_per_area"].median()) if g["price_per_area"].notna().any() else None
-        multiplier = (median_price / global_median) if global_median > 0 else None
-        confidence = "low" if n < 30 else "high"
-        text = f"{medium} — median price ${median_price:,.0f} (N={n})."
-        if median_ppa is not None and not np.isnan(median_ppa):
-            text += f" Median price/area = ${median_ppa:,.2f}."
-        if multiplier is not None:
-            text += f" Multiplier vs global median = {multiplier:.2f}."
-        text += f" Confidence: {confidence}."
-        card = {
-            "type": "aggregate",
-            "scope": {"medium": medium},
-            "metric": "median_price",
-            "value": median_price,
-            "sample_size": n,
-            "confidence": confidence,
-            "text": text,
-            "provenance": {"created_at": datetime.utcnow().isoformat()}
-        }
-        cards.append(card)
-
-    # 2) Artist-level trends (top N artists)
-    artist_counts = df_valid["artist"].value_counts().nlargest(top_artists_n)
-    top_artists = list(artist_counts.index)
-    for artist in top_artists:
-        g = df_valid[df_valid["artist"] == artist]
-        if g.empty:
-            continue
-        n = int(g.shape[0])
-        median_price = float(g["value"].median())
-        median_ppa = float(g["price_per_area"].median()) if g["price_per_area"].notna().any() else None
-        confidence = "low" if n < 30 else "high"
-        text = f"Artist: {artist} — median price ${median_price:,.0f} (N={n})."
-        if median_ppa is not None and not np.isnan(median_ppa):
-            text += f" Median price/area = ${median_ppa:,.2f}."
-        text += f" Confidence: {confidence}."
-        card = {
-            "type": "aggregate",
-            "scope": {"artist": artist},
-            "metric": "median_price",
-            "value": median_price,
-            "sample_size": n,
-            "confidence": confidence,
-            "text": text,
-            "provenance": {"created_at": datetime.utcnow().isoformat()}
-        }
-        cards.append(card)
-
-    # 3) Size-bucket trends
-    size_groups = df_valid.groupby("size_bucket")
-    for size_bkt, g in size_groups:
-        if pd.isna(size_bkt) or g.empty:
+    cards = []
+    for field in dimensions:
+        if field not in df_valid.columns:
             continue
-        n = int(g.shape[0])
-        median_price = float(g["value"].median())
-        median_ppa = float(g["price_per_area"].median()) if g["price_per_area"].notna().any() else None
-        confidence = "low" if n < 30 else "high"
-        text = f"{size_bkt} artworks — median price ${median_price:,.0f} (N={n})."
-        if median_ppa is not None and not np.isnan(median_ppa):
-            text += f" Median price/area = ${median_ppa:,.2f}."
-        text += f" Confidence: {confidence}."
-        card = {
-            "type": "aggregate",
-            "scope": {"size_bucket": str(size_bkt)},
-            "metric": "median_price",
-            "value": median_price,
-            "sample_size": n,
-            "confidence": confidence,
-            "text": text,
-            "provenance": {"created_at": datetime.utcnow().isoformat()}
-        }
-        cards.append(card)
-
-    return cards
\ No newline at end of file
+        template = DIMENSION_TEMPLATES.get(field, DEFAULT_DIMENSION)
+        agg = aggregate_dimension(df_valid, field, top_artists_n if template.get("top_n") else None)
+        for key, n, median_price, median_ppa in zip(agg.index, agg["n"], agg["median_price"], agg["median_ppa"]):
+            if key is None or pd.isna(key):
+                continue
+            cards.append(make_trend_card(field, key, int(n), float(median_price),
+                                         None if pd.isna(median_ppa) else float(median_ppa),
+                                         global_median, created_at))
+    return cards
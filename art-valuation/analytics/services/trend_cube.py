@@ -0,0 +1,265 @@
+"""
+trend_cube.py — Precomputed multi-dimensional trend cube with roll-ups
+"""
+
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from config.settings import CUBE_DIMENSIONS, CUBE_PERIOD, CUBE_MIN_SUPPORT, CUBE_MAX_DIMS, TREND_CUBE_PATH
+from services.trend_analysis import _price_per_area
+
+# Price quantiles stored per cell (exact at build time)
+QUANTILE_GRID = (0.1, 0.25, 0.5, 0.75, 0.9)
+ALL = 0  # code of the rolled-up ("any value") slot in every dimension
+
+
+def sale_periods(df: pd.DataFrame, freq: str = CUBE_PERIOD) -> pd.Series:
+    """Sale-date period labels: '2023' (Y), '2023Q1' (Q) or '2023-01' (M)"""
+    dates = pd.to_datetime(df["sale_date"], errors="coerce", utc=True).dt.tz_localize(None)
+    labels = dates.dt.to_period(freq).astype(str)
+    return labels.where(dates.notna(), None)
+
+
+def _group_quantiles(sorted_values: np.ndarray, starts: np.ndarray, counts: np.ndarray, q: float) -> np.ndarray:
+    # Linear-interpolated quantile of each contiguous sorted group (pandas' default)
+    pos = (counts - 1) * q
+    lo = np.floor(pos).astype(np.int64)
+    frac = pos - lo
+    hi = np.minimum(lo + 1, counts - 1)
+    return sorted_values[starts + lo] * (1 - frac) + sorted_values[starts + hi] * frac
+
+
+class TrendCube:
+    """
+    OLAP-style cube of sale aggregates over CUBE_DIMENSIONS. Every cell of
+    every cuboid (each subset of up to max_dims dimensions) is keyed by one
+    packed int64: a mixed-radix number whose digit per dimension is the value
+    code, or ALL when that dimension is rolled up. Cells are kept in parallel
+    arrays sorted by key, so a lookup is one binary search. Cells below
+    min_support sales are pruned at build time; cell() then rolls up to a
+    coarser cell when asked to.
+    """
+
+    def __init__(self, dimensions: List[str], dictionaries: Dict[str, List[str]], keys: np.ndarray,
+                 n: np.ndarray, price_sum: np.ndarray, quantiles: np.ndarray, ppa_median: np.ndarray,
+                 meta: Optional[Dict[str, Any]] = None):
+        self.dimensions = dimensions
+        self.dictionaries = dictionaries
+        self.lookup = {d: {v: code + 1 for code, v in enumerate(values)} for d, values in dictionaries.items()}
+        radix = [len(dictionaries[d]) + 1 for d in dimensions]
+        self.strides = np.cumprod([1] + radix[:-1]).astype(np.int64)
+        self.keys = keys
+        self.n = n
+        self.price_sum = price_sum
+        self.quantiles = quantiles
+        self.ppa_median = ppa_median
+        self.meta = meta or {}
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, dimensions: Optional[List[str]] = None, min_support: int = CUBE_MIN_SUPPORT,
+              max_dims: int = CUBE_MAX_DIMS, period: str = CUBE_PERIOD) -> "TrendCube":
+        dimensions = dimensions or [d.strip() for d in CUBE_DIMENSIONS.split(",") if d.strip()]
+        df = df.loc[df["value"].notna()]
+        price = df["value"].to_numpy(dtype=np.float64)
+        ppa = _price_per_area(df)
+
+        codes, dictionaries = [], {}
+        for d in dimensions:
+            if d == "period":
+                column = sale_periods(df, period)
+            elif d in df.columns:
+                column = df[d]
+            else:
+                column = pd.Series([None] * len(df), index=df.index, dtype=object)
+            c, uniques = pd.factorize(column, sort=True)
+            c = c + 1  # missing (-1) becomes ALL, i.e. the row only counts where d is rolled up
+            codes.append(c.astype(np.uint16) if len(uniques) < np.iinfo(np.uint16).max else c)
+            dictionaries[d] = [str(u) for u in uniques]
+
+        radix = [len(dictionaries[d]) + 1 for d in dimensions]
+        strides = np.cumprod([1] + radix[:-1]).astype(np.int64)
+
+        # Cuboids are visited depth-first, each one adding a dimension to its
+        # parent: a stable sort of the parent's row order on the new dimension's
+        # codes keeps groups contiguous and, starting from rows sorted by price
+        # (and by finite price/area), keeps every group sorted by value.
+        parts = []
+
+        def visit(cuboid, by_price, by_ppa):
+            key_price = np.zeros(len(by_price), dtype=np.int64)
+            key_ppa = np.zeros(len(by_ppa), dtype=np.int64)
+            for i in cuboid:
+                key_price += codes[i][by_price].astype(np.int64) * strides[i]
+                key_ppa += codes[i][by_ppa].astype(np.int64) * strides[i]
+            parts.append(cls._aggregate(key_price, price[by_price], key_ppa, ppa[by_ppa], min_support))
+            if len(cuboid) == max_dims:
+                return
+            for i in range(cuboid[-1] + 1 if cuboid else 0, len(dimensions)):
+                children = []
+                for rows in (by_price, by_ppa):
+                    rows = rows[codes[i][rows] != ALL]
+                    children.append(rows[np.argsort(codes[i][rows], kind="stable")])
+                visit(cuboid + (i,), *children)
+
+        finite = np.flatnonzero(np.isfinite(ppa))
+        visit((), np.argsort(price, kind="stable"), finite[np.argsort(ppa[finite], kind="stable")])
+
+        keys = np.concatenate([p[0] for p in parts])
+        order = np.argsort(keys)
+        meta = {"period": period, "min_support": min_support, "max_dims": max_dims,
+                "rows": int(len(price)), "created_at": datetime.utcnow().isoformat()}
+        return cls(dimensions, dictionaries, keys[order],
+                   *[np.concatenate([p[i] for p in parts])[order] for i in range(1, 5)], meta=meta)
+
+    @staticmethod
+    def _groups(sorted_keys: np.ndarray):
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]) if len(sorted_keys) \
+            else np.empty(0, dtype=np.int64)
+        return starts, np.diff(np.r_[starts, len(sorted_keys)])
+
+    @classmethod
+    def _aggregate(cls, key: np.ndarray, price: np.ndarray, ppa_key: np.ndarray, ppa: np.ndarray,
+                   min_support: int):
+        # One cuboid, rows grouped by packed key and value-sorted within groups:
+        # counts, sums and exact quantiles per cell
+        starts, counts = cls._groups(key)
+        sums = np.add.reduceat(price, starts) if len(starts) else np.empty(0)
+        keep = counts >= min_support
+        starts, counts, sums = starts[keep], counts[keep], sums[keep]
+        cell_keys = key[starts]
+        quantiles = np.stack([_group_quantiles(price, starts, counts, q) for q in QUANTILE_GRID], axis=1) \
+            if len(starts) else np.empty((0, len(QUANTILE_GRID)))
+
+        ppa_median = np.full(len(cell_keys), np.nan)
+        if len(ppa_key) and len(cell_keys):
+            pstarts, pcounts = cls._groups(ppa_key)
+            medians = dict(zip(ppa_key[pstarts].tolist(), _group_quantiles(ppa, pstarts, pcounts, 0.5).tolist()))
+            ppa_median = np.array([medians.get(k, np.nan) for k in cell_keys.tolist()])
+
+        return (cell_keys, counts.astype(np.int64), sums.astype(np.float64),
+                quantiles.astype(np.float32), ppa_median.astype(np.float32))
+
+    # ---------- lookups ----------
+
+    def _encode(self, spec: Dict[str, Any]) -> Optional[int]:
+        key = 0
+        for i, d in enumerate(self.dimensions):
+            value = spec.get(d)
+            if value is None:
+                continue
+            code = self.lookup[d].get(str(value))
+            if code is None:
+                return None
+            key += code * int(self.strides[i])
+        return key
+
+    def _row(self, key: Optional[int]) -> int:
+        if key is None:
+            return -1
+        pos = int(np.searchsorted(self.keys, key))
+        return pos if pos < len(self.keys) and self.keys[pos] == key else -1
+
+    def _cell(self, pos: int, spec: Dict[str, Any]) -> Dict[str, Any]:
+        n = int(self.n[pos])
+        cell = {
+            "scope": {d: spec[d] for d in self.dimensions if spec.get(d) is not None},
+            "n": n,
+            "mean_price": float(self.price_sum[pos] / n),
+            "median_ppa": None if np.isnan(self.ppa_median[pos]) else float(self.ppa_median[pos]),
+        }
+        for q, value in zip(QUANTILE_GRID, self.quantiles[pos]):
+            cell[f"p{int(q * 100)}"] = float(value)
+        cell["median_price"] = cell["p50"]
+        return cell
+
+    def cell(self, spec: Dict[str, Any], roll_up: Sequence[str] = ()) -> Optional[Dict[str, Any]]:
+        """
+        Aggregates for one cell, e.g. {"medium": "Oil", "size_bucket": "size_3", "period": "2024"}.
+        Unspecified dimensions are rolled up. If the cell was pruned (or never
+        seen) and `roll_up` lists dimensions, they are dropped one at a time in
+        that order until a cell with enough support is found.
+        """
+        spec = {d: v for d, v in spec.items() if v is not None and d in self.lookup}
+        pos = self._row(self._encode(spec))
+        for d in roll_up:
+            if pos >= 0:
+                break
+            spec.pop(d, None)
+            pos = self._row(self._encode(spec))
+        return self._cell(pos, spec) if pos >= 0 else None
+
+    def drill_down(self, spec: Dict[str, Any], dimension: str) -> List[Dict[str, Any]]:
+        """All supported child cells of `spec` along one more dimension"""
+        base = self._encode({d: v for d, v in spec.items() if v is not None and d != dimension})
+        if base is None or dimension not in self.lookup or len(self.keys) == 0:
+            # No cells at all (e.g. every cell was pruned by the support threshold)
+            return []
+        stride = int(self.strides[self.dimensions.index(dimension)])
+        values = self.dictionaries[dimension]
+        candidates = base + np.arange(1, len(values) + 1, dtype=np.int64) * stride
+        pos = np.minimum(np.searchsorted(self.keys, candidates), len(self.keys) - 1)
+        hit = np.flatnonzero(self.keys[pos] == candidates)
+        return [self._cell(int(pos[i]), {**spec, dimension: values[i]}) for i in hit]
+
+    def cell_range(self, spec: Dict[str, Any], dimension: str, values: Sequence[str]) -> Optional[Dict[str, Any]]:
+        """
+        Combine sibling cells along one dimension, e.g. the last four quarters.
+        Counts and means are exact; quantiles are count-weighted averages of the
+        children's quantiles and flagged as approximate.
+        """
+        children = [c for c in self.drill_down(spec, dimension) if c["scope"][dimension] in set(map(str, values))]
+        if not children:
+            return None
+        n = np.array([c["n"] for c in children], dtype=np.float64)
+        cell = {"scope": {**{d: v for d, v in spec.items() if v is not None and d != dimension},
+                          dimension: list(values)},
+                "n": int(n.sum()),
+                "mean_price": float(sum(c["mean_price"] * c["n"] for c in children) / n.sum()),
+                "approximate_quantiles": len(children) > 1}
+        for q in QUANTILE_GRID:
+            name = f"p{int(q * 100)}"
+            cell[name] = float(np.dot([c[name] for c in children], n) / n.sum())
+        ppa = [(c["median_ppa"], c["n"]) for c in children if c["median_ppa"] is not None]
+        cell["median_ppa"] = float(sum(v * w for v, w in ppa) / sum(w for _, w in ppa)) if ppa else None
+        cell["median_price"] = cell["p50"]
+        return cell
+
+    def cuboid_frame(self, dimensions: Sequence[str]) -> pd.DataFrame:
+        """Every stored cell of one cuboid as a DataFrame (for inspection and card generation)"""
+        idx = [self.dimensions.index(d) for d in dimensions]
+        digits = [(self.keys // self.strides[i]) % (len(self.dictionaries[d]) + 1)
+                  for i, d in enumerate(self.dimensions)]
+        mask = np.ones(len(self.keys), dtype=bool)
+        for i, digit in enumerate(digits):
+            mask &= (digit != ALL) if i in idx else (digit == ALL)
+        frame = pd.DataFrame({d: np.asarray(self.dictionaries[d], dtype=object)[digits[i][mask] - 1]
+                              for i, d in zip(idx, dimensions)})
+        frame["n"] = self.n[mask]
+        frame["mean_price"] = self.price_sum[mask] / self.n[mask]
+        for j, q in enumerate(QUANTILE_GRID):
+            frame[f"p{int(q * 100)}"] = self.quantiles[mask, j]
+        frame["median_ppa"] = self.ppa_median[mask]
+        return frame
+
+    # ---------- persistence ----------
+
+    def save(self, path: str = TREND_CUBE_PATH):
+        header = {"dimensions": self.dimensions, "dictionaries": self.dictionaries, "meta": self.meta}
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, header=np.array(json.dumps(header)), keys=self.keys, n=self.n, price_sum=self.price_sum,
+                 quantiles=self.quantiles, ppa_median=self.ppa_median)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str = TREND_CUBE_PATH) -> Optional["TrendCube"]:
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            header = json.loads(str(data["header"]))
+            return cls(header["dimensions"], header["dictionaries"], data["keys"], data["n"],
+                       data["price_sum"], data["quantiles"], data["ppa_median"], meta=header["meta"])
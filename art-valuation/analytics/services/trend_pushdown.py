@@ -0,0 +1,248 @@
+"""
+trend_pushdown.py — Trend aggregation pushed down into MongoDB
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pymongo import MongoClient
+
+from config.settings import MONGO_URI, MONGO_DB, MONGO_COLLECTION, TREND_DIMENSIONS, PUSHDOWN_WORKERS
+from services.trend_analysis import DIMENSION_TEMPLATES, DEFAULT_DIMENSION, make_trend_card
+
+# Servers before 7.0 have no $median/$percentile: they return log-scale
+# histograms per key instead (at most HIST_BINS rows per key), and quantiles
+# are interpolated client-side. Either way the client receives aggregated rows
+# only, so transfer and memory depend on the number of keys, not documents.
+HIST_BINS = 256
+PRICE_RANGE = (1.0, 1e9)
+PPA_RANGE = (1e-4, 1e7)
+AREA_RANGE = (1e-2, 1e8)
+SIZE_BUCKETS = 3
+AGG_COLUMNS = ["n", "p25_price", "median_price", "p75_price", "median_ppa"]
+
+
+def _number(path: str) -> Dict[str, Any]:
+    # Same coercion as the loader (pd.to_numeric(errors="coerce")): non-numbers become null
+    return {"$convert": {"input": path, "to": "double", "onError": None, "onNull": None}}
+
+
+def _area_expr() -> Dict[str, Any]:
+    return {"$multiply": [_number("$dim1"), _number("$dim2")]}
+
+
+def _base_stages(key_expr: Any, match: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    # Only the grouping key, price and price/area leave the storage layer; the
+    # embedding and every other field are dropped by the $project
+    stages = [{"$match": match}] if match else []
+    stages += [
+        {"$project": {"_id": 0, "key": key_expr, "value": _number("$value"), "area": _area_expr()}},
+        {"$match": {"value": {"$ne": None}, "key": {"$ne": None}}},
+        {"$project": {"key": 1, "value": 1, "ppa": {
+            "$cond": [{"$gt": [{"$ifNull": ["$area", 0]}, 0]}, {"$divide": ["$value", "$area"]}, None]}}},
+    ]
+    return stages
+
+
+def _bucket_expr(path: str, value_range: Tuple[float, float]) -> Dict[str, Any]:
+    # Log-scale bin of a field; values below the range (including <= 0) land in bin 0
+    lo, hi = np.log(value_range[0]), np.log(value_range[1])
+    width = (hi - lo) / HIST_BINS
+    clipped = {"$min": [{"$max": [path, value_range[0]]}, value_range[1]]}
+    bucket = {"$floor": {"$divide": [{"$subtract": [{"$ln": clipped}, lo]}, width]}}
+    return {"$cond": [{"$eq": [{"$ifNull": [path, None]}, None]}, None, {"$min": [bucket, HIST_BINS - 1]}]}
+
+
+def percentile_pipeline(key_expr: Any, match: Optional[Dict[str, Any]] = None,
+                        top_n: Optional[int] = None) -> List[Dict[str, Any]]:
+    """$group with server-side approximate quantiles (MongoDB 7.0+)"""
+    pipeline = _base_stages(key_expr, match) + [
+        {"$group": {
+            "_id": "$key",
+            "n": {"$sum": 1},
+            "price": {"$percentile": {"input": "$value", "p": [0.25, 0.5, 0.75], "method": "approximate"}},
+            "median_ppa": {"$median": {"input": "$ppa", "method": "approximate"}},
+        }},
+    ]
+    if top_n is not None:
+        pipeline += [{"$sort": {"n": -1}}, {"$limit": top_n}]
+    return pipeline
+
+
+def histogram_pipeline(key_expr: Any, column: str, value_range: Tuple[float, float],
+                       match: Optional[Dict[str, Any]] = None, top_n: Optional[int] = None,
+                       keys: Optional[List[Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Fallback: counts per (key, log-scale bin) of 'value' or 'ppa'. top_n keeps
+    the bins of the top_n keys by count, keys the bins of the given keys only.
+    """
+    pipeline = _base_stages(key_expr, match)
+    if keys is not None:
+        pipeline.append({"$match": {"key": {"$in": keys}}})
+    pipeline += [
+        {"$project": {"key": 1, "bin": _bucket_expr("$" + column, value_range)}},
+        {"$match": {"bin": {"$ne": None}}},
+        {"$group": {"_id": {"key": "$key", "bin": "$bin"}, "count": {"$sum": 1}}},
+    ]
+    if top_n is not None:
+        # Rank keys by their total count and expand the winners' bins again
+        pipeline += [
+            {"$group": {"_id": "$_id.key", "n": {"$sum": "$count"},
+                        "bins": {"$push": {"bin": "$_id.bin", "count": "$count"}}}},
+            {"$sort": {"n": -1, "_id": 1}},
+            {"$limit": top_n},
+            {"$unwind": "$bins"},
+            {"$project": {"_id": {"key": "$_id", "bin": "$bins.bin"}, "count": "$bins.count"}},
+        ]
+    return pipeline
+
+
+def _hist_quantiles(bins: np.ndarray, counts: np.ndarray, qs, value_range: Tuple[float, float]) -> List[float]:
+    # Quantiles from a sparse log histogram, interpolated inside the bin
+    order = np.argsort(bins)
+    bins, counts = bins[order], counts[order].astype(np.float64)
+    running = np.cumsum(counts)
+    lo, hi = np.log(value_range[0]), np.log(value_range[1])
+    width = (hi - lo) / HIST_BINS
+    out = []
+    for q in qs:
+        target = q * running[-1]
+        i = min(int(np.searchsorted(running, target, side="left")), len(bins) - 1)
+        below = running[i] - counts[i]
+        frac = (target - below) / counts[i] if counts[i] else 0.5
+        out.append(float(np.exp(lo + (bins[i] + frac) * width)))
+    return out
+
+
+class TrendPushdown:
+    """
+    Computes the compute_basic_trends cards inside MongoDB: one aggregation
+    pipeline per dimension (plus the global median), run concurrently, with
+    $percentile/$median when the server supports them and a histogram
+    fallback otherwise.
+    """
+
+    def __init__(self, client: Optional[MongoClient] = None, workers: int = PUSHDOWN_WORKERS):
+        self.client = client or MongoClient(MONGO_URI)
+        self.coll = self.client[MONGO_DB][MONGO_COLLECTION]
+        self.workers = workers
+        version = self.client.server_info().get("versionArray", [0])
+        self.has_percentile = list(version[:2]) >= [7, 0]
+        # Area boundaries of the size buckets used by the last compute_trends
+        self.size_edges: Optional[List[float]] = None
+
+    def _aggregate(self, pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return list(self.coll.aggregate(pipeline, allowDiskUse=True))
+
+    def _histograms(self, key_expr: Any, column: str, value_range, match, top_n: Optional[int] = None,
+                    keys: Optional[List[Any]] = None) -> Dict[Any, Tuple[np.ndarray, np.ndarray]]:
+        rows = self._aggregate(histogram_pipeline(key_expr, column, value_range, match, top_n, keys))
+        grouped: Dict[Any, Tuple[list, list]] = {}
+        for row in rows:
+            bins, counts = grouped.setdefault(row["_id"]["key"], ([], []))
+            bins.append(row["_id"]["bin"])
+            counts.append(row["count"])
+        return {key: (np.asarray(b, dtype=np.int64), np.asarray(c)) for key, (b, c) in grouped.items()}
+
+    def aggregate_key(self, key_expr: Any, match: Optional[Dict[str, Any]] = None,
+                      top_n: Optional[int] = None) -> pd.DataFrame:
+        """Per key: n, p25/median/p75 price and median price/area (aggregate_dimension's shape)"""
+        if self.has_percentile:
+            rows = self._aggregate(percentile_pipeline(key_expr, match, top_n))
+            frame = pd.DataFrame({
+                "n": [r["n"] for r in rows],
+                "p25_price": [r["price"][0] for r in rows],
+                "median_price": [r["price"][1] for r in rows],
+                "p75_price": [r["price"][2] for r in rows],
+                "median_ppa": [r["median_ppa"] for r in rows],
+            }, index=pd.Index([r["_id"] for r in rows], dtype=object))
+        else:
+            price = self._histograms(key_expr, "value", PRICE_RANGE, match, top_n=top_n)
+            # Price/area only for the keys that made the price top_n
+            keys = list(price) if top_n is not None else None
+            ppa = self._histograms(key_expr, "ppa", PPA_RANGE, match, keys=keys) if price else {}
+            records = {}
+            for key, (bins, counts) in price.items():
+                p25, p50, p75 = _hist_quantiles(bins, counts, (0.25, 0.5, 0.75), PRICE_RANGE)
+                median_ppa = _hist_quantiles(*ppa[key], (0.5,), PPA_RANGE)[0] if key in ppa else None
+                records[key] = {"n": int(counts.sum()), "p25_price": p25, "median_price": p50,
+                                "p75_price": p75, "median_ppa": median_ppa}
+            # Explicit columns keep an empty collection's frame indexable
+            frame = pd.DataFrame.from_dict(records, orient="index", columns=AGG_COLUMNS)
+            if top_n is not None:
+                frame = frame.sort_values("n", ascending=False, kind="stable")
+        return frame if top_n is not None else frame.sort_index(key=lambda idx: idx.map(str))
+
+    def size_bucket_bounds(self, match: Optional[Dict[str, Any]] = None) -> List[float]:
+        # Tertile boundaries of area (missing area counts as 0, as in
+        # assign_size_buckets); usable as size_bucket_edges
+        area = {"$ifNull": [_area_expr(), 0]}
+        qs = [i / SIZE_BUCKETS for i in range(1, SIZE_BUCKETS)]
+        stages = ([{"$match": match}] if match else []) + [{"$project": {"_id": 0, "area": area}}]
+        if self.has_percentile:
+            rows = self._aggregate(stages + [{"$group": {"_id": None, "q": {
+                "$percentile": {"input": "$area", "p": qs, "method": "approximate"}}}}])
+            bounds = rows[0]["q"] if rows else [0.0] * len(qs)
+        else:
+            rows = self._aggregate(stages + [
+                {"$project": {"bin": _bucket_expr("$area", AREA_RANGE)}},
+                {"$group": {"_id": "$bin", "count": {"$sum": 1}}}])
+            bins = np.asarray([r["_id"] for r in rows], dtype=np.int64)
+            counts = np.asarray([r["count"] for r in rows])
+            bounds = _hist_quantiles(bins, counts, qs, AREA_RANGE) if len(rows) else [0.0] * len(qs)
+        return [float(b) for b in bounds]
+
+    def size_bucket_expr(self, bounds: List[float]) -> Dict[str, Any]:
+        # $switch labelling size_1..size_N by the area boundaries
+        area = {"$ifNull": [_area_expr(), 0]}
+        branches = [{"case": {"$lte": [area, bound]}, "then": f"size_{i + 1}"} for i, bound in enumerate(bounds)]
+        return {"$switch": {"branches": branches, "default": f"size_{SIZE_BUCKETS}"}}
+
+    def compute_trends(self, top_artists_n: int = 50, dimensions: Optional[List[str]] = None,
+                       match: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Same cards as compute_basic_trends, computed server-side"""
+        dimensions = dimensions or [d.strip() for d in TREND_DIMENSIONS.split(",") if d.strip()]
+        created_at = datetime.utcnow().isoformat()
+
+        def run(field: str) -> pd.DataFrame:
+            # size_bucket needs its area boundaries first, inside the same worker
+            if field == "size_bucket":
+                self.size_edges = self.size_bucket_bounds(match)
+                key_expr = self.size_bucket_expr(self.size_edges)
+            else:
+                key_expr = "$" + field
+            top_n = top_artists_n if DIMENSION_TEMPLATES.get(field, DEFAULT_DIMENSION).get("top_n") else None
+            return self.aggregate_key(key_expr, match, top_n)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            # The global median groups every document under one constant key
+            overall = pool.submit(self.aggregate_key, {"$literal": "all"}, match)
+            futures = {d: pool.submit(run, d) for d in dimensions}
+            global_frame = overall.result()
+            results = {d: f.result() for d, f in futures.items()}
+        global_median = float(global_frame["median_price"].iloc[0]) if not global_frame.empty else 0.0
+
+        cards = []
+        for field in dimensions:
+            agg = results[field]
+            for key, n, median_price, median_ppa in zip(agg.index, agg["n"], agg["median_price"], agg["median_ppa"]):
+                if key is None or pd.isna(key) or median_price is None:
+                    continue
+                card = make_trend_card(field, key, int(n), float(median_price),
+                                       None if median_ppa is None or pd.isna(median_ppa) else float(median_ppa),
+                                       global_median, created_at)
+                card["provenance"]["backend"] = "mongo" if self.has_percentile else "mongo-histogram"
+                cards.append(card)
+        return cards
+
+
+def compute_trends_pushdown(top_artists_n: int = 50, dimensions: Optional[List[str]] = None,
+                            match: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    pushdown = TrendPushdown()
+    try:
+        return pushdown.compute_trends(top_artists_n=top_artists_n, dimensions=dimensions, match=match)
+    finally:
+        pushdown.client.close()
@@ -0,0 +1,279 @@
+"""
+trend_series.py — Rolling time-window price trends per scope
+"""
+
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config.settings import (SERIES_WINDOWS, SERIES_KEEP_DAYS, SERIES_SLOPE_DAYS, SERIES_FLAT_SLOPE,
+                             SERIES_SLOPE_Z, TREND_DIMENSIONS, TREND_SERIES_PATH)
+from services.trend_analysis import DIMENSION_TEMPLATES, DEFAULT_DIMENSION
+
+# Prices are binned on a fixed log scale (one byte per sale); window medians are
+# interpolated inside the bin, so they are accurate to a small fraction of the
+# ~8% bin width.
+PRICE_BINS = 256
+LOG_EDGES = np.linspace(np.log(1.0), np.log(1e9), PRICE_BINS + 1)
+EPOCH = pd.Timestamp("1970-01-01")
+
+
+def sale_days(df: pd.DataFrame) -> np.ndarray:
+    """Days since epoch of each sale (-1 when unknown)"""
+    dates = pd.to_datetime(df["sale_date"], errors="coerce", utc=True).dt.tz_localize(None)
+    days = ((dates - EPOCH).dt.days).to_numpy(dtype=np.float64, na_value=np.nan)
+    return np.where(np.isnan(days), -1, days).astype(np.int64)
+
+
+def price_bins(prices: np.ndarray) -> np.ndarray:
+    logp = np.log(np.clip(prices, np.exp(LOG_EDGES[0]), np.exp(LOG_EDGES[-1])))
+    return np.clip(np.searchsorted(LOG_EDGES, logp, side="right") - 1, 0, PRICE_BINS - 1).astype(np.uint8)
+
+
+class ScopeSeries:
+    """
+    Daily series for one scope: per window, the sale volume and median price
+    over the trailing window ending on each day. Only the last SERIES_KEEP_DAYS
+    points are kept, plus the raw (day, price bin) pairs still inside the
+    longest window, which is all append() needs to extend the series and
+    what the trend slope is fitted on.
+    """
+
+    def __init__(self, n_windows: int):
+        self.days = np.empty(0, dtype=np.int32)
+        self.volume = np.empty((n_windows, 0), dtype=np.int32)
+        self.median = np.empty((n_windows, 0), dtype=np.float32)
+        self.tail_days = np.empty(0, dtype=np.int32)
+        self.tail_bins = np.empty(0, dtype=np.uint8)
+
+    def evaluate(self, first: int, last: int, windows: List[int]):
+        # Window counts for every day in [first, last] from one cumulative daily
+        # price histogram: counts(d, W) = C[d] - C[d - W], no per-window filtering.
+        # Only occupied price bins get a column (sparse scopes touch few).
+        t0 = first - max(windows) + 1
+        inside = self.tail_days >= t0
+        occupied, bins = np.unique(self.tail_bins[inside], return_inverse=True)
+        days = np.arange(first, last + 1)
+        if not len(occupied):
+            return (days.astype(np.int32), np.zeros((len(windows), len(days)), dtype=np.int32),
+                    np.full((len(windows), len(days)), np.nan, dtype=np.float32))
+        offsets = (self.tail_days[inside] - t0).astype(np.int64) * len(occupied) + bins
+        hist = np.bincount(offsets, minlength=(last - t0 + 1) * len(occupied)).astype(np.int32)
+        hist = hist.reshape(-1, len(occupied))
+        cum = np.concatenate([np.zeros((1, len(occupied)), dtype=np.int32), np.cumsum(hist, axis=0, dtype=np.int32)])
+
+        hi = days - t0 + 1
+        volume = np.empty((len(windows), len(days)), dtype=np.int32)
+        median = np.empty((len(windows), len(days)), dtype=np.float32)
+        for w, window in enumerate(windows):
+            counts = cum[hi] - cum[np.maximum(hi - window, 0)]
+            volume[w] = counts.sum(axis=1)
+            median[w] = self._hist_median(counts, volume[w], occupied)
+        return days.astype(np.int32), volume, median
+
+    @staticmethod
+    def _hist_median(counts: np.ndarray, volume: np.ndarray, occupied: np.ndarray) -> np.ndarray:
+        running = np.cumsum(counts, axis=1, dtype=np.int32)
+        target = volume / 2.0
+        idx = np.argmax(running >= target[:, None], axis=1)
+        rows = np.arange(len(idx))
+        below = running[rows, idx] - counts[rows, idx]
+        in_bin = counts[rows, idx]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            frac = np.where(in_bin > 0, (target - below) / in_bin, 0.5)
+        width = LOG_EDGES[1] - LOG_EDGES[0]
+        median = np.exp(LOG_EDGES[occupied[idx]] + frac * width)
+        return np.where(volume > 0, median, np.nan)
+
+    def extend(self, days: np.ndarray, volume: np.ndarray, median: np.ndarray, keep_days: int):
+        start = max(0, len(self.days) + len(days) - keep_days)
+        self.days = np.concatenate([self.days, days])[start:]
+        self.volume = np.concatenate([self.volume, volume], axis=1)[:, start:]
+        self.median = np.concatenate([self.median, median], axis=1)[:, start:]
+
+
+class TrendSeries:
+    """
+    Rolling 30/90/365-day (SERIES_WINDOWS) median price and volume per scope
+    key of the trend dimensions. append() folds in a batch of sales and only
+    evaluates the days after the previous as-of day; sales dated on or before
+    it still count toward later windows but earlier points are not revised.
+    """
+
+    def __init__(self, dimensions: Optional[List[str]] = None, windows: Optional[List[int]] = None,
+                 keep_days: int = SERIES_KEEP_DAYS):
+        self.dimensions = dimensions or [d.strip() for d in TREND_DIMENSIONS.split(",") if d.strip()]
+        self.windows = sorted(windows or [int(w) for w in SERIES_WINDOWS.split(",")])
+        self.keep_days = keep_days
+        self.as_of: Optional[int] = None
+        self.scopes: Dict[Tuple[str, Any], ScopeSeries] = {}
+
+    def append(self, df: pd.DataFrame):
+        days = sale_days(df)
+        valid = df["value"].notna().to_numpy() & (days >= 0)
+        df, days = df.loc[valid], days[valid]
+        if not len(df) and self.as_of is None:
+            return
+        bins = price_bins(df["value"].to_numpy(dtype=np.float64))
+
+        for field in self.dimensions:
+            if field not in df.columns:
+                continue
+            codes, keys = pd.factorize(df[field], sort=False)
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(keys) + 1))
+            for code, key in enumerate(keys):
+                rows = order[bounds[code]:bounds[code + 1]]
+                scope = self.scopes.setdefault((field, key), ScopeSeries(len(self.windows)))
+                scope.tail_days = np.concatenate([scope.tail_days, days[rows].astype(np.int32)])
+                scope.tail_bins = np.concatenate([scope.tail_bins, bins[rows]])
+
+        previous = self.as_of
+        self.as_of = max([d for d in (previous, int(days.max()) if len(days) else None) if d is not None])
+        longest = self.windows[-1]
+        for scope in self.scopes.values():
+            if not len(scope.tail_days) and not len(scope.days):
+                continue
+            first = previous + 1 if previous is not None else int(scope.tail_days.min())
+            first = max(first, self.as_of - self.keep_days + 1)
+            if first <= self.as_of:
+                scope.extend(*scope.evaluate(first, self.as_of, self.windows), self.keep_days)
+            keep = scope.tail_days > self.as_of - longest
+            scope.tail_days, scope.tail_bins = scope.tail_days[keep], scope.tail_bins[keep]
+
+    def latest(self, field: str, key) -> Optional[Dict[str, Any]]:
+        """Windowed medians/volumes on the as-of day, slope and momentum for one scope"""
+        scope = self.scopes.get((field, key))
+        if scope is None or not len(scope.days):
+            return None
+        windows = {w: {"median_price": None if np.isnan(scope.median[i, -1]) else float(scope.median[i, -1]),
+                       "volume": int(scope.volume[i, -1])}
+                   for i, w in enumerate(self.windows)}
+        short, long_ = windows[self.windows[0]]["median_price"], windows[self.windows[-1]]["median_price"]
+        momentum = short / long_ - 1 if short and long_ else None
+        fit = self._slope(scope)
+        if fit is None:
+            slope, slope_se, direction = None, None, "unknown"
+        else:
+            beta, se = fit
+            slope, slope_se = float(np.expm1(beta * 30)), float(se * 30)
+            # A direction only when the slope clears both its noise and the flat band
+            significant = beta != 0 and abs(beta) >= SERIES_SLOPE_Z * se
+            if not significant or abs(slope) < SERIES_FLAT_SLOPE:
+                direction = "flat"
+            else:
+                direction = "up" if slope > 0 else "down"
+        return {"windows": windows, "momentum": momentum, "slope_per_30d": slope, "slope_se_per_30d": slope_se,
+                "direction": direction}
+
+    def _slope(self, scope: ScopeSeries) -> Optional[Tuple[float, float]]:
+        # Least-squares fit of log price on sale day over the individual sales of
+        # the last SERIES_SLOPE_DAYS days (bin centres of the retained tail).
+        # Individual sales are independent, unlike the overlapping daily window
+        # medians, so the standard error is meaningful. Returns (beta, se) per day.
+        recent = scope.tail_days > self.as_of - min(SERIES_SLOPE_DAYS, self.windows[-1])
+        x = scope.tail_days[recent].astype(np.float64)
+        if len(x) < 3 or np.ptp(x) == 0:
+            return None
+        y = LOG_EDGES[scope.tail_bins[recent]] + (LOG_EDGES[1] - LOG_EDGES[0]) / 2
+        xc = x - x.mean()
+        sxx = np.sum(xc ** 2)
+        beta = np.sum(xc * (y - y.mean())) / sxx
+        residual = y - y.mean() - beta * xc
+        se = np.sqrt(np.sum(residual ** 2) / (len(x) - 2) / sxx)
+        return float(beta), float(se)
+
+    def cards(self, top_artists_n: int = 50) -> List[Dict[str, Any]]:
+        """Time-series insight cards carrying direction, slope and windowed medians"""
+        if self.as_of is None:
+            return []
+        as_of = datetime.fromtimestamp(self.as_of * 86400, timezone.utc).date().isoformat()
+        created_at = datetime.utcnow().isoformat()
+        mid = self.windows[len(self.windows) // 2]
+
+        cards = []
+        for field in self.dimensions:
+            template = DIMENSION_TEMPLATES.get(field, DEFAULT_DIMENSION)
+            entries = [(key, self.latest(field, key)) for (f, key) in self.scopes
+                       if f == field and key is not None and not pd.isna(key)]
+            entries = [(key, latest) for key, latest in entries if latest and latest["windows"][mid]["volume"]]
+            if template.get("top_n"):
+                entries = sorted(entries, key=lambda e: -e[1]["windows"][self.windows[-1]]["volume"])[:top_artists_n]
+            else:
+                entries = sorted(entries, key=lambda e: str(e[0]))
+            for key, latest in entries:
+                window = latest["windows"][mid]
+                # High only with enough sales and a trend distinguishable from noise
+                confidence = "high" if window["volume"] >= 30 and latest["direction"] in ("up", "down") else "low"
+                text = (template["label"].format(field=field, key=key)
+                        + f" — {mid}-day median price ${window['median_price']:,.0f} (N={window['volume']})"
+                        + f" as of {as_of}.")
+                if latest["slope_per_30d"] is not None:
+                    text += (f" Trend: {latest['direction']} ({latest['slope_per_30d'] * 100:+.1f}%"
+                             f" ± {latest['slope_se_per_30d'] * 100:.1f}% per 30 days).")
+                if latest["momentum"] is not None:
+                    text += (f" {self.windows[0]}-day vs {self.windows[-1]}-day median:"
+                             f" {latest['momentum'] * 100:+.1f}%.")
+                text += f" Confidence: {confidence}."
+                cards.append({
+                    "type": "time_series",
+                    "scope": {field: str(key) if field == "size_bucket" else key},
+                    "metric": "median_price_slope",
+                    "value": latest["slope_per_30d"],
+                    "slope_se": latest["slope_se_per_30d"],
+                    "direction": latest["direction"],
+                    "momentum": latest["momentum"],
+                    "windows": {str(w): v for w, v in latest["windows"].items()},
+                    "sample_size": window["volume"],
+                    "confidence": confidence,
+                    "text": text,
+                    "provenance": {"created_at": created_at, "as_of": as_of}
+                })
+        return cards
+
+    def save(self, path: str = TREND_SERIES_PATH):
+        scopes = list(self.scopes.items())
+        header = {"dimensions": self.dimensions, "windows": self.windows, "keep_days": self.keep_days,
+                  "as_of": self.as_of,
+                  "scopes": [[field, key.item() if isinstance(key, np.generic) else key]
+                             for (field, key), _ in scopes]}
+
+        def offsets(arrays):
+            return np.concatenate([[0], np.cumsum([len(a) for a in arrays])]).astype(np.int64)
+
+        series = [s for _, s in scopes]
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, header=np.array(json.dumps(header)),
+                 days=np.concatenate([s.days for s in series] or [np.empty(0, np.int32)]),
+                 days_off=offsets([s.days for s in series]),
+                 volume=np.concatenate([s.volume for s in series] or [np.empty((len(self.windows), 0), np.int32)], axis=1),
+                 median=np.concatenate([s.median for s in series] or [np.empty((len(self.windows), 0), np.float32)], axis=1),
+                 tail_days=np.concatenate([s.tail_days for s in series] or [np.empty(0, np.int32)]),
+                 tail_bins=np.concatenate([s.tail_bins for s in series] or [np.empty(0, np.uint8)]),
+                 tail_off=offsets([s.tail_days for s in series]))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str = TREND_SERIES_PATH) -> Optional["TrendSeries"]:
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            header = json.loads(str(data["header"]))
+            series = cls(header["dimensions"], header["windows"], header["keep_days"])
+            series.as_of = header["as_of"]
+            d_off, t_off = data["days_off"], data["tail_off"]
+            days, volume, median = data["days"], data["volume"], data["median"]
+            tail_days, tail_bins = data["tail_days"], data["tail_bins"]
+            for i, (field, key) in enumerate(header["scopes"]):
+                scope = ScopeSeries(len(series.windows))
+                scope.days = days[d_off[i]:d_off[i + 1]]
+                scope.volume = volume[:, d_off[i]:d_off[i + 1]]
+                scope.median = median[:, d_off[i]:d_off[i + 1]]
+                scope.tail_days = tail_days[t_off[i]:t_off[i + 1]]
+                scope.tail_bins = tail_bins[t_off[i]:t_off[i + 1]]
+                series.scopes[(field, key)] = scope
+        return series
@@ -0,0 +1,165 @@
+"""
+trend_store.py — Incremental trend store backed by quantile sketches
+"""
+
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config.settings import TREND_DIMENSIONS
+from services.quantile_sketch import KLLSketch, sketch_k
+from services.trend_analysis import DIMENSION_TEMPLATES, DEFAULT_DIMENSION, _price_per_area, make_trend_card
+
+QUANTILES = {"p25": 0.25, "p50": 0.5, "p75": 0.75}
+GLOBAL_SCOPE = ("__global__", None)
+
+
+class ScopeStats:
+    """Count plus price and price/area sketches for one scope key"""
+
+    def __init__(self, k: Optional[int] = None):
+        self.n = 0
+        self.price = KLLSketch(k)
+        self.ppa = KLLSketch(k)
+
+    def update(self, prices: np.ndarray, ppa: np.ndarray):
+        self.n += len(prices)
+        self.price.update_many(prices)
+        self.ppa.update_many(ppa)
+
+    def merge(self, other: "ScopeStats"):
+        self.n += other.n
+        self.price.merge(other.price)
+        self.ppa.merge(other.ppa)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "n": self.n,
+            "price": {name: self.price.quantile(q) for name, q in QUANTILES.items()},
+            "price_per_area": {name: self.ppa.quantile(q) for name, q in QUANTILES.items()},
+            "rank_epsilon": max(self.price.rank_epsilon(), self.ppa.rank_epsilon()),
+        }
+
+
+class TrendStore:
+    """
+    Per-scope counts and KLL sketches for every trend dimension.
+    New sales are folded in with update(); stores built on separate shards
+    combine with merge(). Quantile summaries are cached per scope and only
+    recomputed for scopes touched since the last read, so lookups never scan
+    the sales history.
+    """
+
+    def __init__(self, dimensions: Optional[List[str]] = None, k: Optional[int] = None):
+        self.dimensions = dimensions or [d.strip() for d in TREND_DIMENSIONS.split(",") if d.strip()]
+        self.k = k or sketch_k()
+        self.scopes: Dict[Tuple[str, Any], ScopeStats] = {}
+        self._summaries: Dict[Tuple[str, Any], Dict[str, Any]] = {}
+
+    def _stats(self, scope: Tuple[str, Any]) -> ScopeStats:
+        stats = self.scopes.get(scope)
+        if stats is None:
+            stats = self.scopes[scope] = ScopeStats(self.k)
+        self._summaries.pop(scope, None)
+        return stats
+
+    def update(self, df: pd.DataFrame):
+        """Fold a batch of sales (rows with 'value', 'area' and the dimension columns) into the sketches"""
+        df_valid = df.loc[df["value"].notna()]
+        if df_valid.empty:
+            return
+        prices = df_valid["value"].to_numpy(dtype=np.float64)
+        ppa = _price_per_area(df_valid)
+        self._stats(GLOBAL_SCOPE).update(prices, ppa)
+
+        for field in self.dimensions:
+            if field not in df_valid.columns:
+                continue
+            codes, keys = pd.factorize(df_valid[field], sort=False)
+            order = np.argsort(codes, kind="stable")
+            sorted_codes = codes[order]
+            bounds = np.searchsorted(sorted_codes, np.arange(len(keys) + 1))
+            for code, key in enumerate(keys):
+                rows = order[bounds[code]:bounds[code + 1]]
+                self._stats((field, key)).update(prices[rows], ppa[rows])
+
+    def merge(self, other: "TrendStore") -> "TrendStore":
+        """Combine a store built on another shard of sales into this one"""
+        for scope, stats in other.scopes.items():
+            self._stats(scope).merge(stats)
+        for field in other.dimensions:
+            if field not in self.dimensions:
+                self.dimensions.append(field)
+        return self
+
+    def summary(self, field: str, key) -> Optional[Dict[str, Any]]:
+        """Count, p25/p50/p75 of price and price/area, and the rank error bound for one scope"""
+        scope = (field, key)
+        cached = self._summaries.get(scope)
+        if cached is None:
+            stats = self.scopes.get(scope)
+            if stats is None:
+                return None
+            cached = self._summaries[scope] = stats.summary()
+        return cached
+
+    def global_summary(self) -> Optional[Dict[str, Any]]:
+        return self.summary(*GLOBAL_SCOPE)
+
+    def cards(self, top_artists_n: int = 50) -> List[Dict[str, Any]]:
+        """Trend cards in the compute_basic_trends shape, with quantiles and rank epsilon attached"""
+        overall = self.global_summary()
+        global_median = overall["price"]["p50"] if overall else 0.0
+        created_at = datetime.utcnow().isoformat()
+
+        cards = []
+        for field in self.dimensions:
+            keys = [key for (f, key) in self.scopes if f == field and key is not None and not pd.isna(key)]
+            template = DIMENSION_TEMPLATES.get(field, DEFAULT_DIMENSION)
+            if template.get("top_n"):
+                keys = sorted(keys, key=lambda key: -self.scopes[(field, key)].n)[:top_artists_n]
+            else:
+                keys = sorted(keys, key=str)
+            for key in keys:
+                summary = self.summary(field, key)
+                card = make_trend_card(field, key, summary["n"], summary["price"]["p50"],
+                                       summary["price_per_area"]["p50"], global_median, created_at)
+                card["quantiles"] = summary["price"]
+                card["price_per_area_quantiles"] = summary["price_per_area"]
+                card["rank_epsilon"] = summary["rank_epsilon"]
+                cards.append(card)
+        return cards
+
+    def save(self, path: str):
+        data = {
+            "dimensions": self.dimensions,
+            "k": self.k,
+            "scopes": [
+                {"field": field, "key": key.item() if isinstance(key, np.generic) else key, "n": stats.n,
+                 "price": stats.price.to_dict(), "ppa": stats.ppa.to_dict()}
+                for (field, key), stats in self.scopes.items()
+            ],
+        }
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["TrendStore"]:
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        store = cls(dimensions=data["dimensions"], k=data["k"])
+        for entry in data["scopes"]:
+            stats = ScopeStats(store.k)
+            stats.n = entry["n"]
+            stats.price = KLLSketch.from_dict(entry["price"])
+            stats.ppa = KLLSketch.from_dict(entry["ppa"])
+            store.scopes[(entry["field"], entry["key"])] = stats
+        return store
@@ -0,0 +1,265 @@
+"""
+valuation.py — Deterministic price estimates from comparables and trend cards
+"""
+
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from config.settings import (VALUATION_K, VALUATION_DISTANCE_EPS, VALUATION_MAX_ADJUST, VALUATION_INTERVAL_Z,
+                             VALUATION_MIN_SPREAD, VALUATION_CONF_DISTANCE)
+
+# Segment fields whose median prices adjust a comparable towards the target
+ADJUST_FIELDS = ("medium", "size_bucket")
+# Spread (log scale) of an estimate that falls back to a segment median
+FALLBACK_SPREAD = 0.5
+CONFIDENCE_LABELS = ((0.5, "high"), (0.25, "medium"), (0.0, "low"))
+
+
+def segment_medians(cards: List[Dict[str, Any]], fields=ADJUST_FIELDS) -> Dict[str, Dict[Any, float]]:
+    """{field: {scope value: median price}} from the aggregate trend cards"""
+    medians: Dict[str, Dict[Any, float]] = {f: {} for f in fields}
+    for card in cards:
+        if card.get("type") != "aggregate" or card.get("metric") != "median_price":
+            continue
+        for field, key in card["scope"].items():
+            if field in medians and card.get("value"):
+                medians[field][key] = float(card["value"])
+    return medians
+
+
+def confidence_label(score: float) -> str:
+    for threshold, label in CONFIDENCE_LABELS:
+        if score >= threshold:
+            return label
+    return CONFIDENCE_LABELS[-1][1]
+
+
+class ValuationEngine:
+    """
+    Prices a batch of artworks without the LLM:
+      1. k nearest comparables per artwork from the embedding index (one batched search)
+      2. each comparable's sale price is scaled by the ratio of segment medians
+         (target medium / comparable medium, target size bucket / comparable
+         size bucket), each ratio clipped to VALUATION_MAX_ADJUST
+      3. the estimate is the inverse-distance weighted mean of the adjusted log
+         prices; the range is +/- VALUATION_INTERVAL_Z weighted log std devs
+      4. confidence in [0, 1] is the product of an effective-sample-size term,
+         a similarity term and a spread term
+    Artworks with no priced comparables fall back to their segment median with
+    confidence 0. All steps are array operations over (artworks, k).
+    """
+
+    def __init__(self, index, cards: List[Dict[str, Any]], k: int = VALUATION_K,
+                 resolve: Optional[Callable[[str, Any], Any]] = None, size_edges: Optional[List[float]] = None):
+        # index: ImageEmbeddingIndex or SegmentedIndex (database.mutable_index.open_index)
+        self.index = index
+        self.k = k
+        self.medians = segment_medians(cards)
+        # Maps a target's attribute value to the scope value of the cards
+        # (e.g. InsightIndex.resolve_scope); exact match when not given
+        self.resolve = resolve
+        # Area edges of the trend data's size buckets, for artworks without one
+        self.size_edges = size_edges
+        self._columns: Dict[int, Tuple[Any, Dict[str, np.ndarray]]] = {}
+        self._ids: Dict[int, Tuple[Any, np.ndarray]] = {}
+
+    @classmethod
+    def from_insight_index(cls, index, insight_index, k: int = VALUATION_K) -> "ValuationEngine":
+        return cls(index, insight_index.cards, k=k, resolve=insight_index.resolve_scope,
+                   size_edges=insight_index.meta.get("size_edges"))
+
+    def prepare(self):
+        """Build the per-segment columns up front instead of on the first search"""
+        for segment in getattr(self.index, "segments", [self.index]):
+            if len(segment.ids):
+                self._segment_columns(segment)
+
+    def _segment_columns(self, segment) -> Dict[str, np.ndarray]:
+        # Per-row sale price and segment medians of one index segment, computed once
+        cached = self._columns.get(id(segment))
+        if cached is not None and cached[0] is segment:
+            return cached[1]
+        table = segment.meta_table
+        if table is None:
+            from database.index_store import MetaTable
+            table = MetaTable.from_records([segment.meta.get(_id, {}) for _id in segment.ids])
+        n = len(segment.ids)
+        columns = {"price": _float_column(table, "sale_price", n)}
+        for field in ADJUST_FIELDS:
+            columns[field] = _median_column(table, field, self.medians[field], n)
+        self._columns[id(segment)] = (segment, columns)
+        return columns
+
+    def _segment_ids(self, segment) -> np.ndarray:
+        cached = self._ids.get(id(segment))
+        if cached is not None and cached[0] is segment:
+            return cached[1]
+        ids = np.asarray([str(_id) for _id in segment.ids], dtype=object)
+        self._ids[id(segment)] = (segment, ids)
+        return ids
+
+    def _neighbors(self, q: np.ndarray,
+                   exclude_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        # (Q, k) distances and gathered comparable columns; missing slots are NaN.
+        # A comparable whose id is the query's own exclude_ids entry (an artwork
+        # that is itself in the index) is dropped, so one extra neighbour is searched.
+        k = self.k + (exclude_ids is not None)
+        if hasattr(self.index, "segments"):
+            dists, segs, rows = self.index.search(q, k)
+            segments = self.index.segments
+        else:
+            dists, rows = self.index.search(q, k)
+            segs = np.where(rows >= 0, 0, -1)
+            segments = [self.index]
+        dists = np.asarray(dists, dtype=np.float64)
+        if exclude_ids is not None:
+            found = np.full(rows.shape, None, dtype=object)
+            for n in np.unique(segs[segs >= 0]):
+                at = segs == n
+                found[at] = self._segment_ids(segments[int(n)])[rows[at]]
+            own = found == np.asarray(exclude_ids, dtype=object)[:, None]
+            dists = np.where(own, np.inf, dists)
+            segs = np.where(own, -1, segs)
+            # Move the dropped slot to the end (results are distance-ordered) and trim to k
+            order = np.argsort(own, axis=1, kind="stable")[:, :self.k]
+            dists, segs, rows = (np.take_along_axis(a, order, axis=1) for a in (dists, segs, rows))
+        gathered = {name: np.full(rows.shape, np.nan) for name in ("price",) + ADJUST_FIELDS}
+        for n in np.unique(segs[segs >= 0]):
+            at = segs == n
+            columns = self._segment_columns(segments[int(n)])
+            for name, values in columns.items():
+                gathered[name][at] = values[rows[at]]
+        return dists, gathered
+
+    def _target_medians(self, metadata: Union[List[Dict[str, Any]], pd.DataFrame]) -> Dict[str, np.ndarray]:
+        # Each distinct attribute value is resolved once and broadcast back by
+        # its factorized code, so a portfolio costs one lookup per value, not per row
+        out = {}
+        for field in ADJUST_FIELDS:
+            if isinstance(metadata, pd.DataFrame):
+                values = metadata[field] if field in metadata.columns else pd.Series([None] * len(metadata))
+            else:
+                values = pd.Series([meta.get(field) for meta in metadata], dtype=object)
+            codes, uniques = pd.factorize(values.astype(object))
+            medians = self.medians[field]
+            lookup = np.full(len(uniques) + 1, np.nan)  # code -1 (missing) indexes the trailing NaN
+            for i, key in enumerate(uniques):
+                if self.resolve is not None:
+                    key = self.resolve(field, key)
+                median = medians.get(key) if key is not None else None
+                if median is not None:
+                    lookup[i] = median
+            out[field] = lookup[codes]
+        return out
+
+    def estimate_batch(self, embeddings, metadata: Optional[Union[List[Dict[str, Any]], pd.DataFrame]] = None,
+                       timer=None, exclude_ids=None) -> pd.DataFrame:
+        """
+        One row per artwork: estimate, low, high, confidence (+ label), comparable
+        counts and the target's segment medians. metadata is a list of dicts or a
+        DataFrame with medium/size_bucket columns; embeddings=None prices from
+        the segment medians only. exclude_ids (one id per artwork) keeps an
+        indexed artwork from being its own comparable. timer
+        (utils.helpers.PhaseTimer) collects the search and estimate times.
+        """
+        phase = timer.phase if timer is not None else (lambda name: nullcontext())
+        if embeddings is None:
+            n = len(metadata)
+            dists = np.full((n, 0), np.inf)
+            comps = {name: np.full((n, 0), np.nan) for name in ("price",) + ADJUST_FIELDS}
+        else:
+            q = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+            with phase("search"):
+                dists, comps = self._neighbors(q, None if exclude_ids is None else
+                                               np.asarray([str(_id) for _id in exclude_ids], dtype=object))
+        metadata = metadata if metadata is not None else [{}] * len(dists)
+        with phase("estimate"):
+            return self._estimate(dists, comps, self._target_medians(metadata))
+
+    def _estimate(self, dists: np.ndarray, comps: Dict[str, np.ndarray],
+                  targets: Dict[str, np.ndarray]) -> pd.DataFrame:
+        # Segment adjustment; an unknown median on either side leaves the price as is
+        log_adjust = np.zeros(dists.shape)
+        limit = np.log(VALUATION_MAX_ADJUST)
+        for field in ADJUST_FIELDS:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratio = np.log(targets[field][:, None] / comps[field])
+            log_adjust += np.clip(np.nan_to_num(ratio, nan=0.0, posinf=0.0, neginf=0.0), -limit, limit)
+
+        price = comps["price"]
+        valid = np.isfinite(price) & (price > 0) & np.isfinite(dists)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_price = np.where(valid, np.log(np.where(valid, price, 1.0)) + log_adjust, 0.0)
+        weights = np.where(valid, 1.0 / (np.maximum(np.where(valid, dists, 0.0), 0.0) + VALUATION_DISTANCE_EPS), 0.0)
+
+        total = weights.sum(axis=1)
+        has_comps = total > 0
+        safe_total = np.where(has_comps, total, 1.0)
+        mu = (weights * log_price).sum(axis=1) / safe_total
+        var = (weights * (log_price - mu[:, None]) ** 2).sum(axis=1) / safe_total
+        spread = np.maximum(np.sqrt(var), VALUATION_MIN_SPREAD)
+        n_eff = np.where(has_comps, total ** 2 / np.maximum((weights ** 2).sum(axis=1), 1e-300), 0.0)
+        mean_dist = (weights * np.where(valid, dists, 0.0)).sum(axis=1) / safe_total
+        confidence = (n_eff / (n_eff + 2.0)) / (1.0 + mean_dist / VALUATION_CONF_DISTANCE) * np.exp(-spread)
+
+        # No priced comparables: the target's medium (else size bucket) median
+        fallback = np.where(np.isfinite(targets["medium"]), targets["medium"], targets["size_bucket"])
+        basis = np.where(has_comps, "comparables", np.where(np.isfinite(fallback), "segment", "none"))
+        mu = np.where(has_comps, mu, np.log(np.where(np.isfinite(fallback), fallback, np.nan)))
+        spread = np.where(has_comps, spread, FALLBACK_SPREAD)
+        confidence = np.where(has_comps, confidence, 0.0)
+
+        return pd.DataFrame({
+            "estimate": np.exp(mu),
+            "low": np.exp(mu - VALUATION_INTERVAL_Z * spread),
+            "high": np.exp(mu + VALUATION_INTERVAL_Z * spread),
+            "confidence": confidence,
+            "confidence_label": [confidence_label(c) for c in confidence],
+            "n_comparables": valid.sum(axis=1),
+            "n_effective": n_eff,
+            "basis": basis,
+            "medium_median": targets["medium"],
+            "size_bucket_median": targets["size_bucket"],
+        })
+
+    def estimate(self, embedding, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        row = self.estimate_batch([embedding], [metadata or {}]).iloc[0]
+        return {
+            "estimate": None if np.isnan(row["estimate"]) else float(row["estimate"]),
+            "low": None if np.isnan(row["low"]) else float(row["low"]),
+            "high": None if np.isnan(row["high"]) else float(row["high"]),
+            "confidence": float(row["confidence"]),
+            "confidence_label": row["confidence_label"],
+            "n_comparables": int(row["n_comparables"]),
+            "basis": row["basis"],
+        }
+
+
+def _float_column(table, name: str, n: int) -> np.ndarray:
+    col = table.columns.get(name)
+    if col is None:
+        return np.full(n, np.nan)
+    if col["kind"] == "float":
+        return np.asarray(col["values"], dtype=np.float64)
+    # Mixed or non-numeric column: decode through the dictionary
+    lookup = np.array([_to_float(v) for v in col["dictionary"]] + [np.nan])
+    return lookup[np.asarray(col["codes"])]
+
+
+def _median_column(table, field: str, medians: Dict[Any, float], n: int) -> np.ndarray:
+    col = table.columns.get(field)
+    if col is None or col["kind"] != "dict":
+        return np.full(n, np.nan)
+    # Code -1 (missing) indexes the trailing NaN
+    lookup = np.array([medians.get(v, np.nan) for v in col["dictionary"]] + [np.nan])
+    return lookup[np.asarray(col["codes"])]
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
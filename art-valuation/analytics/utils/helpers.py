@@ -0,0 +1,66 @@
+"""
+helpers.py — Shared utilities for the analytics pipeline
+"""
+
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process in MB"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def frame_memory_mb(df: pd.DataFrame) -> float:
+    """Deep memory usage of a DataFrame in MB"""
+    return float(df.memory_usage(deep=True).sum()) / 2**20
+
+
+@contextmanager
+def stage_memory(name: str, log=print):
+    """Log RSS growth, process peak RSS and wall time of one pipeline stage"""
+    before = rss_mb()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        after = rss_mb()
+        log(f"[stage] {name}: rss {after:,.0f}MB ({after - before:+,.0f}MB), "
+            f"peak {peak_rss_mb():,.0f}MB, {time.perf_counter() - start:.2f}s")
+
+
+class PhaseTimer:
+    """Wall time accumulated per named phase across many calls"""
+
+    def __init__(self):
+        self.totals = {}
+        self.calls = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[name] = self.totals.get(name, 0.0) + time.perf_counter() - start
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def report(self, log=print):
+        total = sum(self.totals.values()) or 1.0
+        for name, seconds in self.totals.items():
+            log(f"[phase] {name}: {seconds:.2f}s ({seconds / total:.0%}, {self.calls[name]} calls)")
@@ -25,4 +25,49 @@ class Config:
     COMPOSITION_OBJECTS: str = os.getenv('COMPOSITION_OBJECTS', 'tree,mountain,building,person,animal,flower,boat,bridge,house,rock,cloud,river,ocean,beach,forest,sky')
     LIGHTING_CONDITIONS: str = os.getenv('LIGHTING_CONDITIONS', 'bright sunlight,soft diffuse light,dramatic lighting,golden hour,sunset lighting,morning light,overcast')
     TEXTURE_DESCRIPTIONS: str = os.getenv('TEXTURE_DESCRIPTIONS', 'smooth brush strokes,rough brush strokes,thick impasto,fine detailed brushwork,loose brushwork,visible brush marks')
-    BACKGROUND_LABELS: str = os.getenv('BACKGROUND_LABELS', 'mountains,sky,forest,ocean,city,abstract background')
\ No newline at end of file
+    BACKGROUND_LABELS: str = os.getenv('BACKGROUND_LABELS', 'mountains,sky,forest,ocean,city,abstract background')
+    
+    # Memory-budgeted streaming mode (0 disables the budget)
+    MEMORY_BUDGET_MB: int = int(os.getenv('MEMORY_BUDGET_MB', '0'))
+    IMAGE_BYTES_ESTIMATE: int = int(os.getenv('IMAGE_BYTES_ESTIMATE', str(8 * 1024 * 1024)))
+    TRACE_MALLOC: bool = os.getenv('TRACE_MALLOC', 'false').lower() == 'true'
+    
+    # Failure tracking and retry scheduling
+    MAX_ATTEMPTS: int = int(os.getenv('MAX_ATTEMPTS', '5'))
+    RETRY_BASE_SECONDS: int = int(os.getenv('RETRY_BASE_SECONDS', '900'))
+    RETRY_MAX_SECONDS: int = int(os.getenv('RETRY_MAX_SECONDS', str(7 * 24 * 3600)))
+    DEAD_LETTER_COLLECTION: str = os.getenv('DEAD_LETTER_COLLECTION', 'artworks_dead_letter')
+    
+    # Hierarchical taxonomy tagging (empty path disables)
+    TAXONOMY_PATH: str = os.getenv('TAXONOMY_PATH', '')
+    TAXONOMY_CACHE_DIR: str = os.getenv('TAXONOMY_CACHE_DIR', '.cache/taxonomy')
+    TAXONOMY_TOP_K: int = int(os.getenv('TAXONOMY_TOP_K', '8'))
+    TAXONOMY_BEAM: int = int(os.getenv('TAXONOMY_BEAM', '6'))
+    TAXONOMY_CHUNK_SIZE: int = int(os.getenv('TAXONOMY_CHUNK_SIZE', '4096'))
+    TAXONOMY_TEMPLATE: str = os.getenv('TAXONOMY_TEMPLATE', 'an artwork of {name}')
+    
+    # Thumbnail-first partial fetching
+    PARTIAL_FETCH: bool = os.getenv('PARTIAL_FETCH', 'true').lower() == 'true'
+    TARGET_IMAGE_SIZE: int = int(os.getenv('TARGET_IMAGE_SIZE', '224'))
+    EXIF_PROBE_BYTES: int = int(os.getenv('EXIF_PROBE_BYTES', str(64 * 1024)))
+    PROGRESSIVE_MIN_SCANS: int = int(os.getenv('PROGRESSIVE_MIN_SCANS', '3'))
+    MAX_DOWNLOAD_BYTES: int = int(os.getenv('MAX_DOWNLOAD_BYTES', str(4 * 1024 * 1024)))
+    MAX_IMAGE_PIXELS: int = int(os.getenv('MAX_IMAGE_PIXELS', str(100_000_000)))
+    
+    # Adaptive batch-size / thread-split controller (opt-in: warm-up costs
+    # (warmup + trial) batches per candidate before the run settles)
+    AUTOTUNE: bool = os.getenv('AUTOTUNE', 'false').lower() == 'true'
+    AUTOTUNE_BATCH_SIZES: str = os.getenv('AUTOTUNE_BATCH_SIZES', '8,16,32,64')
+    AUTOTUNE_MAX_LATENCY: float = float(os.getenv('AUTOTUNE_MAX_LATENCY', '30'))
+    AUTOTUNE_PROBE_EVERY: int = int(os.getenv('AUTOTUNE_PROBE_EVERY', '10'))
+    AUTOTUNE_TRIAL_BATCHES: int = int(os.getenv('AUTOTUNE_TRIAL_BATCHES', '3'))
+    AUTOTUNE_WARMUP_BATCHES: int = int(os.getenv('AUTOTUNE_WARMUP_BATCHES', '1'))
+    
+    # Output sinks (comma-separated: mongo, parquet, arrow)
+    OUTPUT_SINKS: str = os.getenv('OUTPUT_SINKS', 'mongo')
+    SINK_OUTPUT_DIR: str = os.getenv('SINK_OUTPUT_DIR', 'output/metadata')
+    SINK_ROWS_PER_FILE: int = int(os.getenv('SINK_ROWS_PER_FILE', '50000'))
+    SINK_PASSTHROUGH_FIELDS: str = os.getenv('SINK_PASSTHROUGH_FIELDS', 'artist,medium,dim1,dim2,value,sale_date,auction_house,gallery,year_created,sold')
+    
+    # Embedding model benchmark results (feeds ModelSpec.expected_images_per_sec)
+    MODEL_BENCHMARK_PATH: str = os.getenv('MODEL_BENCHMARK_PATH', 'config/model_benchmarks.json')
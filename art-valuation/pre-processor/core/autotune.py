@@ -0,0 +1,214 @@
+import logging
+import os
+from dataclasses import dataclass
+from typing import List, Optional
+from config.settings import Config
+
+@dataclass(frozen=True)
+class TuningConfig:
+    """One point in the search space: batch size and CPU thread split"""
+    batch_size: int
+    torch_threads: int
+    workers: int
+
+    def __str__(self) -> str:
+        return f"batch_size={self.batch_size}, torch_threads={self.torch_threads}, workers={self.workers}"
+
+@dataclass
+class TrialResult:
+    """Measured performance of a configuration"""
+    config: TuningConfig
+    throughput: float
+    latency: float
+
+class AdaptiveBatchController:
+    """
+    Auto-tunes batch size and the torch/worker thread split while a run is in progress
+
+    Warm-up is a coordinate search: every candidate batch size is timed with
+    an even thread split, then every thread split is timed at the best batch
+    size. Afterwards the controller keeps an EWMA of throughput and, every
+    `probe_every` batches, tries a neighbouring batch size, switching when it
+    is clearly faster. Configurations whose batch latency exceeds
+    `max_latency` are never selected.
+
+    Each candidate (and each probe) is measured over `trial_batches` batches
+    after `warmup_batches` untimed ones, so model loading, allocator and
+    thread-pool start-up do not decide the result.
+    """
+
+    SWITCH_MARGIN = 0.05
+    EWMA_ALPHA = 0.3
+
+    def __init__(self, batch_sizes: Optional[List[int]] = None, cpu_count: Optional[int] = None,
+                 max_latency: Optional[float] = None, probe_every: Optional[int] = None,
+                 trial_batches: Optional[int] = None, warmup_batches: Optional[int] = None,
+                 logger: Optional[logging.Logger] = None):
+        """
+        Args:
+            batch_sizes: Candidate batch sizes (defaults to AUTOTUNE_BATCH_SIZES)
+            cpu_count: Cores available to this process
+            max_latency: Maximum acceptable seconds per batch
+            probe_every: Batches between steady-state probes
+            trial_batches: Timed batches per candidate configuration
+            warmup_batches: Untimed batches run first with each candidate
+            logger: Logger receiving every tuning decision
+        """
+        self.batch_sizes = sorted(batch_sizes or [int(b) for b in Config.AUTOTUNE_BATCH_SIZES.split(',')])
+        self.cpu_count = cpu_count or os.cpu_count() or 1
+        self.max_latency = max_latency or Config.AUTOTUNE_MAX_LATENCY
+        self.probe_every = probe_every or Config.AUTOTUNE_PROBE_EVERY
+        self.trial_batches = max(1, trial_batches or Config.AUTOTUNE_TRIAL_BATCHES)
+        self.warmup_batches = Config.AUTOTUNE_WARMUP_BATCHES if warmup_batches is None else warmup_batches
+        self.logger = logger or logging.getLogger(__name__)
+        self._reset_trial()
+
+        self.thread_splits = sorted({
+            max(1, self.cpu_count // 4), max(1, self.cpu_count // 2),
+            max(1, 3 * self.cpu_count // 4), self.cpu_count
+        })
+        default_threads = max(1, self.cpu_count // 2)
+
+        self.phase = 'warmup_batch'
+        self._pending = [self._make_config(b, default_threads) for b in self.batch_sizes]
+        self._trials: List[TrialResult] = []
+        self.best: Optional[TuningConfig] = None
+        self.best_throughput = 0.0
+        self._batches_since_probe = 0
+        self._probe_up = True
+        self.current = self._pending.pop(0)
+        self.logger.info(f"Autotune warm-up: trying {len(self.batch_sizes)} batch sizes, starting with {self.current}")
+
+    def _make_config(self, batch_size: int, torch_threads: int) -> TuningConfig:
+        workers = min(Config.MAX_WORKERS, max(2, self.cpu_count - torch_threads))
+        return TuningConfig(batch_size, torch_threads, workers)
+
+    def _reset_trial(self):
+        self._trial_skipped = 0
+        self._trial_batches = 0
+        self._trial_images = 0
+        self._trial_elapsed = 0.0
+
+    def _measure(self, n_images: int, elapsed: float) -> Optional[TrialResult]:
+        """
+        Accumulate one batch of the current candidate
+
+        Returns:
+            The candidate's result once its timed batches are complete, else None
+        """
+        if self._trial_skipped < self.warmup_batches:
+            self._trial_skipped += 1
+            return None
+        self._trial_batches += 1
+        self._trial_images += n_images
+        self._trial_elapsed += elapsed
+        if self._trial_batches < self.trial_batches:
+            return None
+        result = TrialResult(self.current, self._trial_images / self._trial_elapsed,
+                             self._trial_elapsed / self._trial_batches)
+        self._reset_trial()
+        return result
+
+    def _pick_best(self, trials: List[TrialResult]) -> TrialResult:
+        """Highest throughput among trials within the latency bound (or lowest latency if none are)"""
+        within = [t for t in trials if t.latency <= self.max_latency]
+        if within:
+            return max(within, key=lambda t: t.throughput)
+        return min(trials, key=lambda t: t.latency)
+
+    @property
+    def batch_size(self) -> int:
+        return self.current.batch_size
+
+    def observe(self, n_images: int, elapsed: float, inference_seconds: Optional[float] = None):
+        """
+        Record the outcome of the batch that ran with `current` and choose the next config
+
+        Args:
+            n_images: Images in the batch
+            elapsed: Wall-clock seconds for the whole batch
+            inference_seconds: Seconds spent in model inference (for logging)
+        """
+        if n_images <= 0 or elapsed <= 0:
+            return
+        if self.phase == 'steady' and self.current == self.best:
+            self._observe_steady(n_images / elapsed, elapsed)
+            return
+
+        result = self._measure(n_images, elapsed)
+        if result is None:
+            return
+        detail = f"{result.throughput:.1f} img/s, {result.latency:.2f}s/batch over {self.trial_batches} batches"
+        if inference_seconds is not None:
+            detail += f", last inference {inference_seconds:.2f}s"
+
+        if self.phase in ('warmup_batch', 'warmup_threads'):
+            self.logger.info(f"Autotune trial {self.current}: {detail}")
+            self._trials.append(result)
+            if self._pending:
+                self.current = self._pending.pop(0)
+                return
+            self._finish_warmup_phase()
+        else:
+            self._observe_probe(result, detail)
+
+    def _finish_warmup_phase(self):
+        best = self._pick_best(self._trials)
+        if self.phase == 'warmup_batch':
+            self.logger.info(f"Autotune picked batch_size={best.config.batch_size}; trying thread splits")
+            self.phase = 'warmup_threads'
+            self._pending = [
+                self._make_config(best.config.batch_size, t)
+                for t in self.thread_splits if t != best.config.torch_threads
+            ]
+            self._trials = [best]
+            if self._pending:
+                self.current = self._pending.pop(0)
+                return
+            best = self._pick_best(self._trials)
+
+        self.phase = 'steady'
+        self.best, self.best_throughput = best.config, best.throughput
+        self.current = self.best
+        self._trials = []
+        self.logger.info(f"Autotune warm-up complete: {self.best} ({best.throughput:.1f} img/s)")
+
+    def _observe_steady(self, throughput: float, elapsed: float):
+        self.best_throughput = (1 - self.EWMA_ALPHA) * self.best_throughput + self.EWMA_ALPHA * throughput
+
+        if elapsed > self.max_latency:
+            smaller = [b for b in self.batch_sizes if b < self.best.batch_size]
+            if smaller:
+                self.best = self._make_config(smaller[-1], self.best.torch_threads)
+                self.current = self.best
+                self.logger.info(f"Autotune: batch latency {elapsed:.2f}s over limit, shrinking to {self.best}")
+                return
+
+        self._batches_since_probe += 1
+        if self._batches_since_probe < self.probe_every:
+            return
+        self._batches_since_probe = 0
+
+        probe = self._neighbour()
+        if probe is not None:
+            self.current = probe
+            self.logger.info(f"Autotune probe: {probe} (current {self.best} at {self.best_throughput:.1f} img/s)")
+
+    def _observe_probe(self, result: TrialResult, detail: str):
+        if (result.latency <= self.max_latency
+                and result.throughput > self.best_throughput * (1 + self.SWITCH_MARGIN)):
+            self.logger.info(f"Autotune switching to {result.config}: {detail} vs {self.best_throughput:.1f} img/s")
+            self.best, self.best_throughput = result.config, result.throughput
+        else:
+            self.logger.info(f"Autotune keeping {self.best}: probe {result.config} gave {detail}")
+        self.current = self.best
+
+    def _neighbour(self) -> Optional[TuningConfig]:
+        """Next larger or smaller candidate batch size, alternating direction"""
+        i = self.batch_sizes.index(self.best.batch_size) if self.best.batch_size in self.batch_sizes else 0
+        order = [i + 1, i - 1] if self._probe_up else [i - 1, i + 1]
+        self._probe_up = not self._probe_up
+        for j in order:
+            if 0 <= j < len(self.batch_sizes):
+                return self._make_config(self.batch_sizes[j], self.best.torch_threads)
+        return None
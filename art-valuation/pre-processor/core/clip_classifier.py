@@ -1,25 +1,30 @@
 import torch
-import clip
 from PIL import Image
 from typing import List, Dict
 import numpy as np
 from config.settings import Config
+from core.model_registry import load_model
 
 class CLIPClassifier:
     """Optimized CLIP classification with caching"""
     
-    def __init__(self):
+    def __init__(self, model_name: str = None):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model, self.preprocess = None, None
+        self.model_name = model_name or Config.CLIP_MODEL
+        self.model, self.preprocess, self.tokenize = None, None, None
+        self.spec = None
         self.text_embeddings = {}
+        self.text_embeddings_np = {}
+        self.labels = {}
         self._load_model()
         self._precompute_text_embeddings()
     
     def _load_model(self):
         """Load CLIP model and set to evaluation mode"""
-        print(f"Loading CLIP model on {self.device}")
-        self.model, self.preprocess = clip.load(Config.CLIP_MODEL, device=self.device)
-        self.model.eval()  # Set to eval mode for inference
+        print(f"Loading {self.model_name} on {self.device}")
+        loaded = load_model(self.model_name, self.device)  # Already in eval mode
+        self.model, self.preprocess, self.tokenize = loaded.model, loaded.preprocess, loaded.tokenize
+        self.spec = loaded.spec
     
     def _get_style_labels(self) -> List[str]:
         """Get style labels from configuration"""
@@ -57,11 +62,43 @@ class CLIPClassifier:
         }
         
         for category, labels in all_labels.items():
-            text_inputs = clip.tokenize(labels).to(self.device)
+            text_inputs = self.tokenize(labels).to(self.device)
             with torch.no_grad():
                 text_features = self.model.encode_text(text_inputs)
                 text_features /= text_features.norm(dim=-1, keepdim=True)
                 self.text_embeddings[category] = text_features
+            self.text_embeddings_np[category] = text_features.float().cpu().numpy()
+            self.labels[category] = labels
+    
+    def set_threads(self, n_threads: int):
+        """
+        Set the number of intra-op threads used by torch on CPU
+        
+        Args:
+            n_threads: Number of threads
+        """
+        if torch.get_num_threads() != n_threads:
+            torch.set_num_threads(n_threads)
+    
+    @torch.no_grad()
+    def encode_texts(self, texts: List[str], batch_size: int = 256) -> np.ndarray:
+        """
+        Encode a large list of prompts in batches
+        
+        Args:
+            texts: Prompts to encode
+            batch_size: Number of prompts per forward pass
+            
+        Returns:
+            L2-normalized float32 array of shape (len(texts), dim)
+        """
+        chunks = []
+        for start in range(0, len(texts), batch_size):
+            tokens = self.tokenize(texts[start:start + batch_size]).to(self.device)
+            features = self.model.encode_text(tokens).float()
+            features /= features.norm(dim=-1, keepdim=True)
+            chunks.append(features.cpu().numpy())
+        return np.concatenate(chunks).astype(np.float32, copy=False)
     
     @torch.no_grad()
     def get_image_embedding(self, image: Image.Image) -> List[float]:
@@ -110,8 +147,7 @@ class CLIPClassifier:
         top_probs, top_indices = similarities[0].topk(top_k)
         
         # Get the appropriate labels list based on category
-        labels_method = getattr(self, f"_get_{category}_labels")
-        labels_list = labels_method()
+        labels_list = self.labels[category]
         
         result = []
         
@@ -119,4 +155,47 @@ class CLIPClassifier:
             if prob > Config.CONFIDENCE_THRESHOLD:
                 result.append(labels_list[i])
         
-        return result[:top_k] if result else [labels_list[top_indices[0]]]
\ No newline at end of file
+        return result[:top_k] if result else [labels_list[top_indices[0]]]
+    
+    @torch.no_grad()
+    def encode_images(self, images: List[Image.Image]) -> np.ndarray:
+        """
+        Encode a batch of images in a single forward pass
+        
+        Args:
+            images: PIL Images (already resized for CLIP)
+            
+        Returns:
+            L2-normalized float32 array of shape (len(images), dim)
+        """
+        image_input = torch.stack([self.preprocess(image) for image in images]).to(self.device)
+        image_features = self.model.encode_image(image_input).float()
+        image_features /= image_features.norm(dim=-1, keepdim=True)
+        return image_features.cpu().numpy()
+    
+    def classify_features(self, image_features: np.ndarray, category: str, top_k: int = 3) -> List[List[str]]:
+        """
+        Batch classification from precomputed image features
+        
+        Same decision rule as classify_fast, applied to every row at once.
+        
+        Args:
+            image_features: Normalized image features of shape (batch, dim)
+            category: Category to classify (style, subject, etc.)
+            top_k: Number of top results to return
+            
+        Returns:
+            One list of classification labels per image
+        """
+        logits = 100.0 * image_features @ self.text_embeddings_np[category].T
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=1, keepdims=True)
+        
+        labels_list = self.labels[category]
+        top_indices = np.argsort(-probs, axis=1)[:, :top_k]
+        results = []
+        for row_probs, row_indices in zip(probs, top_indices):
+            result = [labels_list[i] for i in row_indices if row_probs[i] > Config.CONFIDENCE_THRESHOLD]
+            results.append(result if result else [labels_list[row_indices[0]]])
+        return results
\ No newline at end of file
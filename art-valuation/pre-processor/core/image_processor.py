@@ -1,12 +1,18 @@
+import hashlib
+import threading
+from collections import OrderedDict
 import numpy as np
 from PIL import Image
 from sklearn.cluster import KMeans
-from functools import lru_cache
 from config.settings import Config
 
 class ImageProcessor:
     """Optimized image processing utilities"""
     
+    # Results-only colour cache keyed by pixel hash (never pins pixel buffers)
+    _color_cache: "OrderedDict[str, tuple]" = OrderedDict()
+    _color_cache_lock = threading.Lock()
+    
     # Precomputed CSS color mapping for speed
     CSS_COLORS = {
         (0, 0, 0): 'black', (255, 255, 255): 'white', (255, 0, 0): 'red',
@@ -16,19 +22,40 @@ class ImageProcessor:
     }
     
     @staticmethod
-    @lru_cache(maxsize=Config.IMAGE_CACHE_SIZE)
-    def get_dominant_colors_fast(img_hash: int, img_array_bytes: bytes) -> tuple:
+    def hash_pixels(img_array: np.ndarray) -> str:
+        """
+        Hash a pixel array without copying it
+        
+        Args:
+            img_array: Image pixels as a uint8 array
+            
+        Returns:
+            Hex digest identifying the pixels
+        """
+        return hashlib.blake2b(np.ascontiguousarray(img_array).data, digest_size=16).hexdigest()
+    
+    @staticmethod
+    def get_dominant_colors_fast(img_hash: str, img_array: np.ndarray) -> tuple:
         """
         Fast dominant color extraction with caching
         
+        Only the resulting colour names are cached, so the pixel buffer can be
+        freed as soon as the caller drops it.
+        
         Args:
             img_hash: Hash of the image for caching
-            img_array_bytes: Image array as bytes
+            img_array: Image pixels as a uint8 array
             
         Returns:
             Tuple of dominant color names
         """
-        img_array = np.frombuffer(img_array_bytes, dtype=np.uint8).reshape(-1, 3)
+        cache = ImageProcessor._color_cache
+        with ImageProcessor._color_cache_lock:
+            if img_hash in cache:
+                cache.move_to_end(img_hash)
+                return cache[img_hash]
+        
+        img_array = img_array.reshape(-1, 3)
         
         # Downsample for speed
         if len(img_array) > 10000:
@@ -55,7 +82,12 @@ class ImageProcessor:
             
             color_names.append(closest_color)
         
-        return tuple(set(color_names))
+        result = tuple(set(color_names))
+        with ImageProcessor._color_cache_lock:
+            cache[img_hash] = result
+            while len(cache) > Config.IMAGE_CACHE_SIZE:
+                cache.popitem(last=False)
+        return result
     
     @staticmethod
     def resize_image_for_clip(image: Image.Image, max_size: int = 224) -> Image.Image:
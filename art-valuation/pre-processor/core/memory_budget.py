@@ -0,0 +1,129 @@
+import queue
+import threading
+from typing import Any, Optional, Tuple
+
+class MemoryBudget:
+    """Byte-accounted admission control shared by all pipeline stages"""
+
+    def __init__(self, limit_bytes: int):
+        self.limit_bytes = limit_bytes
+        self.in_use = 0
+        self.peak = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes: int, timeout: Optional[float] = None) -> bool:
+        """
+        Reserve bytes, blocking while the budget is exhausted
+
+        A reservation larger than the whole budget is admitted once nothing
+        else is in flight, so a single oversized item cannot deadlock the run.
+
+        Args:
+            nbytes: Number of bytes to reserve
+            timeout: Maximum seconds to wait (None waits forever)
+
+        Returns:
+            True if the bytes were reserved, False on timeout
+        """
+        with self._cond:
+            self.waiting += 1
+            try:
+                admitted = self._cond.wait_for(
+                    lambda: self.in_use == 0 or self.in_use + nbytes <= self.limit_bytes,
+                    timeout=timeout
+                )
+            finally:
+                self.waiting -= 1
+            if not admitted:
+                return False
+            self._add(nbytes)
+            return True
+
+    def adjust(self, delta: int):
+        """
+        Correct a reservation once the real size is known (never blocks)
+
+        Args:
+            delta: Bytes to add (positive) or give back (negative)
+        """
+        with self._cond:
+            self._add(delta)
+            if delta < 0:
+                self._cond.notify_all()
+
+    def release(self, nbytes: int):
+        """
+        Return previously reserved bytes to the budget
+
+        Args:
+            nbytes: Number of bytes to release
+        """
+        self.adjust(-nbytes)
+
+    def _add(self, delta: int):
+        self.in_use = max(0, self.in_use + delta)
+        self.peak = max(self.peak, self.in_use)
+
+class ByteBudgetQueue:
+    """FIFO queue whose items are charged against a MemoryBudget until consumed"""
+
+    def __init__(self, budget: MemoryBudget):
+        self.budget = budget
+        self._queue = queue.Queue()
+
+    def put(self, item: Any, nbytes: int, reserved: bool = False):
+        """
+        Enqueue an item, waiting for budget if necessary
+
+        Args:
+            item: Item to enqueue
+            nbytes: Accounted size of the item
+            reserved: True if the caller already holds a reservation for nbytes
+        """
+        if not reserved:
+            self.budget.acquire(nbytes)
+        self._queue.put((item, nbytes))
+
+    def get(self, timeout: Optional[float] = None) -> Tuple[Any, int]:
+        """
+        Dequeue an item; the caller must release its bytes once it is dropped
+
+        Returns:
+            Tuple of (item, accounted bytes)
+        """
+        return self._queue.get(timeout=timeout)
+
+    def close(self):
+        """Signal consumers that no more items will arrive"""
+        self._queue.put((None, 0))
+
+def estimate_image_bytes(image) -> int:
+    """
+    Decoded size of a PIL image in bytes
+
+    Args:
+        image: PIL Image
+
+    Returns:
+        Approximate bytes held by the decoded pixel buffer
+    """
+    width, height = image.size
+    return width * height * len(image.getbands())
+
+def estimate_result_bytes(result: dict) -> int:
+    """
+    Rough in-memory size of a processed result waiting to be written
+
+    Embedding lists dominate: every Python float costs a 24-byte object plus
+    an 8-byte list slot.
+
+    Args:
+        result: Processed result with metadata
+
+    Returns:
+        Approximate bytes held by the result
+    """
+    metadata = result.get("metadata") or {}
+    embedding = metadata.get("image_embedding") or []
+    return 2048 + 32 * len(embedding)
@@ -0,0 +1,121 @@
+import json
+import os
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, List, Optional
+from config.settings import Config
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """Registered image/text embedding model"""
+    name: str
+    backend: str                    # 'clip' (openai/CLIP) or 'open_clip'
+    embedding_dim: int
+    input_resolution: int
+    preprocess: str                 # Image transform applied before encoding
+    pretrained: Optional[str] = None
+    expected_images_per_sec: Optional[float] = None
+    notes: str = ''
+
+@dataclass
+class LoadedModel:
+    """A loaded model with its preprocess transform and tokenizer"""
+    spec: ModelSpec
+    model: object
+    preprocess: Callable
+    tokenize: Callable
+
+_CLIP_PREPROCESS = "resize short side to {res} (bicubic), center crop {res}, CLIP mean/std normalize"
+
+MODEL_REGISTRY: Dict[str, ModelSpec] = {}
+
+def register_model(spec: ModelSpec):
+    """
+    Add (or replace) a model in the registry
+
+    Args:
+        spec: Model specification
+    """
+    MODEL_REGISTRY[spec.name] = spec
+
+for _name, _dim, _res, _notes in [
+    ('RN50', 1024, 224, 'ResNet-50 with attention pooling'),
+    ('RN101', 512, 224, 'ResNet-101 with attention pooling'),
+    ('ViT-B/32', 512, 224, 'Current default; 7x7 patch grid'),
+    ('ViT-B/16', 512, 224, '14x14 patch grid, ~4x the image FLOPs of ViT-B/32'),
+    ('ViT-L/14', 768, 224, 'Largest practical CPU model; used as the quality reference'),
+]:
+    register_model(ModelSpec(_name, 'clip', _dim, _res, _CLIP_PREPROCESS.format(res=_res), notes=_notes))
+
+register_model(ModelSpec(
+    'TinyCLIP-ViT-39M-16-Text-19M', 'open_clip', 512, 224, _CLIP_PREPROCESS.format(res=224),
+    pretrained='YFCC15M', notes='Distilled from ViT-B/16 (requires open_clip_torch)'
+))
+register_model(ModelSpec(
+    'MobileCLIP-S1', 'open_clip', 512, 256, "resize to 256 (bilinear), center crop 256, no normalization",
+    pretrained='datacompdr', notes='Mobile-oriented distilled model (requires open_clip_torch)'
+))
+
+def _load_benchmarks():
+    """Fill expected_images_per_sec from the last benchmark run, if one was saved"""
+    if not os.path.exists(Config.MODEL_BENCHMARK_PATH):
+        return
+    try:
+        with open(Config.MODEL_BENCHMARK_PATH, encoding='utf-8') as f:
+            results = json.load(f).get('results', [])
+    except (OSError, ValueError):
+        return
+    for row in results:
+        spec = MODEL_REGISTRY.get(row.get('model'))
+        if spec and row.get('images_per_sec'):
+            MODEL_REGISTRY[spec.name] = replace(spec, expected_images_per_sec=row['images_per_sec'])
+
+_load_benchmarks()
+
+def get_model_spec(name: str) -> ModelSpec:
+    """
+    Look up a registered model
+
+    Args:
+        name: Registered model name
+
+    Returns:
+        ModelSpec
+    """
+    if name not in MODEL_REGISTRY:
+        raise KeyError(f"Unknown model '{name}'. Registered: {', '.join(MODEL_REGISTRY)}")
+    return MODEL_REGISTRY[name]
+
+def list_models() -> List[ModelSpec]:
+    """All registered models"""
+    return list(MODEL_REGISTRY.values())
+
+def load_model(name: str, device: str) -> LoadedModel:
+    """
+    Load a registered model in eval mode
+
+    Args:
+        name: Registered model name
+        device: torch device string
+
+    Returns:
+        LoadedModel with model, preprocess transform and tokenizer
+    """
+    spec = get_model_spec(name)
+    if spec.backend == 'clip':
+        import clip
+        model, preprocess = clip.load(spec.name, device=device)
+        tokenize = lambda texts: clip.tokenize(texts, truncate=True)
+    elif spec.backend == 'open_clip':
+        try:
+            import open_clip
+        except ImportError as e:
+            raise ImportError(f"{spec.name} requires open_clip_torch (pip install open_clip_torch)") from e
+        model, _, preprocess = open_clip.create_model_and_transforms(
+            spec.name, pretrained=spec.pretrained, device=device
+        )
+        tokenize = open_clip.get_tokenizer(spec.name)
+    else:
+        raise ValueError(f"Unknown backend '{spec.backend}' for {spec.name}")
+
+    model.eval()
+    return LoadedModel(spec, model, preprocess, tokenize)
@@ -0,0 +1,316 @@
+import threading
+from io import BytesIO
+from typing import Dict, Iterator, Optional, Tuple
+from urllib.parse import urlparse
+import requests
+from PIL import Image
+from config.settings import Config
+
+# JPEG markers
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_PROGRESSIVE_SOF = {0xC2, 0xC6, 0xCA, 0xCE}
+_STANDALONE = {0x01, 0xD8} | set(range(0xD0, 0xD8))
+_APP1, _SOS, _EOI = 0xE1, 0xDA, 0xD9
+
+class JpegScanner:
+    """Incremental JPEG marker scanner for a growing download buffer"""
+
+    def __init__(self):
+        self.valid: Optional[bool] = None
+        self.progressive = False
+        self.width: Optional[int] = None
+        self.height: Optional[int] = None
+        self.exif: Optional[Tuple[int, int]] = None
+        self.sos_offsets = []
+        self.eoi: Optional[int] = None
+        self._pos = 2
+        self._in_scan = False
+
+    def advance(self, buf: bytearray):
+        """
+        Parse as far as the buffer allows, resuming where the last call stopped
+
+        Args:
+            buf: Bytes received so far (must only ever grow)
+        """
+        n = len(buf)
+        if self.valid is None:
+            if n < 2:
+                return
+            self.valid = buf[0] == 0xFF and buf[1] == 0xD8
+        if not self.valid or self.eoi is not None:
+            return
+
+        while True:
+            if self._in_scan:
+                # Skip entropy-coded data up to the next real marker
+                p = buf.find(b'\xff', self._pos)
+                if p < 0:
+                    self._pos = n
+                    return
+                if p + 1 >= n:
+                    self._pos = p
+                    return
+                nxt = buf[p + 1]
+                if nxt == 0x00 or 0xD0 <= nxt <= 0xD7:
+                    self._pos = p + 2
+                elif nxt == 0xFF:
+                    self._pos = p + 1
+                else:
+                    self._in_scan = False
+                    self._pos = p
+                continue
+
+            pos = self._pos
+            if pos + 1 >= n:
+                return
+            if buf[pos] != 0xFF:
+                self.valid = False
+                return
+            marker = buf[pos + 1]
+            if marker == 0xFF:
+                self._pos += 1
+                continue
+            if marker in _STANDALONE:
+                self._pos += 2
+                continue
+            if marker == _EOI:
+                self.eoi = pos
+                return
+            if pos + 4 > n:
+                return
+
+            seg_end = pos + 2 + ((buf[pos + 2] << 8) | buf[pos + 3])
+            if marker in (_SOS, _APP1) or marker in _SOF_MARKERS:
+                if seg_end > n:
+                    return
+                if marker in _SOF_MARKERS:
+                    self.height = (buf[pos + 5] << 8) | buf[pos + 6]
+                    self.width = (buf[pos + 7] << 8) | buf[pos + 8]
+                    self.progressive = marker in _PROGRESSIVE_SOF
+                elif marker == _APP1:
+                    if self.exif is None and buf[pos + 4:pos + 10] == b'Exif\x00\x00':
+                        self.exif = (pos + 10, seg_end)
+                else:
+                    self.sos_offsets.append(pos)
+                    self._in_scan = True
+            self._pos = seg_end
+
+class FetchStats:
+    """Thread-safe per-host accounting of fetch strategies and bytes saved"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, Dict[str, int]] = {}
+
+    def record(self, host: str, strategy: str, fetched: int, total: Optional[int]):
+        """
+        Record one fetch
+
+        Args:
+            host: Source host
+            strategy: 'exif', 'progressive', 'stream' or 'full'
+            fetched: Bytes actually read
+            total: Full size of the source file if known
+        """
+        with self._lock:
+            stats = self._hosts.setdefault(host, {
+                "images": 0, "bytes_fetched": 0, "bytes_total": 0, "bytes_saved": 0,
+                "exif": 0, "progressive": 0, "stream": 0, "full": 0
+            })
+            stats["images"] += 1
+            stats[strategy] += 1
+            stats["bytes_fetched"] += fetched
+            if total:
+                stats["bytes_total"] += total
+                stats["bytes_saved"] += max(total - fetched, 0)
+
+    def report(self) -> Dict[str, Dict[str, int]]:
+        """
+        Snapshot of the per-host statistics
+
+        Returns:
+            Dict of host -> counters
+        """
+        with self._lock:
+            return {host: dict(stats) for host, stats in self._hosts.items()}
+
+def _total_size(response: requests.Response) -> Optional[int]:
+    """Full file size from Content-Range (206) or Content-Length (200)"""
+    content_range = response.headers.get('Content-Range', '')
+    if '/' in content_range:
+        total = content_range.rsplit('/', 1)[1]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get('Content-Length')
+    return int(length) if length and length.isdigit() and response.status_code == 200 else None
+
+class PartialImageFetcher:
+    """
+    Thumbnail-first image fetcher for large source files
+
+    A single capped Range request is streamed and abandoned as early as
+    possible: an embedded EXIF thumbnail that is large enough wins outright,
+    progressive JPEGs stop once enough scans have arrived, and everything
+    else is read up to MAX_DOWNLOAD_BYTES. Oversized or undecodable
+    partials fall back to completing the full download; a server that ignores
+    Range has its single response read to the end instead.
+    """
+
+    def __init__(self, session: Optional[requests.Session] = None, target_size: Optional[int] = None):
+        self.session = session or requests.Session()
+        self.target_size = target_size or Config.TARGET_IMAGE_SIZE
+        self.stats = FetchStats()
+
+    def fetch(self, url: str) -> Image.Image:
+        """
+        Fetch an image at (at least) the target resolution
+
+        Args:
+            url: Image URL
+
+        Returns:
+            PIL Image in RGB
+        """
+        host = urlparse(url).netloc or 'unknown'
+        buf, total, ranged = bytearray(), None, False
+        try:
+            image, strategy, buf, total, ranged = self._fetch_partial(url)
+        except (requests.exceptions.HTTPError, Image.DecompressionBombError):
+            raise
+        except Exception as e:
+            print(f"Partial fetch failed for {url}, falling back to full download: {e}")
+            image, strategy = None, 'full'
+
+        if image is None:
+            image, buf, total = self._fetch_full(url, buf if ranged else bytearray())
+            strategy = 'full'
+
+        self.stats.record(host, strategy, len(buf), total)
+        return image
+
+    def _fetch_partial(self, url: str):
+        """
+        Stream a capped Range request, stopping as soon as an image is decodable
+
+        Returns:
+            Tuple of (image or None, strategy, bytes read, total size, whether Range was honoured)
+        """
+        cap = Config.MAX_DOWNLOAD_BYTES
+        headers = {"Range": f"bytes=0-{cap - 1}"}
+        buf = bytearray()
+        scanner = JpegScanner()
+        exif_checked = False
+
+        with self.session.get(url, headers=headers, stream=True, timeout=Config.REQUEST_TIMEOUT) as response:
+            response.raise_for_status()
+            ranged = response.status_code == 206
+            total = _total_size(response)
+
+            chunks = response.iter_content(chunk_size=16 * 1024)
+            for chunk in chunks:
+                buf += chunk
+                if len(buf) > cap:
+                    # Range not honoured and the body is larger than the cap: the
+                    # whole file is coming anyway, so finish this stream
+                    return self._read_rest(chunks, buf, scanner), 'full', buf, total or len(buf), False
+                scanner.advance(buf)
+                if not scanner.valid:
+                    continue
+
+                if scanner.width and scanner.height:
+                    self._check_pixels(scanner.width, scanner.height)
+
+                if not exif_checked and (scanner.sos_offsets or len(buf) >= Config.EXIF_PROBE_BYTES):
+                    exif_checked = True
+                    thumbnail = self._exif_thumbnail(buf, scanner)
+                    if thumbnail is not None:
+                        return thumbnail, 'exif', buf, total, ranged
+
+                if scanner.progressive:
+                    needed = self._scans_needed(scanner)
+                    if len(scanner.sos_offsets) > needed:
+                        # Cut before the next scan and terminate the stream with EOI
+                        cut = scanner.sos_offsets[needed]
+                        image = self._decode(bytes(buf[:cut]) + b'\xff\xd9')
+                        return image, 'progressive', buf, total, ranged
+
+        if total and len(buf) < total:
+            # Capped before the end of a non-progressive file
+            return None, 'full', buf, total, ranged
+        return self._decode(bytes(buf)), 'stream', buf, total or len(buf), ranged
+
+    def _read_rest(self, chunks: Iterator[bytes], buf: bytearray, scanner: JpegScanner) -> Image.Image:
+        """
+        Read the remaining chunks of an un-ranged response into `buf` and decode it
+
+        The pixel limit is still enforced as soon as the frame header is seen.
+
+        Returns:
+            Decoded image
+        """
+        for chunk in chunks:
+            buf += chunk
+            if scanner.valid is not False and not (scanner.width and scanner.height):
+                scanner.advance(buf)
+                if scanner.width and scanner.height:
+                    self._check_pixels(scanner.width, scanner.height)
+        return self._decode(bytes(buf))
+
+    def _fetch_full(self, url: str, prefix: bytearray):
+        """
+        Complete the download, resuming after `prefix` when the server supports ranges
+
+        Returns:
+            Tuple of (image, bytes read, total size)
+        """
+        headers = {"Range": f"bytes={len(prefix)}-"} if prefix else {}
+        response = self.session.get(url, headers=headers, timeout=Config.REQUEST_TIMEOUT)
+        response.raise_for_status()
+        if prefix and response.status_code == 206:
+            data = prefix + response.content
+        else:
+            data = bytearray(response.content)
+        return self._decode(bytes(data)), data, len(data)
+
+    def _scans_needed(self, scanner: JpegScanner) -> int:
+        """
+        Number of complete progressive scans required for the target size
+
+        The first (DC) scan alone already holds an exact 1/8-scale image, which
+        is enough whenever the short side is at least 8x the target.
+        """
+        if min(scanner.width or 0, scanner.height or 0) >= 8 * self.target_size:
+            return min(2, Config.PROGRESSIVE_MIN_SCANS)
+        return Config.PROGRESSIVE_MIN_SCANS
+
+    def _exif_thumbnail(self, buf: bytearray, scanner: JpegScanner) -> Optional[Image.Image]:
+        """Decode the embedded EXIF thumbnail if it is at least the target size"""
+        if scanner.exif is None:
+            return None
+        start, end = scanner.exif
+        payload = bytes(buf[start:end])
+        soi = payload.find(b'\xff\xd8\xff', 8)
+        eoi = payload.rfind(b'\xff\xd9')
+        if soi < 0 or eoi <= soi:
+            return None
+        try:
+            thumbnail = Image.open(BytesIO(payload[soi:eoi + 2]))
+            if min(thumbnail.size) < self.target_size:
+                return None
+            return thumbnail.convert('RGB')
+        except Exception:
+            return None
+
+    def _check_pixels(self, width: int, height: int):
+        """Reject decompression bombs before any pixels are decoded"""
+        if width * height > Config.MAX_IMAGE_PIXELS:
+            raise Image.DecompressionBombError(
+                f"Image size ({width}x{height}) exceeds limit of {Config.MAX_IMAGE_PIXELS} pixels"
+            )
+
+    def _decode(self, data: bytes) -> Image.Image:
+        """Decode at reduced DCT scale where possible (JPEG draft mode)"""
+        image = Image.open(BytesIO(data))
+        self._check_pixels(*image.size)
+        image.draft('RGB', (self.target_size, self.target_size))
+        return image.convert('RGB')
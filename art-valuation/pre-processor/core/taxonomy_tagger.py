@@ -0,0 +1,286 @@
+import hashlib
+import json
+import os
+from collections import deque
+from typing import List, Dict, Optional, Tuple
+import numpy as np
+from config.settings import Config
+
+class Taxonomy:
+    """Hierarchical tag taxonomy flattened in breadth-first order"""
+
+    def __init__(self, tree: Dict, default_template: str = None):
+        """
+        Flatten a nested taxonomy so the children of every node are contiguous
+
+        Each node is a dict with a 'name' and optional 'children', 'prompt'
+        (explicit CLIP prompt), 'template' (prompt template for descendants,
+        e.g. 'an artwork in the {name} style') and 'tag' (false for grouping
+        nodes that should never be returned as tags).
+
+        Args:
+            tree: Root node of the taxonomy
+            default_template: Prompt template used when no ancestor defines one
+        """
+        default_template = default_template or Config.TAXONOMY_TEMPLATE
+        self.names: List[str] = []
+        self.paths: List[str] = []
+        self.prompts: List[str] = []
+        parents, depths, taggable = [], [], []
+        child_start, child_end = [], []
+
+        # Breadth-first: a node's children are appended as one run, so they
+        # occupy rows [child_start, child_end) of the embedding matrix
+        queue = deque([(tree, -1, '', default_template, 0)])
+        while queue:
+            node, parent, parent_path, template, depth = queue.popleft()
+            index = len(self.names)
+            name = node['name']
+            path = f"{parent_path}/{name}" if parent_path else name
+
+            self.names.append(name)
+            self.paths.append(path)
+            self.prompts.append(node.get('prompt') or template.format(name=name))
+            parents.append(parent)
+            depths.append(depth)
+            taggable.append(depth > 0 and node.get('tag', True))
+            child_start.append(0)
+            child_end.append(0)
+
+            children = node.get('children') or []
+            if children:
+                first = len(self.names) + len(queue)
+                child_start[index] = first
+                child_end[index] = first + len(children)
+                child_template = node.get('template', template)
+                child_path = path if depth > 0 else ''
+                for child in children:
+                    queue.append((child, index, child_path, child_template, depth + 1))
+
+        self.parent = np.asarray(parents, dtype=np.int32)
+        self.depth = np.asarray(depths, dtype=np.int16)
+        self.taggable = np.asarray(taggable, dtype=bool)
+        self.child_start = np.asarray(child_start, dtype=np.int32)
+        self.child_end = np.asarray(child_end, dtype=np.int32)
+
+    @classmethod
+    def load(cls, path: str) -> "Taxonomy":
+        """
+        Load a taxonomy from a JSON file
+
+        Args:
+            path: Path to the taxonomy JSON file
+
+        Returns:
+            Flattened Taxonomy
+        """
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def fingerprint(self, model_name: str) -> str:
+        """
+        Stable identifier for the prompts and model, used to key cached embeddings
+
+        Args:
+            model_name: Name of the embedding model
+
+        Returns:
+            Hex digest
+        """
+        digest = hashlib.sha1(model_name.encode('utf-8'))
+        for prompt in self.prompts:
+            digest.update(b'\0' + prompt.encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+def chunked_topk(matrix: np.ndarray, queries: np.ndarray, k: int,
+                 chunk_size: int = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exhaustive top-k inner product search in fixed-size row chunks
+
+    Only a (Q, chunk_size) score block is alive at a time; each chunk's
+    candidates are merged into a running top-k with argpartition.
+
+    Args:
+        matrix: (N, D) float32 rows to search
+        queries: (Q, D) float32 queries
+        k: Number of results per query
+        chunk_size: Rows scored per matmul
+
+    Returns:
+        Tuple of (indices, scores), each (Q, k) and sorted by descending score
+    """
+    chunk_size = chunk_size or Config.TAXONOMY_CHUNK_SIZE
+    n_rows = matrix.shape[0]
+    k = min(k, n_rows)
+    best_idx = np.empty((queries.shape[0], 0), dtype=np.int64)
+    best_scores = np.empty((queries.shape[0], 0), dtype=np.float32)
+
+    for start in range(0, n_rows, chunk_size):
+        scores = queries @ matrix[start:start + chunk_size].T
+        kk = min(k, scores.shape[1])
+        part = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+        cand_scores = np.concatenate([best_scores, np.take_along_axis(scores, part, axis=1)], axis=1)
+        cand_idx = np.concatenate([best_idx, part + start], axis=1)
+        if cand_scores.shape[1] > k:
+            keep = np.argpartition(-cand_scores, k - 1, axis=1)[:, :k]
+            cand_scores = np.take_along_axis(cand_scores, keep, axis=1)
+            cand_idx = np.take_along_axis(cand_idx, keep, axis=1)
+        best_scores, best_idx = cand_scores, cand_idx
+
+    order = np.argsort(-best_scores, axis=1)
+    return np.take_along_axis(best_idx, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+class TaxonomyTagger:
+    """Zero-shot tagging against a large hierarchical taxonomy with coarse-to-fine pruning"""
+
+    def __init__(self, encoder, taxonomy_path: str = None, cache_dir: str = None,
+                 beam: int = None, top_k: int = None):
+        """
+        Args:
+            encoder: Object exposing encode_texts(list) -> (N, D) float32 (e.g. CLIPClassifier)
+            taxonomy_path: Path to the taxonomy JSON file
+            cache_dir: Directory for persisted node embeddings
+            beam: Nodes kept per level while descending the hierarchy
+            top_k: Number of tags returned per image
+        """
+        self.taxonomy = Taxonomy.load(taxonomy_path or Config.TAXONOMY_PATH)
+        self.cache_dir = cache_dir or Config.TAXONOMY_CACHE_DIR
+        self.beam = beam or Config.TAXONOMY_BEAM
+        self.top_k = top_k or Config.TAXONOMY_TOP_K
+        self.embeddings = self._load_or_compute_embeddings(encoder)
+
+    def _load_or_compute_embeddings(self, encoder) -> np.ndarray:
+        """Load node embeddings from the cache, encoding and persisting them on a miss"""
+        model_name = getattr(encoder, 'model_name', None) or Config.CLIP_MODEL
+        cache_path = os.path.join(
+            self.cache_dir, f"taxonomy-{self.taxonomy.fingerprint(model_name)}.npy"
+        )
+        if os.path.exists(cache_path):
+            embeddings = np.load(cache_path, mmap_mode='r')
+            if embeddings.shape[0] == len(self.taxonomy):
+                return embeddings
+
+        print(f"Encoding {len(self.taxonomy)} taxonomy prompts...")
+        embeddings = np.ascontiguousarray(encoder.encode_texts(self.taxonomy.prompts), dtype=np.float32)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = cache_path + '.tmp.npy'
+        np.save(tmp_path, embeddings)
+        os.replace(tmp_path, cache_path)
+        return embeddings
+
+    def _descend(self, query: np.ndarray, root_scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Beam search down the hierarchy for a single query
+
+        Args:
+            query: (D,) normalized image embedding
+            root_scores: Scores of the root's children (first level)
+
+        Returns:
+            Tuple of (visited node indices, their scores)
+        """
+        tax = self.taxonomy
+        frontier = np.arange(tax.child_start[0], tax.child_end[0])
+        scores = root_scores
+        visited_idx, visited_scores = [frontier], [scores]
+
+        while True:
+            if len(frontier) > self.beam:
+                keep = np.argpartition(-scores, self.beam - 1)[:self.beam]
+                frontier = frontier[keep]
+
+            starts, ends = tax.child_start[frontier], tax.child_end[frontier]
+            has_children = ends > starts
+            if not has_children.any():
+                break
+            frontier = np.concatenate([
+                np.arange(s, e) for s, e in zip(starts[has_children], ends[has_children])
+            ])
+            scores = self.embeddings[frontier] @ query
+            visited_idx.append(frontier)
+            visited_scores.append(scores)
+
+        return np.concatenate(visited_idx), np.concatenate(visited_scores)
+
+    def _format_tags(self, indices: np.ndarray, scores: np.ndarray) -> List[Dict]:
+        tax = self.taxonomy
+        return [
+            {"label": tax.names[i], "path": tax.paths[i], "score": round(float(s), 4)}
+            for i, s in zip(indices, scores)
+        ]
+
+    def tag_batch(self, image_embeddings: np.ndarray, top_k: Optional[int] = None) -> List[List[Dict]]:
+        """
+        Tag many images at once using coarse-to-fine pruning
+
+        The first level is scored for the whole batch in one chunked matmul;
+        below it only the children of the best `beam` nodes are scored, so the
+        per-image cost grows with beam x branching x depth rather than with
+        the vocabulary size.
+
+        Args:
+            image_embeddings: (Q, D) image embeddings
+            top_k: Number of tags per image
+
+        Returns:
+            One list of tag dicts (label, path, score) per image
+        """
+        top_k = top_k or self.top_k
+        tax = self.taxonomy
+        queries = np.atleast_2d(np.asarray(image_embeddings, dtype=np.float32))
+        queries = queries / (np.linalg.norm(queries, axis=1, keepdims=True) + 1e-12)
+
+        first, last = tax.child_start[0], tax.child_end[0]
+        level = self.embeddings[first:last]
+        chunk = Config.TAXONOMY_CHUNK_SIZE
+        root_scores = np.concatenate(
+            [queries @ level[s:s + chunk].T for s in range(0, level.shape[0], chunk)], axis=1
+        )
+
+        results = []
+        for query, scores in zip(queries, root_scores):
+            indices, node_scores = self._descend(query, scores)
+            mask = tax.taggable[indices]
+            indices, node_scores = indices[mask], node_scores[mask]
+            k = min(top_k, len(indices))
+            if k == 0:
+                results.append([])
+                continue
+            best = np.argpartition(-node_scores, k - 1)[:k]
+            best = best[np.argsort(-node_scores[best])]
+            results.append(self._format_tags(indices[best], node_scores[best]))
+        return results
+
+    def tag(self, image_embedding, top_k: Optional[int] = None) -> List[Dict]:
+        """
+        Tag a single image
+
+        Args:
+            image_embedding: Image embedding (list or array)
+            top_k: Number of tags to return
+
+        Returns:
+            List of tag dicts (label, path, score)
+        """
+        return self.tag_batch(np.asarray(image_embedding, dtype=np.float32)[None, :], top_k)[0]
+
+    def tag_flat_batch(self, image_embeddings: np.ndarray, top_k: Optional[int] = None) -> List[List[Dict]]:
+        """
+        Exhaustive (unpruned) tagging over every taggable node, for auditing pruning recall
+
+        Args:
+            image_embeddings: (Q, D) image embeddings
+            top_k: Number of tags per image
+
+        Returns:
+            One list of tag dicts (label, path, score) per image
+        """
+        top_k = top_k or self.top_k
+        queries = np.atleast_2d(np.asarray(image_embeddings, dtype=np.float32))
+        queries = queries / (np.linalg.norm(queries, axis=1, keepdims=True) + 1e-12)
+        taggable = np.flatnonzero(self.taxonomy.taggable)
+        indices, scores = chunked_topk(self.embeddings[taggable], queries, top_k)
+        return [self._format_tags(taggable[i], s) for i, s in zip(indices, scores)]
@@ -0,0 +1,136 @@
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional
+from urllib.parse import urlparse
+from pymongo import UpdateOne, ReplaceOne
+from config.settings import Config
+from utils.helpers import classify_error
+
+class FailureTracker:
+    """Per-document failure tracking with exponential backoff and dead-lettering"""
+
+    def __init__(self, db_handler):
+        self.db_handler = db_handler
+
+    @staticmethod
+    def backoff_seconds(attempts: int) -> int:
+        """
+        Delay before the next retry after a given number of failed attempts
+
+        Args:
+            attempts: Number of failed attempts so far (>= 1)
+
+        Returns:
+            Seconds to wait, doubling per attempt and capped at RETRY_MAX_SECONDS
+        """
+        delay = Config.RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0))
+        return min(delay, Config.RETRY_MAX_SECONDS)
+
+    @staticmethod
+    def pending_query(now: Optional[datetime] = None) -> Dict:
+        """
+        Query for documents that still need metadata and are due for processing
+
+        Args:
+            now: Reference time (defaults to the current UTC time)
+
+        Returns:
+            MongoDB query dict
+        """
+        now = now or datetime.utcnow()
+        return {
+            "metadata": {"$exists": False},
+            "processed_at": {"$exists": False},
+            "processing_failure.dead_lettered": {"$ne": True},
+            "$or": [
+                {"processing_failure": {"$exists": False}},
+                {"processing_failure.next_retry_at": {"$lte": now}}
+            ]
+        }
+
+    def build_failure(self, doc: Dict, exc: Exception) -> Dict:
+        """
+        Turn an exception into a failure result for bulk recording
+
+        Args:
+            doc: Document from MongoDB (with any previous processing_failure)
+            exc: Exception raised while downloading or processing
+
+        Returns:
+            Result dict with the document id and its failure record
+        """
+        now = datetime.utcnow()
+        previous = doc.get('processing_failure') or {}
+        attempts = int(previous.get('attempts', 0)) + 1
+        img_url = doc.get('img_url') or ''
+
+        return {
+            "_id": doc["_id"],
+            "failure": {
+                "error_class": classify_error(exc),
+                "error": str(exc)[:500],
+                "attempts": attempts,
+                "host": urlparse(img_url).netloc or 'unknown',
+                "img_url": img_url,
+                "first_failed_at": previous.get('first_failed_at', now),
+                "last_failed_at": now,
+                "next_retry_at": now + timedelta(seconds=self.backoff_seconds(attempts)),
+                "dead_lettered": attempts >= Config.MAX_ATTEMPTS
+            }
+        }
+
+    def record_failures(self, failures: List[Dict]):
+        """
+        Persist failure records and copy exhausted documents to the dead-letter collection
+
+        The source document stays in place (analytics still needs its sale
+        data) but is flagged so the pending query never selects it again.
+
+        Args:
+            failures: Results produced by build_failure
+        """
+        if not failures:
+            return
+
+        operations = [
+            UpdateOne({"_id": f["_id"]}, {"$set": {"processing_failure": f["failure"]}})
+            for f in failures
+        ]
+        dead = [
+            ReplaceOne({"_id": f["_id"]}, {"_id": f["_id"], **f["failure"]}, upsert=True)
+            for f in failures if f["failure"]["dead_lettered"]
+        ]
+
+        self.db_handler.bulk_write(operations, ordered=False)
+        if dead:
+            self.db_handler.bulk_write_dead_letter(dead, ordered=False)
+        print(f"Recorded {len(operations)} failures ({len(dead)} dead-lettered)")
+
+    def report(self) -> List[Dict]:
+        """
+        Summarise failures by host and error class
+
+        Returns:
+            Rows with host, error_class, count, dead-lettered count and attempts
+        """
+        pipeline = [
+            {"$match": {"processing_failure": {"$exists": True}, "metadata": {"$exists": False}}},
+            {"$group": {
+                "_id": {"host": "$processing_failure.host", "error_class": "$processing_failure.error_class"},
+                "count": {"$sum": 1},
+                "dead_lettered": {"$sum": {"$cond": ["$processing_failure.dead_lettered", 1, 0]}},
+                "avg_attempts": {"$avg": "$processing_failure.attempts"},
+                "next_retry_at": {"$min": "$processing_failure.next_retry_at"}
+            }},
+            {"$sort": {"count": -1}}
+        ]
+        return [
+            {
+                "host": row["_id"].get("host"),
+                "error_class": row["_id"].get("error_class"),
+                "count": row["count"],
+                "dead_lettered": row["dead_lettered"],
+                "avg_attempts": round(row["avg_attempts"] or 0, 1),
+                "next_retry_at": row["next_retry_at"]
+            }
+            for row in self.db_handler.aggregate(pipeline)
+        ]
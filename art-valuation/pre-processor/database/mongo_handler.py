@@ -9,6 +9,7 @@ class MongoDBHandler:
         self.client = None
         self.db = None
         self.collection = None
+        self.dead_letter = None
         self._connect()
     
     def _connect(self):
@@ -21,6 +22,7 @@ class MongoDBHandler:
         )
         self.db = self.client[Config.DB_NAME]
         self.collection = self.db[Config.COLLECTION_NAME]
+        self.dead_letter = self.db[Config.DEAD_LETTER_COLLECTION]
     
     def count_documents(self, query: Dict) -> int:
         """Count documents matching query"""
@@ -39,4 +41,12 @@ class MongoDBHandler:
     
     def create_index(self, index_spec: List, **kwargs):
         """Create index on collection"""
-        return self.collection.create_index(index_spec, **kwargs)
\ No newline at end of file
+        return self.collection.create_index(index_spec, **kwargs)
+    
+    def aggregate(self, pipeline: List[Dict]):
+        """Run an aggregation pipeline on the collection"""
+        return self.collection.aggregate(pipeline, allowDiskUse=True)
+    
+    def bulk_write_dead_letter(self, operations: List, ordered: bool = False):
+        """Execute bulk write operations against the dead-letter collection"""
+        return self.dead_letter.bulk_write(operations, ordered=ordered)
\ No newline at end of file
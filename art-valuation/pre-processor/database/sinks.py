@@ -0,0 +1,384 @@
+import logging
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Callable, List, Dict, Optional
+import numpy as np
+from pymongo import UpdateOne
+from config.settings import Config
+from core.memory_budget import estimate_result_bytes
+
+logger = logging.getLogger(__name__)
+
+class ResultSink:
+    """Destination for processed results; sinks must tolerate failure records"""
+
+    name = 'sink'
+    # Whether the sink needs the source document's passthrough fields
+    needs_source = False
+
+    def write(self, results: List[Dict]):
+        """
+        Write a batch of processed results
+
+        Args:
+            results: Processed results (and failure records) from one batch
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Flush any buffered rows"""
+
+    def set_budget(self, budget):
+        """Charge buffered rows to a MemoryBudget (None detaches it)"""
+
+class MongoSink(ResultSink):
+    """
+    Writes nested metadata back onto the source documents
+
+    Every successful document also gets `processed_at`, which keeps it out of
+    the pending query, and `updated_at` when its metadata is written (the
+    analytics snapshot watermark). With write_metadata=False only the marker
+    (and failure tracking) is written, for runs whose metadata goes to
+    columnar sinks only; a document is then marked once every columnar sink
+    has committed its part file (see mark_committed), so rows lost in a
+    crash before the flush are processed again on the next run.
+    """
+
+    name = 'mongo'
+
+    def __init__(self, db_handler, failure_tracker, write_metadata: bool = True):
+        self.db_handler = db_handler
+        self.failure_tracker = failure_tracker
+        self.write_metadata = write_metadata
+        # Marker mode: commits still needed per document id
+        self.commit_sources = 0
+        self._awaiting: Dict[Any, int] = {}
+
+    def write(self, results: List[Dict]):
+        operations = []
+        failures = []
+        processed_at = datetime.utcnow()
+        for result in results:
+            if "failure" in result:
+                failures.append(result)
+                continue
+            if not self.write_metadata and self.commit_sources:
+                self._awaiting[result["_id"]] = self.commit_sources
+                continue
+            fields = {"processed_at": processed_at}
+            if self.write_metadata:
+                fields["metadata"] = result["metadata"]
+                fields["updated_at"] = processed_at
+            operations.append(
+                UpdateOne({"_id": result["_id"]}, {"$set": fields, "$unset": {"processing_failure": ""}})
+            )
+
+        if failures:
+            try:
+                self.failure_tracker.record_failures(failures)
+            except Exception as e:
+                logger.error(f"Failure tracking error: {e}")
+        self._bulk_write(operations)
+
+    def mark_committed(self, ids: List[Any]):
+        """
+        Mark documents processed once their rows are in a committed part file
+
+        Args:
+            ids: Document ids written by one columnar sink flush
+        """
+        done = []
+        for _id in ids:
+            remaining = self._awaiting.get(_id)
+            if remaining is None:
+                continue
+            if remaining > 1:
+                self._awaiting[_id] = remaining - 1
+            else:
+                del self._awaiting[_id]
+                done.append(_id)
+        processed_at = datetime.utcnow()
+        self._bulk_write([
+            UpdateOne({"_id": _id}, {"$set": {"processed_at": processed_at}, "$unset": {"processing_failure": ""}})
+            for _id in done
+        ])
+
+    def _bulk_write(self, operations: List):
+        if not operations:
+            return
+        try:
+            self.db_handler.bulk_write(operations, ordered=False)
+            logger.info(f"Updated {len(operations)} documents in MongoDB")
+        except Exception as e:
+            logger.error(f"Bulk update error: {e}")
+
+# Share of the memory budget the buffered rows of a columnar sink may hold
+BUDGET_BUFFER_FRACTION = 0.5
+
+class ColumnarSink(ResultSink):
+    """
+    Buffers results and writes them as partitioned Arrow tables
+
+    Files land in `<output_dir>/processed_date=YYYY-MM-DD/part-<run>-<seq>.<ext>`.
+    Embeddings are a fixed_size_list<float32> column and label columns are
+    dictionary-encoded, so analytics can read them without flattening.
+
+    With a MemoryBudget attached (streaming mode) the buffered rows are
+    charged to it and a file is flushed early once they reach
+    BUDGET_BUFFER_FRACTION of the limit, or while admission is blocked.
+    Callbacks in `on_commit` receive the ids of every committed file.
+    """
+
+    needs_source = True
+    extension = ''
+
+    def __init__(self, output_dir: Optional[str] = None, rows_per_file: Optional[int] = None):
+        try:
+            import pyarrow as pa
+        except ImportError as e:
+            raise ImportError(f"The {self.name} sink requires pyarrow (pip install pyarrow)") from e
+        self.pa = pa
+        self.output_dir = output_dir or Config.SINK_OUTPUT_DIR
+        self.rows_per_file = rows_per_file or Config.SINK_ROWS_PER_FILE
+        self.run_id = uuid.uuid4().hex[:8]
+        self._rows: List[Dict] = []
+        self._seq = 0
+        self.budget = None
+        self._bytes = 0
+        self.on_commit: List[Callable[[List[Any]], None]] = []
+
+    def set_budget(self, budget):
+        self.budget = budget
+
+    def write(self, results: List[Dict]):
+        rows = [r for r in results if "failure" not in r]
+        self._rows.extend(rows)
+        if self.budget is not None and rows:
+            # Charged without blocking: the writer is what frees the budget
+            nbytes = sum(estimate_result_bytes(r) for r in rows)
+            self.budget.adjust(nbytes)
+            self._bytes += nbytes
+        if len(self._rows) >= self.rows_per_file or self._over_budget():
+            self._flush()
+
+    def _over_budget(self) -> bool:
+        if self.budget is None or not self._rows:
+            return False
+        return self._bytes >= self.budget.limit_bytes * BUDGET_BUFFER_FRACTION or self.budget.waiting > 0
+
+    def close(self):
+        self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+        ids = [r["_id"] for r in rows]
+        try:
+            table = self.build_table(rows)
+        finally:
+            # The result dicts go now; the Arrow table holds the rows from here on
+            del rows
+            if self.budget is not None:
+                self.budget.release(self._bytes)
+            self._bytes = 0
+
+        partition = os.path.join(self.output_dir, f"processed_date={datetime.utcnow():%Y-%m-%d}")
+        os.makedirs(partition, exist_ok=True)
+        path = os.path.join(partition, f"part-{self.run_id}-{self._seq:05d}{self.extension}")
+        self._seq += 1
+
+        tmp_path = path + '.tmp'
+        self.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+        logger.info(f"Wrote {table.num_rows} rows to {path}")
+        for callback in self.on_commit:
+            callback(ids)
+
+    def write_table(self, table, path: str):
+        raise NotImplementedError
+
+    def _dictionary(self, values: List[Optional[str]]):
+        return self.pa.array(values, type=self.pa.string()).dictionary_encode()
+
+    def _dictionary_list(self, values: List[Optional[List[str]]]):
+        pa = self.pa
+        lists = pa.array(values, type=pa.list_(pa.string()))
+        return pa.ListArray.from_arrays(lists.offsets, lists.flatten().dictionary_encode(), mask=lists.is_null())
+
+    def _passthrough_column(self, field: str, values: List):
+        """Typed column for a source field, so every file shares one schema"""
+        pa = self.pa
+        kind = _PASSTHROUGH_TYPES.get(field)
+        if kind == 'category':
+            return self._dictionary([None if v is None else str(v) for v in values])
+        if kind == 'float':
+            return pa.array([_to_float(v) for v in values], type=pa.float64())
+        if kind == 'int':
+            return pa.array([None if _to_float(v) is None else int(_to_float(v)) for v in values], type=pa.int32())
+        if kind == 'bool':
+            return pa.array([None if v is None else bool(v) for v in values], type=pa.bool_())
+        if kind == 'timestamp':
+            return pa.array([v if isinstance(v, datetime) else None for v in values], type=pa.timestamp('ms'))
+        array = pa.array(values, from_pandas=True)
+        return array.dictionary_encode() if pa.types.is_string(array.type) else array
+
+    def build_table(self, rows: List[Dict]):
+        """
+        Convert processed results to an Arrow table
+
+        Args:
+            rows: Successful processed results
+
+        Returns:
+            pyarrow.Table
+        """
+        pa = self.pa
+        metadata = [r["metadata"] for r in rows]
+        columns = {"_id": pa.array([str(r["_id"]) for r in rows], type=pa.string())}
+
+        embeddings = np.asarray([m["image_embedding"] for m in metadata], dtype=np.float32)
+        columns["embedding"] = pa.FixedSizeListArray.from_arrays(
+            pa.array(embeddings.reshape(-1)), embeddings.shape[1]
+        )
+
+        columns["caption"] = pa.array([m.get("caption") for m in metadata], type=pa.string())
+        columns["style_labels"] = self._dictionary_list([m.get("style_labels") for m in metadata])
+        columns["medium_label"] = self._dictionary([(m.get("medium_labels") or [None])[0] for m in metadata])
+        columns["dominant_colors"] = self._dictionary_list([m.get("dominant_colors") for m in metadata])
+        columns["foreground_objects"] = self._dictionary_list(
+            [m.get("composition", {}).get("foreground_objects") for m in metadata]
+        )
+        columns["background"] = self._dictionary([m.get("composition", {}).get("background") for m in metadata])
+        columns["aspect_ratio"] = self._dictionary([m.get("composition", {}).get("aspect_ratio") for m in metadata])
+        columns["texture"] = self._dictionary([m.get("texture") for m in metadata])
+        columns["lighting"] = self._dictionary([m.get("lighting") for m in metadata])
+        # Always present (null when untagged), so every file shares one schema
+        columns["taxonomy_tags"] = self._dictionary_list(
+            [[t["path"] for t in m["taxonomy_tags"]] if m.get("taxonomy_tags") is not None else None
+             for m in metadata]
+        )
+
+        for field in _passthrough_fields():
+            values = [(r.get("source") or {}).get(field) for r in rows]
+            columns[field] = self._passthrough_column(field, values)
+
+        columns["processed_at"] = pa.array([datetime.utcnow()] * len(rows), type=pa.timestamp('ms'))
+        return pa.table(columns)
+
+class ParquetSink(ColumnarSink):
+    """Partitioned Parquet files"""
+
+    name = 'parquet'
+    extension = '.parquet'
+
+    def write_table(self, table, path: str):
+        import pyarrow.parquet as pq
+        pq.write_table(table, path, compression='zstd')
+
+class ArrowIPCSink(ColumnarSink):
+    """Partitioned Arrow IPC (Feather v2) files, memory-mappable by readers"""
+
+    name = 'arrow'
+    extension = '.arrow'
+
+    def write_table(self, table, path: str):
+        with self.pa.OSFile(path, 'wb') as sink:
+            with self.pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+class MultiSink(ResultSink):
+    """Fans each batch out to several sinks; one failing sink does not block the others"""
+
+    name = 'multi'
+
+    def __init__(self, sinks: List[ResultSink]):
+        self.sinks = sinks
+        self.needs_source = any(s.needs_source for s in sinks)
+
+    def write(self, results: List[Dict]):
+        results = [r for r in results if r]
+        if not results:
+            return
+        for sink in self.sinks:
+            try:
+                sink.write(results)
+            except Exception as e:
+                logger.error(f"{sink.name} sink write error: {e}")
+
+    def close(self):
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                logger.error(f"{sink.name} sink close error: {e}")
+
+    def set_budget(self, budget):
+        for sink in self.sinks:
+            sink.set_budget(budget)
+
+# Column types for well-known source fields
+_PASSTHROUGH_TYPES = {
+    "artist": 'category', "medium": 'category', "auction_house": 'category', "gallery": 'category',
+    "dim1": 'float', "dim2": 'float', "value": 'float',
+    "year_created": 'int', "sold": 'bool', "sale_date": 'timestamp'
+}
+
+def _to_float(value) -> Optional[float]:
+    try:
+        result = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if np.isnan(result) else result
+
+def _passthrough_fields() -> List[str]:
+    return [f.strip() for f in Config.SINK_PASSTHROUGH_FIELDS.split(',') if f.strip()]
+
+def create_sinks(names: str, db_handler, failure_tracker) -> MultiSink:
+    """
+    Build the configured sinks
+
+    Processed documents are always marked in MongoDB: without the mongo sink a
+    marker-only MongoSink is added, otherwise every run would re-process the
+    whole collection. It marks a document only after the columnar sinks have
+    committed it, and comes first so it sees each batch before any flush.
+
+    Args:
+        names: Comma-separated sink names (mongo, parquet, arrow)
+        db_handler: MongoDB handler used by the mongo sink
+        failure_tracker: Failure tracker used by the mongo sink
+
+    Returns:
+        MultiSink writing to every configured sink
+    """
+    sinks = []
+    for name in [n.strip().lower() for n in names.split(',') if n.strip()]:
+        if name == 'mongo':
+            sinks.append(MongoSink(db_handler, failure_tracker))
+        elif name == 'parquet':
+            sinks.append(ParquetSink())
+        elif name == 'arrow':
+            sinks.append(ArrowIPCSink())
+        else:
+            raise ValueError(f"Unknown output sink: {name}")
+    if not any(isinstance(sink, MongoSink) for sink in sinks):
+        marker = MongoSink(db_handler, failure_tracker, write_metadata=False)
+        columnar = [sink for sink in sinks if isinstance(sink, ColumnarSink)]
+        marker.commit_sources = len(columnar)
+        for sink in columnar:
+            sink.on_commit.append(marker.mark_committed)
+        sinks.insert(0, marker)
+    return MultiSink(sinks)
+
+def source_projection(sinks: ResultSink) -> Dict:
+    """
+    Extra fields to read from the source documents for the configured sinks
+
+    Args:
+        sinks: Configured sink(s)
+
+    Returns:
+        Projection dict fragment
+    """
+    return {f: 1 for f in _passthrough_fields()} if sinks.needs_source else {}
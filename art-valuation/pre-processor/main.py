@@ -1,15 +1,29 @@
+import argparse
+import queue
+import threading
 import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional
+import numpy as np
 from tqdm import tqdm
 
 # Import from our modules
 from config.settings import Config
+from core.autotune import AdaptiveBatchController
 from core.clip_classifier import CLIPClassifier
 from core.image_processor import ImageProcessor
-from database.mongodb_handler import MongoDBHandler
+from core.taxonomy_tagger import TaxonomyTagger
+from core.memory_budget import (
+    MemoryBudget, ByteBudgetQueue, estimate_image_bytes, estimate_result_bytes
+)
+from database.mongo_handler import MongoDBHandler
+from database.failure_tracker import FailureTracker
+from database.sinks import create_sinks, source_projection
 from models.metadata_models import generate_caption, create_metadata_dict
 from utils.helpers import (
-    setup_logging, download_image_sync, process_batch, create_mongodb_indexes
+    setup_logging, fetch_image, process_batch, create_mongodb_indexes,
+    memory_snapshot, log_fetch_report
 )
 
 logger = setup_logging()
@@ -20,9 +34,19 @@ class ArtMetadataGenerator:
     def __init__(self):
         # MongoDB setup
         self.db_handler = MongoDBHandler()
+        self.failure_tracker = FailureTracker(self.db_handler)
+        
+        # Output sinks (Mongo and/or columnar files)
+        self.sinks = create_sinks(Config.OUTPUT_SINKS, self.db_handler, self.failure_tracker)
         
         # Initialize CLIP classifier
         self.classifier = CLIPClassifier()
+        
+        # Optional large-vocabulary taxonomy tagger
+        self.tagger = TaxonomyTagger(self.classifier) if Config.TAXONOMY_PATH else None
+        
+        # Batch size / thread split auto-tuning for batched inference
+        self.controller = AdaptiveBatchController(logger=logger) if Config.AUTOTUNE else None
     
     def process_single_image(self, doc: Dict) -> Optional[Dict]:
         """
@@ -32,17 +56,33 @@ class ArtMetadataGenerator:
             doc: Document from MongoDB
             
         Returns:
-            Processed document with metadata or None if processing fails
+            Processed document with metadata, or a failure record if processing fails
         """
         try:
             # Download image
-            image = download_image_sync(doc['img_url'])
-            if image is None:
-                return None
+            image = fetch_image(doc['img_url'])
             
             # Resize for faster processing
             image = ImageProcessor.resize_image_for_clip(image)
             
+            return self._extract_metadata(doc, image)
+            
+        except Exception as e:
+            logger.error(f"Error processing {doc.get('_id')}: {e}")
+            return self.failure_tracker.build_failure(doc, e)
+    
+    def _extract_metadata(self, doc: Dict, image) -> Dict:
+        """
+        Build the metadata for an already resized image and release the image
+        
+        Args:
+            doc: Document from MongoDB
+            image: PIL Image resized for CLIP
+            
+        Returns:
+            Processed document with metadata
+        """
+        try:
             # Parallel classification
             style_labels = self.classifier.classify_fast(image, 'style', 2)
             subject_labels = self.classifier.classify_fast(image, 'subject', 2)
@@ -52,12 +92,14 @@ class ArtMetadataGenerator:
             background = self.classifier.classify_fast(image, 'background', 1)[0]
             
             # Fast color extraction
-            img_array = np.array(image).reshape(-1, 3)
-            img_hash = hash(img_array.tobytes())
-            dominant_colors = list(ImageProcessor.get_dominant_colors_fast(img_hash, img_array.tobytes()))
+            img_array = np.asarray(image).reshape(-1, 3)
+            img_hash = ImageProcessor.hash_pixels(img_array)
+            dominant_colors = list(ImageProcessor.get_dominant_colors_fast(img_hash, img_array))
+            del img_array
             
             # Get embedding
             image_embedding = self.classifier.get_image_embedding(image)
+            taxonomy_tags = self.tagger.tag(image_embedding) if self.tagger else None
             
             # Generate caption
             caption = generate_caption(style_labels, subject_labels, doc.get('medium', 'painting'))
@@ -65,45 +107,180 @@ class ArtMetadataGenerator:
             # Calculate aspect ratio
             width, height = image.size
             aspect_ratio = f"{round(width/height, 1)}:1" if width >= height else f"1:{round(height/width, 1)}"
+        finally:
+            # Release pixel buffers as soon as preprocessing is done
+            image.close()
+        
+        # Create metadata
+        metadata = create_metadata_dict(
+            caption, style_labels, doc.get('medium', 'Unknown'), dominant_colors,
+            foreground_objects, background, aspect_ratio, image_embedding, texture, lighting,
+            taxonomy_tags=taxonomy_tags
+        )
+        
+        return self._make_result(doc, metadata)
+    
+    def _make_result(self, doc: Dict, metadata: Dict) -> Dict:
+        """Package metadata with the source fields the configured sinks need"""
+        result = {"_id": doc["_id"], "metadata": metadata}
+        fields = self._source_fields
+        if fields:
+            result["source"] = {f: doc.get(f) for f in fields}
+        return result
+    
+    @property
+    def _source_fields(self) -> List[str]:
+        return list(source_projection(self.sinks))
+    
+    def _projection(self) -> Dict:
+        """Fields read from the collection for processing and for the sinks"""
+        projection = {"_id": 1, "img_url": 1, "medium": 1, "processing_failure": 1}
+        projection.update(source_projection(self.sinks))
+        return projection
+    
+    def _prepare_image(self, doc: Dict) -> Dict:
+        """
+        Download, resize and run the per-image CPU work ahead of batched inference
+        
+        Args:
+            doc: Document from MongoDB
+            
+        Returns:
+            Dict with the doc, resized image, colours and aspect ratio, or a failure record
+        """
+        try:
+            image = ImageProcessor.resize_image_for_clip(fetch_image(doc['img_url']))
+            img_array = np.asarray(image).reshape(-1, 3)
+            img_hash = ImageProcessor.hash_pixels(img_array)
+            dominant_colors = list(ImageProcessor.get_dominant_colors_fast(img_hash, img_array))
+            width, height = image.size
+            aspect_ratio = f"{round(width/height, 1)}:1" if width >= height else f"1:{round(height/width, 1)}"
+            return {"doc": doc, "image": image, "dominant_colors": dominant_colors, "aspect_ratio": aspect_ratio}
+        except Exception as e:
+            logger.error(f"Error processing {doc.get('_id')}: {e}")
+            return self.failure_tracker.build_failure(doc, e)
+    
+    def process_batch_batched(self, batch: List[Dict], max_workers: int) -> tuple:
+        """
+        Process a batch with one CLIP forward pass for all of its images
+        
+        Downloads and colour extraction run in worker threads; embedding and
+        every label category are then computed from a single batched encode.
+        
+        Args:
+            batch: Documents from MongoDB
+            max_workers: Worker threads for download/preprocessing
             
-            # Create metadata
+        Returns:
+            Tuple of (results, seconds spent in model inference)
+        """
+        prepared = process_batch(batch, self._prepare_image, max_workers=max_workers)
+        results = [p for p in prepared if "failure" in p]
+        ready = [p for p in prepared if "failure" not in p]
+        if not ready:
+            return results, 0.0
+        
+        start = time.perf_counter()
+        try:
+            features = self.classifier.encode_images([p["image"] for p in ready])
+            labels = {
+                category: self.classifier.classify_features(features, category, top_k)
+                for category, top_k in (('style', 2), ('subject', 2), ('objects', 3),
+                                        ('lighting', 1), ('texture', 1), ('background', 1))
+            }
+            taxonomy_tags = self.tagger.tag_batch(features) if self.tagger else [None] * len(ready)
+        except Exception as e:
+            logger.error(f"Batch inference error: {e}")
+            return results + [self.failure_tracker.build_failure(p["doc"], e) for p in ready], 0.0
+        finally:
+            for p in ready:
+                p["image"].close()
+        inference_seconds = time.perf_counter() - start
+        
+        for i, p in enumerate(ready):
+            doc = p["doc"]
+            caption = generate_caption(labels['style'][i], labels['subject'][i], doc.get('medium', 'painting'))
             metadata = create_metadata_dict(
-                caption, style_labels, doc.get('medium', 'Unknown'), dominant_colors,
-                foreground_objects, background, aspect_ratio, image_embedding, texture, lighting
+                caption, labels['style'][i], doc.get('medium', 'Unknown'), p["dominant_colors"],
+                labels['objects'][i], labels['background'][i][0], p["aspect_ratio"],
+                features[i].tolist(), labels['texture'][i][0], labels['lighting'][i][0],
+                taxonomy_tags=taxonomy_tags[i]
             )
+            results.append(self._make_result(doc, metadata))
+        return results, inference_seconds
+    
+    def _run_batch(self, batch: List[Dict]) -> List[Dict]:
+        """
+        Process one batch, letting the controller tune and observe it when enabled
+        
+        Args:
+            batch: Documents from MongoDB
             
-            return {"_id": doc["_id"], "metadata": metadata}
+        Returns:
+            Processed results and failure records
+        """
+        if self.controller is None:
+            return process_batch(batch, self.process_single_image)
+        
+        config = self.controller.current
+        self.classifier.set_threads(config.torch_threads)
+        start = time.perf_counter()
+        results, inference_seconds = self.process_batch_batched(batch, config.workers)
+        self.controller.observe(len(batch), time.perf_counter() - start, inference_seconds)
+        return results
+    
+    def _process_budgeted(self, doc: Dict, budget: MemoryBudget, results: ByteBudgetQueue, pbar):
+        """
+        Process a single document while keeping its memory charged to the budget
+        
+        The admission reservation is corrected to the real decoded size, then
+        shrunk to the resized image and finally handed over to the result queue.
+        
+        Args:
+            doc: Document from MongoDB
+            budget: Shared memory budget (already holds IMAGE_BYTES_ESTIMATE for doc)
+            results: Byte-accounted queue feeding the writer
+            pbar: Progress bar to advance
+        """
+        reserved = Config.IMAGE_BYTES_ESTIMATE
+        try:
+            image = fetch_image(doc['img_url'])
+            
+            decoded = estimate_image_bytes(image)
+            budget.adjust(decoded - reserved)
+            reserved = decoded
             
+            image = ImageProcessor.resize_image_for_clip(image)
+            resized = estimate_image_bytes(image)
+            budget.adjust(resized - reserved)
+            reserved = resized
+            
+            result = self._extract_metadata(doc, image)
+            image = None
+            
+            nbytes = estimate_result_bytes(result)
+            budget.adjust(nbytes - reserved)
+            reserved = 0
+            results.put(result, nbytes, reserved=True)
         except Exception as e:
             logger.error(f"Error processing {doc.get('_id')}: {e}")
-            return None
+            failure = self.failure_tracker.build_failure(doc, e)
+            nbytes = estimate_result_bytes(failure)
+            budget.adjust(nbytes - reserved)
+            reserved = 0
+            results.put(failure, nbytes, reserved=True)
+        finally:
+            budget.release(reserved)
+            pbar.update(1)
     
-    def bulk_update_mongodb(self, results: List[Dict]):
+    def write_results(self, results: List[Dict]):
         """
-        Efficient bulk update to MongoDB
+        Write processed results and failure records to every configured sink
         
         Args:
-            results: List of processed results to update
+            results: List of processed results and failure records
         """
-        if not results:
-            return
-        
-        operations = []
-        for result in results:
-            if result:
-                operations.append(
-                    pymongo.UpdateOne(
-                        {"_id": result["_id"]},
-                        {"$set": {"metadata": result["metadata"]}}
-                    )
-                )
-        
-        if operations:
-            try:
-                self.db_handler.bulk_write(operations, ordered=False)
-                logger.info(f"Updated {len(operations)} documents in MongoDB")
-            except Exception as e:
-                logger.error(f"Bulk update error: {e}")
+        self.sinks.write(results)
     
     def process_collection(self, limit: Optional[int] = None):
         """
@@ -112,16 +289,22 @@ class ArtMetadataGenerator:
         Args:
             limit: Maximum number of documents to process
         """
-        # Get documents without metadata
-        query = {"metadata": {"$exists": False}}
+        if Config.MEMORY_BUDGET_MB > 0:
+            return self.process_collection_streaming(limit)
+        
+        # Get documents without metadata that are due for (re)processing
+        query = FailureTracker.pending_query()
         total_docs = self.db_handler.count_documents(query)
         
         if limit:
             total_docs = min(total_docs, limit)
         
-        logger.info(f"Processing {total_docs} documents with {Config.MAX_WORKERS} workers...")
+        if self.controller:
+            logger.info(f"Processing {total_docs} documents with auto-tuned batch size and threads...")
+        else:
+            logger.info(f"Processing {total_docs} documents with {Config.MAX_WORKERS} workers...")
         
-        cursor = self.db_handler.find(query, {"_id": 1, "img_url": 1, "medium": 1})
+        cursor = self.db_handler.find(query, self._projection())
         if limit:
             cursor = cursor.limit(limit)
         
@@ -129,51 +312,174 @@ class ArtMetadataGenerator:
         batch = []
         processed = 0
         
+        batch_size = self.controller.batch_size if self.controller else Config.BATCH_SIZE
+        
         with tqdm(total=total_docs, desc="Processing images") as pbar:
             for doc in cursor:
                 batch.append(doc)
                 
-                if len(batch) >= Config.BATCH_SIZE:
+                if len(batch) >= batch_size:
                     # Process batch in parallel
-                    results = process_batch(batch, self.process_single_image)
+                    results = self._run_batch(batch)
                     
                     # Bulk update MongoDB
-                    self.bulk_update_mongodb([r for r in results if r])
+                    self.write_results([r for r in results if r])
                     
                     processed += len(batch)
                     pbar.update(len(batch))
                     batch = []
+                    if self.controller:
+                        batch_size = self.controller.batch_size
                     
                     # Brief pause to prevent overwhelming
                     time.sleep(0.05)
             
             # Process remaining batch
             if batch:
-                results = process_batch(batch, self.process_single_image)
-                self.bulk_update_mongodb([r for r in results if r])
+                results = self._run_batch(batch)
+                self.write_results([r for r in results if r])
                 processed += len(batch)
                 pbar.update(len(batch))
         
+        self.sinks.close()
         logger.info(f"Processing complete! Processed {processed} documents")
+        log_fetch_report(logger)
+    
+    def _drain_results(self, results: ByteBudgetQueue, budget: MemoryBudget):
+        """
+        Writer stage: flush results in batches and release their bytes
+        
+        Args:
+            results: Byte-accounted queue of processed results
+            budget: Shared memory budget
+        """
+        batch, batch_bytes, batch_no = [], 0, 0
+        done = False
+        while not done:
+            idle = False
+            try:
+                result, nbytes = results.get(timeout=1.0)
+            except queue.Empty:
+                # Flush partial batches so queued results never hold the budget hostage
+                idle = True
+            else:
+                if result is None:
+                    done = True
+                else:
+                    batch.append(result)
+                    batch_bytes += nbytes
+            
+            # A blocked admission means buffered results are what holds the
+            # budget (e.g. a budget below IMAGE_BYTES_ESTIMATE plus one batch),
+            # so flush right away instead of waiting for the queue to go idle
+            starved = budget.waiting > 0
+            if batch and (done or idle or starved or len(batch) >= Config.BATCH_SIZE):
+                self.write_results(batch)
+                batch = []
+                budget.release(batch_bytes)
+                batch_bytes = 0
+                batch_no += 1
+                logger.info(
+                    f"Batch {batch_no}: budget {budget.in_use / 1e6:.1f}/{budget.limit_bytes / 1e6:.0f} MB "
+                    f"(peak {budget.peak / 1e6:.1f} MB), memory {memory_snapshot()}"
+                )
+    
+    def process_collection_streaming(self, limit: Optional[int] = None):
+        """
+        Bounded-memory processing: every stage is charged to Config.MEMORY_BUDGET_MB
+        
+        Documents are only admitted while the budget has room, images are
+        released right after preprocessing and results are flushed in batches
+        by a dedicated writer thread.
+        
+        Args:
+            limit: Maximum number of documents to process
+        """
+        if Config.TRACE_MALLOC and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        
+        budget = MemoryBudget(Config.MEMORY_BUDGET_MB * 1024 * 1024)
+        results = ByteBudgetQueue(budget)
+        
+        query = FailureTracker.pending_query()
+        total_docs = self.db_handler.count_documents(query)
+        if limit:
+            total_docs = min(total_docs, limit)
+        
+        logger.info(
+            f"Streaming {total_docs} documents with {Config.MAX_WORKERS} workers "
+            f"under a {Config.MEMORY_BUDGET_MB} MB budget..."
+        )
+        
+        cursor = self.db_handler.find(query, self._projection())
+        if limit:
+            cursor = cursor.limit(limit)
+        
+        # Rows buffered by columnar sinks count against the budget too
+        self.sinks.set_budget(budget)
+        writer = threading.Thread(target=self._drain_results, args=(results, budget), daemon=True)
+        writer.start()
+        
+        admitted = 0
+        with tqdm(total=total_docs, desc="Processing images") as pbar:
+            with ThreadPoolExecutor(max_workers=Config.MAX_WORKERS) as executor:
+                for doc in cursor:
+                    # Admission pauses here while the budget is exhausted
+                    budget.acquire(Config.IMAGE_BYTES_ESTIMATE)
+                    executor.submit(self._process_budgeted, doc, budget, results, pbar)
+                    admitted += 1
+            results.close()
+            writer.join()
+        self.sinks.close()
+        self.sinks.set_budget(None)
+        
+        logger.info(
+            f"Streaming complete! Processed {admitted} documents, "
+            f"budget peak {budget.peak / 1e6:.1f} MB, memory {memory_snapshot()}"
+        )
+        log_fetch_report(logger)
     
     def create_indexes(self):
         """Create MongoDB indexes for better query performance"""
         create_mongodb_indexes(self.db_handler.collection)
+    
+    def report_failures(self):
+        """Print a summary of failed documents by host and error class"""
+        rows = self.failure_tracker.report()
+        if not rows:
+            print("No failed documents.")
+            return
+        
+        print(f"{'host':<40} {'error_class':<14} {'count':>7} {'dead':>6} {'avg_att':>8}  next_retry_at")
+        for row in rows:
+            print(
+                f"{row['host'] or '-':<40} {row['error_class'] or '-':<14} {row['count']:>7} "
+                f"{row['dead_lettered']:>6} {row['avg_attempts']:>8}  {row['next_retry_at']}"
+            )
 
 def main():
     """Optimized main function"""
-    logger.info("Starting art metadata generation...")
+    parser = argparse.ArgumentParser(description="Art metadata generation")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum number of documents to process")
+    parser.add_argument("--report-failures", action="store_true",
+                        help="Summarise failed documents by host and error class, then exit")
+    args = parser.parse_args()
     
     generator = ArtMetadataGenerator()
     
+    if args.report_failures:
+        generator.report_failures()
+        return
+    
+    logger.info("Starting art metadata generation...")
+    
     # Create indexes first
     generator.create_indexes()
     
-    # Process collection (remove limit for full processing)
-    generator.process_collection(limit=None)  # Set to None for all 968 images
+    # Process collection (no limit processes every pending document)
+    generator.process_collection(limit=args.limit)
     
     logger.info("✅ Metadata generation complete!")
 
 if __name__ == "__main__":
-    import pymongo  # Import here to avoid circular imports
     main()
\ No newline at end of file
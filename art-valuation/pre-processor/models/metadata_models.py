@@ -33,7 +33,8 @@ def create_metadata_dict(
     aspect_ratio: str,
     image_embedding: List[float],
     texture: str,
-    lighting: str
+    lighting: str,
+    taxonomy_tags: Optional[List[Dict]] = None
 ) -> Dict:
     """
     Create a metadata dictionary with standardized structure
@@ -49,11 +50,12 @@ def create_metadata_dict(
         image_embedding: CLIP image embedding
         texture: Texture description
         lighting: Lighting description
+        taxonomy_tags: Hierarchical taxonomy tags (label, path, score), if enabled
         
     Returns:
         Structured metadata dictionary
     """
-    return {
+    metadata = {
         "caption": caption,
         "style_labels": style_labels,
         "medium_labels": [f"{medium} painting"],
@@ -66,4 +68,7 @@ def create_metadata_dict(
         "image_embedding": image_embedding,
         "texture": texture,
         "lighting": lighting
-    }
\ No newline at end of file
+    }
+    if taxonomy_tags is not None:
+        metadata["taxonomy_tags"] = taxonomy_tags
+    return metadata
\ No newline at end of file
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+benchmark_models.py
+
+Runs every registered embedding model over a fixed local image set and
+reports, per model:
+ - images/sec for batched image encoding (after one warm-up batch)
+ - model load time and peak RSS growth while loading and encoding
+ - agreement of top-1 style / subject labels with a reference model
+
+Results are printed as a table and saved to MODEL_BENCHMARK_PATH, which
+the model registry reads to fill in expected throughput.
+
+Usage (from art-valuation/pre-processor):
+    python scripts/benchmark_models.py --images ./bench_images --reference ViT-L/14
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import torch
+from PIL import Image
+
+from config.settings import Config
+from core.image_processor import ImageProcessor
+from core.model_registry import list_models, load_model
+from utils.helpers import get_rss_bytes
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+
+class PeakRSSSampler:
+    """Samples RSS in a background thread to catch transient peaks."""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, get_rss_bytes())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = get_rss_bytes()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, get_rss_bytes())
+
+
+def load_images(folder: str, limit: int) -> List[Image.Image]:
+    """Load (and pre-resize) a deterministic, sorted set of local images."""
+    paths = sorted(
+        os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS)
+    )[:limit]
+    if not paths:
+        raise SystemExit(f"No images found in {folder}")
+    return [ImageProcessor.resize_image_for_clip(Image.open(p).convert('RGB'), max_size=256) for p in paths]
+
+
+@torch.no_grad()
+def run_model(name: str, images: List[Image.Image], label_sets: Dict[str, List[str]], batch_size: int) -> Dict:
+    """Load one model, time batched encoding and compute top-1 labels per category."""
+    gc.collect()
+    baseline = get_rss_bytes()
+    with PeakRSSSampler() as sampler:
+        start = time.perf_counter()
+        loaded = load_model(name, 'cpu')
+        load_seconds = time.perf_counter() - start
+
+        text_features = {}
+        for category, labels in label_sets.items():
+            feats = loaded.model.encode_text(loaded.tokenize(labels)).float()
+            text_features[category] = feats / feats.norm(dim=-1, keepdim=True)
+
+        def encode(batch):
+            inputs = torch.stack([loaded.preprocess(im) for im in batch])
+            feats = loaded.model.encode_image(inputs).float()
+            return feats / feats.norm(dim=-1, keepdim=True)
+
+        encode(images[:batch_size])  # warm-up
+
+        features = []
+        start = time.perf_counter()
+        for i in range(0, len(images), batch_size):
+            features.append(encode(images[i:i + batch_size]))
+        encode_seconds = time.perf_counter() - start
+        features = torch.cat(features)
+
+    top1 = {
+        category: [labels[i] for i in (features @ text_features[category].T).argmax(dim=-1).tolist()]
+        for category, labels in label_sets.items()
+    }
+
+    del loaded, features
+    gc.collect()
+    return {
+        "model": name,
+        "embedding_dim": int(text_features[next(iter(text_features))].shape[1]),
+        "images": len(images),
+        "images_per_sec": round(len(images) / encode_seconds, 2),
+        "load_seconds": round(load_seconds, 2),
+        "peak_rss_delta_mb": round((sampler.peak - baseline) / (1024 * 1024), 1),
+        "top1": top1,
+    }
+
+
+def agreement(labels: List[str], reference: List[str]) -> float:
+    return float(np.mean([a == b for a, b in zip(labels, reference)])) if reference else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark registered embedding models")
+    parser.add_argument("--images", required=True, help="Folder with the fixed benchmark image set")
+    parser.add_argument("--limit", type=int, default=500, help="Maximum number of images to use")
+    parser.add_argument("--models", default="all", help="Comma-separated model names, or 'all'")
+    parser.add_argument("--reference", default="ViT-L/14", help="Model whose labels count as ground truth")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--output", default=Config.MODEL_BENCHMARK_PATH)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    names = [m.name for m in list_models()] if args.models == "all" else args.models.split(',')
+    if args.reference not in names:
+        names.insert(0, args.reference)
+
+    images = load_images(args.images, args.limit)
+    label_sets = {
+        "style": Config.STYLE_LABELS.split(','),
+        "subject": Config.SUBJECT_LABELS.split(','),
+    }
+    print(f"Benchmarking {len(names)} models on {len(images)} images "
+          f"(batch {args.batch_size}, {torch.get_num_threads()} threads)")
+
+    results = []
+    for name in names:
+        try:
+            results.append(run_model(name, images, label_sets, args.batch_size))
+            print(f"  {name}: {results[-1]['images_per_sec']} img/s")
+        except Exception as e:
+            print(f"  {name}: skipped ({e})")
+
+    reference = next((r for r in results if r["model"] == args.reference), None)
+    for r in results:
+        for category in label_sets:
+            ref_labels = reference["top1"][category] if reference else []
+            r[f"{category}_agreement"] = round(agreement(r["top1"][category], ref_labels), 3)
+
+    print(f"\n{'model':<32} {'dim':>5} {'img/s':>8} {'load s':>7} {'RSS MB':>8} {'style agr':>10} {'subj agr':>9}")
+    for r in sorted(results, key=lambda r: -r["images_per_sec"]):
+        print(f"{r['model']:<32} {r['embedding_dim']:>5} {r['images_per_sec']:>8} {r['load_seconds']:>7} "
+              f"{r['peak_rss_delta_mb']:>8} {r['style_agreement']:>10} {r['subject_agreement']:>9}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({
+            "created_at": datetime.utcnow().isoformat(),
+            "reference": args.reference,
+            "images": len(images),
+            "batch_size": args.batch_size,
+            "threads": torch.get_num_threads(),
+            "cpu_count": os.cpu_count(),
+            "results": [{k: v for k, v in r.items() if k != "top1"} for r in results],
+        }, f, indent=2)
+    print(f"\nSaved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
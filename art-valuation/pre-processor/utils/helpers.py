@@ -1,19 +1,52 @@
 import logging
+import resource
+import sys
+import threading
 import time
+import tracemalloc
 from typing import List, Dict, Optional
 from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 import requests
 from io import BytesIO
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
 import numpy as np
 from config.settings import Config
+from core.partial_fetcher import PartialImageFetcher
+
+_fetcher: Optional[PartialImageFetcher] = None
+_fetcher_lock = threading.Lock()
 
 def setup_logging():
     """Setup logging configuration"""
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     return logging.getLogger(__name__)
 
+def get_image_fetcher() -> PartialImageFetcher:
+    """Shared thumbnail-first fetcher (one connection pool for all worker threads)"""
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = PartialImageFetcher()
+        return _fetcher
+
+def fetch_image(url: str) -> Image.Image:
+    """
+    Synchronous image download that raises on failure
+    
+    Args:
+        url: Image URL to download
+        
+    Returns:
+        PIL Image
+    """
+    if Config.PARTIAL_FETCH:
+        return get_image_fetcher().fetch(url)
+    
+    response = requests.get(url, timeout=Config.REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return Image.open(BytesIO(response.content)).convert('RGB')
+
 def download_image_sync(url: str) -> Optional[Image.Image]:
     """
     Synchronous image download
@@ -25,13 +58,52 @@ def download_image_sync(url: str) -> Optional[Image.Image]:
         PIL Image or None if download fails
     """
     try:
-        response = requests.get(url, timeout=Config.REQUEST_TIMEOUT)
-        response.raise_for_status()
-        return Image.open(BytesIO(response.content)).convert('RGB')
+        return fetch_image(url)
     except Exception as e:
         print(f"Error downloading {url}: {e}")
         return None
 
+def log_fetch_report(logger):
+    """
+    Log bytes fetched and saved per host by the partial fetcher
+    
+    Args:
+        logger: Logger to write to
+    """
+    if _fetcher is None:
+        return
+    mb = 1024 * 1024
+    for host, stats in sorted(_fetcher.stats.report().items()):
+        logger.info(
+            f"{host}: {stats['images']} images, fetched {stats['bytes_fetched'] / mb:.1f} MB, "
+            f"saved {stats['bytes_saved'] / mb:.1f} MB "
+            f"(exif={stats['exif']}, progressive={stats['progressive']}, "
+            f"stream={stats['stream']}, full={stats['full']})"
+        )
+
+def classify_error(exc: Exception) -> str:
+    """
+    Map an exception to a coarse error class for failure tracking
+    
+    Args:
+        exc: Exception raised while downloading or processing an image
+        
+    Returns:
+        Error class such as 'timeout', 'connection', 'http_404' or 'decode'
+    """
+    if isinstance(exc, requests.exceptions.Timeout):
+        return 'timeout'
+    if isinstance(exc, requests.exceptions.HTTPError):
+        status = getattr(exc.response, 'status_code', None)
+        return f'http_{status}' if status else 'http'
+    if isinstance(exc, requests.exceptions.ConnectionError):
+        return 'connection'
+    if isinstance(exc, requests.exceptions.RequestException):
+        return 'request'
+    if isinstance(exc, (UnidentifiedImageError, Image.DecompressionBombError)):
+        return 'decode'
+    return 'processing'
+
 def process_batch(batch: List[Dict], process_function, max_workers: int = None) -> List:
     """
     Process a batch of items using ThreadPoolExecutor
@@ -64,7 +136,11 @@ def create_mongodb_indexes(collection):
         [("metadata.caption", "text")],
         [("metadata.composition.background", 1)],
         [("metadata.lighting", 1)],
-        [("metadata.texture", 1)]
+        [("metadata.texture", 1)],
+        [("processing_failure.next_retry_at", 1)],
+        [("processed_at", 1)],
+        [("updated_at", 1)],
+        [("metadata.taxonomy_tags.path", 1)]
     ]
     
     for index in indexes:
@@ -73,4 +149,46 @@ def create_mongodb_indexes(collection):
         except:
             pass  # Index might already exist
     
-    print("MongoDB indexes created/verified")
\ No newline at end of file
+    print("MongoDB indexes created/verified")
+
+def get_rss_bytes() -> int:
+    """
+    Current resident set size of this process
+
+    Returns:
+        RSS in bytes (0 if it cannot be determined)
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return 0
+
+def get_peak_rss_bytes() -> int:
+    """
+    Peak resident set size of this process since start
+
+    Returns:
+        Peak RSS in bytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def memory_snapshot() -> Dict:
+    """
+    Collect RSS and (if tracing) tracemalloc figures in megabytes
+
+    Returns:
+        Dictionary of memory statistics
+    """
+    mb = 1024 * 1024
+    snapshot = {
+        "rss_mb": round(get_rss_bytes() / mb, 1),
+        "peak_rss_mb": round(get_peak_rss_bytes() / mb, 1)
+    }
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot["traced_mb"] = round(current / mb, 1)
+        snapshot["traced_peak_mb"] = round(peak / mb, 1)
+    return snapshot
\ No newline at end of file